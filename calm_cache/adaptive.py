@@ -0,0 +1,194 @@
+"Adaptive mint period and jitter for CalmCache"
+
+import math
+import threading
+from collections import OrderedDict
+
+
+# Prefix of keys without a prefix, and of new prefixes once `max_prefixes`
+# are tracked
+OTHER_PREFIX = '*'
+
+
+def key_prefix_of(key, separator=':', default=None):
+    """
+    Returns the part of the user-supplied key before the first `separator`,
+    or `default` if it's given and the key has no `separator`
+    """
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', 'replace')
+    elif not isinstance(key, str):
+        key = str(key)
+    prefix, found, _ = key.partition(separator)
+    if not found and default is not None:
+        return default
+    return prefix
+
+
+class PrefixStats(object):
+    """
+    Lightweight statistics on all keys sharing the same prefix.
+
+    Read and stale serve rates are measured over windows of `window` seconds,
+    regeneration time is the exponentially weighted moving average of time
+    between a miss and the following `set()` of the same key. Shared by all
+    threads, so updates are made under `lock`.
+    """
+
+    # Weight of the newest sample in regeneration time average
+    alpha = 0.2
+    # Maximum number of keys awaiting regeneration tracked per prefix, the
+    # oldest are dropped to make room for new misses
+    max_pending = 1000
+    # Misses not followed by `set()` within this many seconds are dropped
+    max_pending_age = 300
+
+    def __init__(self, now, window):
+        self.window = window
+        self.window_start = now
+        self.window_reads = 0
+        self.window_stale = 0
+        self.read_rate = None
+        self.stale_rate = None
+        self.reads = 0
+        self.stale_serves = 0
+        self.regenerations = 0
+        self.regen_time = None
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _roll(self, now):
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+        self.read_rate = float(self.window_reads) / elapsed
+        self.stale_rate = float(self.window_stale) / elapsed
+        self.window_start = now
+        self.window_reads = 0
+        self.window_stale = 0
+
+    def record_read(self, now):
+        with self.lock:
+            self._roll(now)
+            self.reads += 1
+            self.window_reads += 1
+
+    def record_stale(self, now):
+        with self.lock:
+            self.stale_serves += 1
+            self.window_stale += 1
+
+    def record_miss(self, key, now):
+        with self.lock:
+            if key in self.pending:
+                return
+            # Misses are kept in the order they happened, so the stale ones
+            # and the oldest are at the front
+            pending = self.pending
+            while pending and (len(pending) >= self.max_pending or
+                               now - next(iter(pending.values())) >
+                               self.max_pending_age):
+                pending.popitem(last=False)
+            pending[key] = now
+
+    def record_set(self, key, now):
+        with self.lock:
+            started = self.pending.pop(key, None)
+            if started is None:
+                return
+            sample = max(now - started, 0)
+            self.regenerations += 1
+            if self.regen_time is None:
+                self.regen_time = sample
+            else:
+                self.regen_time += self.alpha * (sample - self.regen_time)
+
+    def current_read_rate(self, now):
+        if self.read_rate is not None:
+            return self.read_rate
+        return float(self.window_reads) / max(now - self.window_start, 1)
+
+    def current_stale_rate(self, now):
+        if self.stale_rate is not None:
+            return self.stale_rate
+        return float(self.window_stale) / max(now - self.window_start, 1)
+
+
+class AdaptiveTuner(object):
+    """
+    Chooses mint period and jitter per key prefix within configured bounds:
+
+     * mint period covers `mint_factor` times the regeneration time, and,
+       if stale values are being served in the grace period, the average
+       interval between reads, so that the next read after the refresh time
+       regenerates the value while others are still served from the cache
+     * jitter is `jitter_factor` times the regeneration time, spreading
+       expiry of expensive keys wider
+    """
+
+    mint_factor = 2
+    jitter_factor = 10
+    # Maximum number of prefixes with their own statistics
+    max_prefixes = 1000
+
+    def __init__(self, min_mint_period, max_mint_period, min_jitter,
+                 max_jitter, separator=':', window=60):
+        self.min_mint_period = min_mint_period
+        self.max_mint_period = max(max_mint_period, min_mint_period)
+        self.min_jitter = min_jitter
+        self.max_jitter = max(max_jitter, min_jitter)
+        self.separator = separator
+        self.window = window
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get_stats(self, key, now):
+        """
+        Returns statistics of the prefix of `key`. Keys without a prefix,
+        such as ones of `cache_response`, share `OTHER_PREFIX` statistics
+        """
+        prefix = key_prefix_of(key, self.separator, OTHER_PREFIX)
+        stats = self.stats.get(prefix)
+        if stats is None:
+            with self.lock:
+                if prefix not in self.stats and \
+                        len(self.stats) >= self.max_prefixes:
+                    prefix = OTHER_PREFIX
+                stats = self.stats.get(prefix)
+                if stats is None:
+                    stats = self.stats[prefix] = PrefixStats(now,
+                                                             self.window)
+        return stats
+
+    @staticmethod
+    def _clamp(value, low, high):
+        return int(min(max(math.ceil(value), low), high))
+
+    def mint_period(self, stats, now):
+        if stats.regen_time is None:
+            return self.min_mint_period
+        mint_period = stats.regen_time * self.mint_factor
+        read_rate = stats.current_read_rate(now)
+        if stats.current_stale_rate(now) > 0 and read_rate > 0:
+            mint_period = max(mint_period, 1.0 / read_rate)
+        return self._clamp(mint_period, self.min_mint_period,
+                           self.max_mint_period)
+
+    def jitter(self, stats):
+        if stats.regen_time is None:
+            return self.min_jitter
+        return self._clamp(stats.regen_time * self.jitter_factor,
+                           self.min_jitter, self.max_jitter)
+
+    def describe(self, prefix, now):
+        stats = self.stats[prefix]
+        with stats.lock:
+            return {
+                'mint_period': self.mint_period(stats, now),
+                'jitter': self.jitter(stats),
+                'reads': stats.reads,
+                'read_rate': stats.current_read_rate(now),
+                'regenerations': stats.regenerations,
+                'regen_time': stats.regen_time,
+                'stale_serves': stats.stale_serves,
+            }
@@ -0,0 +1,20 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, m2m_changed
+
+
+class CalmCacheConfig(AppConfig):
+    name = 'calm_cache'
+    verbose_name = "Calm Cache"
+
+    def ready(self):
+        from calm_cache.orm import ORM_SIGNALS, _invalidate_on_change
+        if not ORM_SIGNALS:
+            # Don't add cache round trips to every model write unless
+            # queryset caching is used
+            return
+        post_save.connect(_invalidate_on_change,
+                          dispatch_uid='calm_cache.orm.post_save')
+        post_delete.connect(_invalidate_on_change,
+                            dispatch_uid='calm_cache.orm.post_delete')
+        m2m_changed.connect(_invalidate_on_change,
+                            dispatch_uid='calm_cache.orm.m2m_changed')
@@ -1,2 +1,4 @@
-from .calmcache import CalmCache
+from .calmcache import CalmCache, NEGATIVE
 from .memcached import MemcachedCache, PyLibMCCache
+from .metacache import MetaMemcachedCache
+from .mmapcache import MmapCache
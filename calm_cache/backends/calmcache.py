@@ -1,10 +1,57 @@
 "Calm cache backend"
 
+import atexit
+import pickle
 import time
 import random
+import threading
 
 from django.core.cache import caches
-from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.base import BaseCache, InvalidCacheKey
+from django.core.exceptions import ImproperlyConfigured
+
+from calm_cache.adaptive import AdaptiveTuner, OTHER_PREFIX, key_prefix_of
+from calm_cache.breaker import CircuitBreaker, LocalFallback
+from calm_cache.hashring import HashRing
+from calm_cache.hotkeys import HotKeys
+from calm_cache.memo import get_memo
+from calm_cache.sizes import (
+    SizeAccounting, max_entry_size, recording, serialize)
+from calm_cache.snapshot import dump_snapshot, load_snapshot
+
+
+# Django creates a backend instance per thread, so the state that has to be
+# seen by all of them is kept in this per-process registry
+_shared_state = {}
+_shared_state_lock = threading.Lock()
+
+
+class _Negative(object):
+    """
+    Type of `NEGATIVE`, a falsy value that is pickled by reference, so it
+    stays the same object when read from any backend
+    """
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return 'NEGATIVE'
+
+    def __reduce__(self):
+        return 'NEGATIVE'
+
+
+# Stored by `CalmCache.set_negative()` to remember that there is nothing
+NEGATIVE = _Negative()
+
+# Name of the key storing namespace generation, the generation of
+# a key prefix is stored under this name followed by `:` and the prefix
+GENERATION_KEY = '__generation__'
+
+# Maximum number of generations cached by a process
+MAX_GENERATIONS = 1000
 
 
 class CalmCache(BaseCache):
@@ -23,6 +70,9 @@ class CalmCache(BaseCache):
                     'MINT_PERIOD': 10,
                     'GRACE_PERIOD': 120,
                     'JITTER': 10,
+                    'ADAPTIVE': True,
+                    'MAX_MINT_PERIOD': 60,
+                    'MAX_JITTER': 60,
                 }
             },
             'my_cache': {
@@ -31,6 +81,31 @@ class CalmCache(BaseCache):
             }
 
         }
+
+    `LOCATION` could also be a list of backend names, in which case keys are
+    distributed among them using consistent hashing:
+
+        CACHES = {
+            'default': {
+                'BACKEND' : 'calm_cache.backends.CalmCache',
+                'LOCATION': ['cache_a', 'cache_b', 'cache_c'],
+                'OPTIONS': {
+                    'WEIGHTS': {'cache_c': 2},
+                    'REPLICAS': 2,
+                    'REPLICATED_PREFIXES': ('article:', 'front-page'),
+                }
+            },
+            ...
+        }
+
+    When `LOCATION` is a `LocMemCache`, its most recently used entries could
+    be saved on exit and loaded on start:
+
+        'OPTIONS': {
+            'MINT_PERIOD': 10,
+            'SNAPSHOT_PATH': '/var/tmp/django-cache.snapshot',
+            'SNAPSHOT_SIZE': 1000,
+        }
     """
 
     def __init__(self, real_cache, params):
@@ -40,32 +115,307 @@ class CalmCache(BaseCache):
         self.mint_period = int(options.get('MINT_PERIOD', 0))
         self.grace_period = int(options.get('GRACE_PERIOD', 0))
         self.jitter = int(options.get('JITTER', 0))
+        self.adaptive = bool(options.get('ADAPTIVE', False))
+        self.counter_prefix = options.get('COUNTER_PREFIX', '__counter__:')
+        self.negative_timeout = int(options.get('NEGATIVE_TIMEOUT', 60))
+        self.negative_jitter = int(options.get('NEGATIVE_JITTER', self.jitter))
+        self.prefix_separator = options.get('PREFIX_SEPARATOR', ':')
+        self.namespaced_clear = bool(options.get('NAMESPACED_CLEAR', False))
+        self.generation_ttl = float(options.get('GENERATION_TTL', 5))
+        self.request_memo = bool(options.get('REQUEST_MEMO', True))
+        self.size_accounting = bool(options.get('SIZE_ACCOUNTING', False))
+        self.max_entry_size = options.get('MAX_ENTRY_SIZE')
 
         self.time_func = time.time
         self.rand_func = random.randint
 
-        self.cache = caches[real_cache]
+        if isinstance(real_cache, (list, tuple)):
+            real_cache = tuple(real_cache)
+        else:
+            real_cache = (real_cache, )
+        self.caches = dict((alias, caches[alias]) for alias in real_cache)
+        # Primary backend, the only one unless there are several locations
+        self.location = real_cache[0]
+        self.cache = self.caches[self.location]
+        self.ring = None
+        if len(real_cache) > 1:
+            weights = options.get('WEIGHTS', {})
+            self.ring = HashRing(
+                dict((alias, weights.get(alias, 1)) for alias in real_cache),
+                vnodes=int(options.get('VIRTUAL_NODES', 160)))
+        # Let backends supporting it handle mint period on their side
+        self.server_side_stale = all(
+            getattr(cache, 'supports_stale_while_revalidate', False)
+            for cache in self.caches.values())
+        self.replicas = int(options.get('REPLICAS', 1))
+        self.replicated_prefixes = tuple(options.get('REPLICATED_PREFIXES',
+                                                     ()))
+
+        self.shared = _shared_state.setdefault(
+            (real_cache, self.key_prefix, self.version,
+             repr(sorted(options.items()))), {})
+        # Callables receiving `(key, version)` of every `get()`
+        self.access_hooks = self.shared.setdefault('access_hooks', [])
+        self.sizes = self.shared.setdefault('sizes', SizeAccounting())
+
+        self.tuner = None
+        if self.adaptive:
+            self.tuner = self.shared.setdefault('tuner', AdaptiveTuner(
+                self.mint_period,
+                int(options.get('MAX_MINT_PERIOD', self.mint_period)),
+                self.jitter,
+                int(options.get('MAX_JITTER', self.jitter)),
+                separator=self.prefix_separator,
+                window=int(options.get('ADAPTIVE_WINDOW', 60)),
+            ))
+
+        self.breakers = {}
+        # Local copies of recent values, set only when failing open
+        self.fallback = None
+        breaker_options = options.get('CIRCUIT_BREAKER')
+        if breaker_options is not None:
+            slow_call = breaker_options.get('SLOW_CALL')
+            if slow_call is not None:
+                slow_call = float(slow_call)
+            self.breakers = self.shared.setdefault('breakers', dict(
+                (alias, CircuitBreaker(
+                    error_rate=float(breaker_options.get('ERROR_RATE', 0.5)),
+                    window=int(breaker_options.get('WINDOW', 20)),
+                    min_calls=int(breaker_options.get('MIN_CALLS', 5)),
+                    slow_call=slow_call,
+                    cool_down=float(breaker_options.get('COOL_DOWN', 10)),
+                    probes=int(breaker_options.get('PROBES', 1)),
+                    # Missing keys of `incr()` and bad keys aren't failures
+                    ignore=(ValueError, InvalidCacheKey),
+                )) for alias in real_cache))
+            self.fallback = self.shared.setdefault('fallback', LocalFallback(
+                int(breaker_options.get('FALLBACK_SIZE', 1000))))
+
+        # Detector of the most read keys with their local copies
+        self.hot = None
+        hot_options = options.get('HOT_KEYS')
+        if hot_options is not None:
+            self.hot = self.shared.setdefault('hot_keys', HotKeys(
+                sample_rate=float(hot_options.get('SAMPLE_RATE', 0.01)),
+                top_k=int(hot_options.get('TOP_K', 20)),
+                threshold=float(hot_options.get('THRESHOLD', 50)),
+                window=float(hot_options.get('WINDOW', 10)),
+                local_ttl=float(hot_options.get('LOCAL_TTL', 1)),
+            ))
+
+        self.snapshot_path = options.get('SNAPSHOT_PATH')
+        self.snapshot_size = int(options.get('SNAPSHOT_SIZE', 1000))
+        if self.snapshot_path:
+            if len(self.caches) > 1:
+                raise ImproperlyConfigured(
+                    "SNAPSHOT_PATH requires a single LOCATION")
+            with _shared_state_lock:
+                if 'snapshot_loaded' not in self.shared:
+                    self.shared['snapshot_loaded'] = load_snapshot(
+                        self.cache, self.snapshot_path)
+                    atexit.register(self._dump_snapshot_at_exit)
+
+    def _new_generation(self):
+        # Never goes back if the generation key is evicted
+        return int(time.time() * 1000)
+
+    def _generation(self, name):
+        """
+        Returns the generation stored under `name`, read from the real
+        cache at most once per `GENERATION_TTL` seconds
+        """
+        generations = self.shared.setdefault('generations', {})
+        cached = generations.get(name)
+        now = self._time()
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        cache_key = super(CalmCache, self).make_key(name)
+        try:
+            value = self._get_raw(name, cache_key)
+            if value is None:
+                self._add_raw(name, cache_key, self._new_generation(), None)
+                value = self._get_raw(name, cache_key)
+        except Exception:
+            value = None
+        if value is None:
+            return cached[0] if cached is not None else 0
+        self._cache_generation(name, value)
+        return value
+
+    def _cache_generation(self, name, value):
+        """
+        Caches generation `name` for `GENERATION_TTL` seconds, dropping
+        expired and then the oldest ones beyond `MAX_GENERATIONS`
+        """
+        generations = self.shared.setdefault('generations', {})
+        now = self._time()
+        with _shared_state_lock:
+            generations.pop(name, None)
+            if len(generations) >= MAX_GENERATIONS:
+                for cached_name, cached in list(generations.items()):
+                    if cached[1] <= now:
+                        del generations[cached_name]
+                while len(generations) >= MAX_GENERATIONS:
+                    del generations[next(iter(generations))]
+            generations[name] = (value, now + self.generation_ttl)
+
+    def _bump_generation(self, name):
+        cache_key = super(CalmCache, self).make_key(name)
+        alias = self._backends(name, cache_key)[0]
+        try:
+            value = self._call(alias, 'incr', cache_key)
+        except ValueError:
+            value = self._new_generation()
+            self._write_raw(name, cache_key, 'set', value, timeout=None)
+        self._cache_generation(name, value)
+
+    def make_key(self, key, version=None):
+        if self.namespaced_clear:
+            prefix_generation = ''
+            # Keys without a prefix don't get a generation of their own
+            if isinstance(key, str) and self.prefix_separator in key:
+                prefix = key_prefix_of(key, self.prefix_separator)
+                prefix_generation = self._generation(
+                    '%s:%s' % (GENERATION_KEY, prefix))
+            key = '%s:%s:%s' % (self._generation(GENERATION_KEY),
+                                prefix_generation, key)
+        return super(CalmCache, self).make_key(key, version=version)
 
     @property
     def packing_enabled(self):
+        if self.server_side_stale:
+            return False
         return self.mint_period > 0 or self.grace_period > 0
 
     @property
     def has_jitter(self):
         return self.jitter > 0
 
-    def get_jitter(self):
-        if not self.has_jitter:
+    def get_jitter(self, key=None, jitter=None):
+        if jitter is None:
+            jitter = self.jitter
+            if self.tuner is not None and key is not None:
+                jitter = self.tuner.jitter(self._stats(key))
+        if jitter <= 0:
             return 0
-        return self.rand_func(0, self.jitter)
+        return self.rand_func(0, jitter)
+
+    def get_mint_period(self, key=None):
+        if self.tuner is None or key is None:
+            return self.mint_period
+        return self.tuner.mint_period(self._stats(key), self._time())
+
+    def _stats(self, key):
+        return self.tuner.get_stats(key, self._time())
+
+    def tuning(self, prefix=None):
+        """
+        Returns a dictionary with mint period and jitter chosen for
+        the given key prefix along with the statistics they are based on.
+        If `prefix` is not specified, returns a dictionary of such
+        dictionaries for all prefixes seen so far
+        """
+        if self.tuner is None:
+            return {} if prefix is None else None
+        now = self._time()
+        if prefix is not None:
+            if prefix not in self.tuner.stats:
+                return None
+            return self.tuner.describe(prefix, now)
+        return dict((p, self.tuner.describe(p, now))
+                    for p in list(self.tuner.stats))
 
     def _time(self):
         return self.time_func()
 
-    def _pack_value(self, value, timeout, refreshing=False):
-        if not self.packing_enabled:
+    def is_counter(self, key):
+        """
+        Returns `True` if `key` belongs to the counters namespace: such values
+        are stored as they are, without packing and jitter
+        """
+        return bool(self.counter_prefix) and isinstance(key, str) and \
+            key.startswith(self.counter_prefix)
+
+    def _memo(self, key):
+        """
+        Returns `RequestMemo` of the current request if `key` is memoized
+        """
+        if not self.request_memo or self.is_counter(key):
+            return None
+        return get_memo()
+
+    def _memoize(self, key, cache_key, value):
+        """
+        Remembers `value` of `key` in the request memo. Misses (`None`) are
+        not remembered, so polling a key sees values stored by others.
+        Values are kept pickled like in the cache, so changes of the caller's
+        object don't leak into later lookups
+        """
+        memo = self._memo(key)
+        if memo is not None:
+            if value is None:
+                memo.values(id(self.shared)).pop(cache_key, None)
+            else:
+                memo.values(id(self.shared))[cache_key] = serialize(value)
+
+    def _forget(self, key, cache_key):
+        memo = self._memo(key)
+        if memo is not None:
+            memo.values(id(self.shared)).pop(cache_key, None)
+
+    def _drop_local(self, cache_key):
+        """
+        Removes the local copy of a hot key being changed
+        """
+        if self.hot is not None:
+            self.hot.local.delete(cache_key)
+
+    def _check_size(self, key, value):
+        """
+        Records serialized size of `value` under its key prefix, returns
+        `False` if it exceeds `MAX_ENTRY_SIZE` and must not be stored. Keys
+        without a prefix are grouped under `OTHER_PREFIX`
+        """
+        if self.is_counter(key):
+            return True
+        record = self.size_accounting or recording()
+        if self.max_entry_size is None and not record:
+            return True
+        prefix = key_prefix_of(key, self.prefix_separator, OTHER_PREFIX)
+        limit = max_entry_size(self.max_entry_size, prefix)
+        if limit is None and not record:
+            return True
+        data = serialize(value)
+        if limit is not None and len(data) > limit:
+            self.sizes.reject(prefix, key, len(data))
+            return False
+        if record:
+            self.sizes.record(prefix, key, data)
+        return True
+
+    def size_stats(self, prefix=None):
+        """
+        Returns a dictionary with numbers and sizes of values written and
+        rejected for the given key prefix, or a dictionary of such
+        dictionaries for all prefixes, if `prefix` is not specified
+        """
+        return self.sizes.stats(prefix)
+
+    def hot_keys(self):
+        """
+        Returns a list of `(key, estimated reads per second)` of keys found
+        hot in this process during the last window, the hottest first
+        """
+        if self.hot is None:
+            return []
+        return self.hot.hot_keys()
+
+    def _pack_value(self, value, timeout, refreshing=False, key=None,
+                    jitter=None):
+        if not self.packing_enabled or self.is_counter(key):
             return value
-        return (value, self._time() + timeout + self.get_jitter(), refreshing)
+        return (value, self._time() + timeout + self.get_jitter(key, jitter),
+                refreshing)
 
     def _unpack_value(self, value):
         if value is None:
@@ -74,46 +424,437 @@ class CalmCache(BaseCache):
             return (value, 0, True)
         return value
 
-    def _get_real_timeout(self, timeout):
-        return timeout + self.mint_period + self.grace_period + self.get_jitter()
+    def _backends(self, key, cache_key):
+        """
+        Returns the list of names of backends storing `key`,
+        the primary one first
+        """
+        if self.ring is None:
+            return [self.location]
+        count = 1
+        if self.replicated_prefixes and isinstance(key, str) and \
+                key.startswith(self.replicated_prefixes):
+            count = self.replicas
+        return self.ring.get_nodes(cache_key, count)
+
+    def _call(self, alias, method, *args, **kwargs):
+        """
+        Calls `method` of the backend `alias` through its circuit breaker
+        """
+        func = getattr(self.caches[alias], method)
+        breaker = self.breakers.get(alias)
+        if breaker is None:
+            return func(*args, **kwargs)
+        return breaker.call(func, *args, **kwargs)
+
+    def _read_raw(self, key, cache_key, method, version=None, **kwargs):
+        """
+        Calls `method` (`get`, `get_stale` or `has_key`) on the backends
+        storing `key`, trying replicas in turn if the primary backend fails
+        or does not have the key
+        """
+        error = None
+        result = None
+        for alias in self._backends(key, cache_key):
+            try:
+                result = self._call(alias, method, cache_key, version=version,
+                                    **kwargs)
+            except Exception as e:
+                error = e
+                continue
+            if result is not None and result is not False:
+                if self.fallback is not None and method != 'has_key':
+                    self.fallback.set(cache_key, result[0]
+                                      if method == 'get_stale' else result)
+                return result
+            error = None
+        if error is not None:
+            if self.fallback is None:
+                raise error
+            # Fail open serving the local copy, if any
+            result = self.fallback.get(cache_key)
+            if method == 'has_key':
+                result = result is not None
+            elif method == 'get_stale' and result is not None:
+                result = (result, False)
+        return result
+
+    def _get_raw(self, key, cache_key, version=None):
+        return self._read_raw(key, cache_key, 'get', version=version)
+
+    def _write_raw(self, key, cache_key, method, *args, **kwargs):
+        """
+        Calls `method` on every backend storing `key`, failing only if all
+        of them fail. Returns the result of the first successful call
+        """
+        if self.fallback is not None:
+            if method == 'set':
+                self.fallback.set(cache_key, args[0])
+            else:
+                self.fallback.delete(cache_key)
+        error = None
+        result = None
+        succeeded = False
+        for alias in self._backends(key, cache_key):
+            try:
+                r = self._call(alias, method, cache_key, *args, **kwargs)
+            except Exception as e:
+                error = e
+                continue
+            if not succeeded:
+                result, succeeded = r, True
+        if not succeeded and error is not None and self.fallback is None:
+            raise error
+        return result
+
+    def _add_raw(self, key, cache_key, value, timeout, version=None):
+        aliases = self._backends(key, cache_key)
+        try:
+            added = self._call(aliases[0], 'add', cache_key, value,
+                               timeout=timeout, version=version)
+        except Exception:
+            if self.fallback is None:
+                raise
+            return False
+        if added:
+            if self.fallback is not None:
+                self.fallback.set(cache_key, value)
+            for alias in aliases[1:]:
+                try:
+                    self._call(alias, 'set', cache_key, value,
+                               timeout=timeout, version=version)
+                except Exception:
+                    pass
+        return added
+
+    def breaker_stats(self):
+        """
+        Returns a dictionary with circuit breaker state and counters
+        for every backend
+        """
+        return dict((alias, breaker.stats())
+                    for alias, breaker in self.breakers.items())
+
+    def _snapshot_refresh_time(self, pickled):
+        if not self.packing_enabled:
+            return 0
+        value = pickle.loads(pickled)
+        # Counters, generations and values written straight to the backend
+        # are not packed
+        if isinstance(value, tuple) and len(value) == 3 and \
+                isinstance(value[1], (int, float)):
+            return value[1]
+        return 0
+
+    def dump_snapshot(self):
+        """
+        Writes `SNAPSHOT_SIZE` most recently used entries of the backend
+        with their refresh times to `SNAPSHOT_PATH`, so that they are
+        loaded by the next process starting with the same configuration.
+        Returns the number of entries written.
+        """
+        return dump_snapshot(self.cache, self.snapshot_path,
+                             self.snapshot_size, self._snapshot_refresh_time)
+
+    def _dump_snapshot_at_exit(self):
+        try:
+            self.dump_snapshot()
+        except (IOError, OSError):
+            pass
+
+    def _get_real_timeout(self, timeout, key=None, jitter=None):
+        if self.is_counter(key):
+            return timeout
+        return (timeout + self.get_mint_period(key) + self.grace_period +
+                self.get_jitter(key, jitter))
 
     def add(self, key, value, timeout=None, version=None):
         cache_key = self.make_key(key, version=version)
         timeout = timeout or self.default_timeout
-        value = self._pack_value(value, timeout)
-        return self.cache.add(cache_key, value, timeout=self._get_real_timeout(timeout), version=version)
+        if not self._check_size(key, value):
+            return False
+        if self.tuner is not None:
+            self._stats(key).record_set(key, self._time())
+        packed = self._pack_value(value, timeout, key=key)
+        added = self._add_raw(key, cache_key, packed, self._get_real_timeout(timeout, key), version=version)
+        self._drop_local(cache_key)
+        if added:
+            self._memoize(key, cache_key, value)
+        else:
+            self._forget(key, cache_key)
+        return added
 
-    def set(self, key, value, timeout=None, version=None, refreshing=False):
+    def set(self, key, value, timeout=None, version=None, refreshing=False,
+            jitter=None):
         cache_key = self.make_key(key, version=version)
         timeout = timeout or self.default_timeout
-        value = self._pack_value(value, timeout, refreshing=refreshing)
-        self.cache.set(cache_key, value, timeout=self._get_real_timeout(timeout), version=version)
+        if not refreshing and not self._check_size(key, value):
+            # Don't leave the old value behind
+            self.delete(key, version=version)
+            return
+        if self.tuner is not None and not refreshing:
+            self._stats(key).record_set(key, self._time())
+        self._memoize(key, cache_key, value)
+        self._drop_local(cache_key)
+        value = self._pack_value(value, timeout, refreshing=refreshing, key=key,
+                                 jitter=jitter)
+        self._write_raw(key, cache_key, 'set', value, timeout=self._get_real_timeout(timeout, key, jitter), version=version)
+
+    def set_negative(self, key, timeout=None, version=None):
+        """
+        Remembers that there is nothing to cache for `key`: `get()` returns
+        `NEGATIVE` instead of the default value until it expires in
+        `timeout` (Default: `NEGATIVE_TIMEOUT`) plus up to `NEGATIVE_JITTER`
+        seconds
+        """
+        self.set(key, NEGATIVE, timeout or self.negative_timeout,
+                 version=version, jitter=self.negative_jitter)
+
+    def _record_read(self, key, version):
+        """
+        Calls access hooks and returns statistics of the key prefix, if any
+        """
+        for hook in self.access_hooks:
+            hook(key, version)
+        stats = None
+        if self.tuner is not None:
+            stats = self._stats(key)
+            stats.record_read(self._time())
+        return stats
 
     def get(self, key, default=None, version=None):
         cache_key = self.make_key(key, version=version)
-        value = self.cache.get(cache_key, default=None, version=version)
+        memo = self._memo(key)
+        if memo is not None:
+            values = memo.values(id(self.shared))
+            if cache_key in values:
+                memo.hits += 1
+                return pickle.loads(values[cache_key])
+            memo.misses += 1
+        hot = self.hot is not None and not self.is_counter(key)
+        if hot:
+            now = self._time()
+            self.hot.record(key, now)
+            value = self.hot.get_local(key, cache_key, now)
+            if value is not None:
+                self._memoize(key, cache_key, value)
+                return value
+        stats = self._record_read(key, version)
+        mint_period = self.get_mint_period(key)
+        if self.server_side_stale and mint_period + self.grace_period > 0 \
+                and not self.is_counter(key):
+            value = self._get_stale(key, cache_key, None, version,
+                                    mint_period + self.grace_period, stats)
+        else:
+            value = self._get_raw(key, cache_key, version=version)
+            value = self._process_value(key, cache_key, value, None, version,
+                                        stats)
+        self._memoize(key, cache_key, value)
+        if hot:
+            self.hot.set_local(key, cache_key, value, now)
+        return default if value is None else value
+
+    def _process_value(self, key, cache_key, value, default, version, stats):
+        """
+        Returns the value to serve for raw `value` read from the real cache
+        performing mint period and grace period logic
+        """
         if value is None:
+            if stats is not None:
+                stats.record_miss(key, self._time())
             return default
+        if not self.packing_enabled or self.is_counter(key):
+            return value
+        mint_period = self.get_mint_period(key)
         value, refresh_time, refreshing = self._unpack_value(value)
         now = self._time()
-        if now > (refresh_time + self.mint_period):
+        if now > (refresh_time + mint_period):
             # We are beyond minting period, remove the object and return stale
-            self.cache.delete(cache_key)
+            self._write_raw(key, cache_key, 'delete', version=version)
+            if stats is not None:
+                stats.record_stale(now)
+                stats.record_miss(key, now)
             return value
         if (now > refresh_time) and not refreshing:
             # We are in the mint period, allow serving stale while revalidating
             # Use user-supplied key here, so it will be transformed in set()
-            self.set(key, value, timeout=self.mint_period, version=version, refreshing=True)
+            self.set(key, value, timeout=mint_period, version=version, refreshing=True)
+            if stats is not None:
+                stats.record_miss(key, now)
+            return None
+        return value
+
+    def get_many(self, keys, version=None):
+        """
+        Fetches all keys with a single `get_many()` call per backend and
+        processes every value like `get()` does
+        """
+        if self.server_side_stale:
+            return super(CalmCache, self).get_many(keys, version=version)
+        result = {}
+        cache_keys = []
+        groups = {}
+        replicated = set()
+        for key in keys:
+            cache_key = self.make_key(key, version=version)
+            memo = self._memo(key)
+            if memo is not None:
+                values = memo.values(id(self.shared))
+                if cache_key in values:
+                    memo.hits += 1
+                    result[key] = pickle.loads(values[cache_key])
+                    continue
+                memo.misses += 1
+            aliases = self._backends(key, cache_key)
+            cache_keys.append((key, cache_key, aliases))
+            groups.setdefault(aliases[0], []).append(cache_key)
+            if len(aliases) > 1:
+                replicated.add(cache_key)
+        found = {}
+        for alias, group in groups.items():
+            try:
+                found.update(self._call(alias, 'get_many', group,
+                                        version=version))
+            except Exception:
+                if self.fallback is None:
+                    if not replicated.issuperset(group):
+                        raise
+                    # All of them are read from replicas below
+                    continue
+                # Fail open serving local copies
+                for cache_key in group:
+                    value = self.fallback.get(cache_key)
+                    if value is not None:
+                        found[cache_key] = value
+                continue
+            if self.fallback is not None:
+                for cache_key in group:
+                    if cache_key in found:
+                        self.fallback.set(cache_key, found[cache_key])
+        for key, cache_key, aliases in cache_keys:
+            stats = self._record_read(key, version)
+            value = found.get(cache_key)
+            if value is None and len(aliases) > 1:
+                # Try replicas
+                value = self._get_raw(key, cache_key, version=version)
+            value = self._process_value(key, cache_key, value, None, version,
+                                        stats)
+            self._memoize(key, cache_key, value)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def _get_stale(self, key, cache_key, default, version, recache, stats):
+        """
+        `get()` for backends supporting stale-while-revalidate: the first
+        client reading the value during the last `recache` seconds of its TTL
+        gets a miss and refreshes it, others get the stale value
+        """
+        result = self._read_raw(key, cache_key, 'get_stale', version=version,
+                                recache=recache)
+        if result is None:
+            if stats is not None:
+                stats.record_miss(key, self._time())
+            return default
+        value, win = result
+        if win:
+            if stats is not None:
+                stats.record_miss(key, self._time())
+            return default
+        return value
+
+    def get_refresh_time(self, key, version=None):
+        """
+        Returns the time when the value stored under `key` becomes stale,
+        `0` if it is unknown (packing is disabled) or `None` if there
+        is no such key
+        """
+        cache_key = self.make_key(key, version=version)
+        value = self._get_raw(key, cache_key, version=version)
+        if value is None:
             return None
+        return self._unpack_value(value)[1]
+
+    def incr(self, key, delta=1, version=None):
+        """
+        Atomically increments counters (keys starting with `COUNTER_PREFIX`)
+        and all values when packing is disabled using the backend's `incr`.
+        Other values are incremented with non-atomic get and set.
+        Counters are kept on the primary backend only.
+        """
+        if self.packing_enabled and not self.is_counter(key):
+            return super(CalmCache, self).incr(key, delta, version=version)
+        cache_key = self.make_key(key, version=version)
+        self._forget(key, cache_key)
+        self._drop_local(cache_key)
+        alias = self._backends(key, cache_key)[0]
+        value = self._call(alias, 'incr', cache_key, delta, version=version)
+        if self.fallback is not None:
+            self.fallback.set(cache_key, value)
         return value
 
+    def touch(self, key, timeout=None, version=None):
+        """
+        Sets new timeout of `key`, extending both the refresh time of packed
+        value and its real timeout. Returns `True` if the key exists.
+        """
+        cache_key = self.make_key(key, version=version)
+        timeout = timeout or self.default_timeout
+        if not self.packing_enabled or self.is_counter(key):
+            return bool(self._write_raw(
+                key, cache_key, 'touch',
+                timeout=self._get_real_timeout(timeout, key),
+                version=version))
+        value = self._get_raw(key, cache_key, version=version)
+        if value is None:
+            return False
+        value = self._pack_value(self._unpack_value(value)[0], timeout,
+                                 key=key)
+        self._write_raw(key, cache_key, 'set', value,
+                        timeout=self._get_real_timeout(timeout, key),
+                        version=version)
+        return True
+
     def delete(self, key, version=None):
         cache_key = self.make_key(key, version=version)
-        self.cache.delete(cache_key, version=version)
+        self._memoize(key, cache_key, None)
+        self._drop_local(cache_key)
+        self._write_raw(key, cache_key, 'delete', version=version)
 
     def has_key(self, key, version=None):
         cache_key = self.make_key(key, version=version)
-        return self.cache.has_key(cache_key, version=version)
+        return bool(self._read_raw(key, cache_key, 'has_key', version=version))
+
+    def clear_prefix(self, prefix):
+        """
+        Orphans all keys which part before the first `PREFIX_SEPARATOR` is
+        `prefix` by bumping its generation. Requires `NAMESPACED_CLEAR`
+        """
+        if not self.namespaced_clear:
+            raise ValueError("clear_prefix() requires NAMESPACED_CLEAR option")
+        self._bump_generation('%s:%s' % (GENERATION_KEY, prefix))
+        self._clear_local_copies()
+        if self.fallback is not None:
+            self.fallback.clear()
+
+    def _clear_local_copies(self):
+        memo = get_memo()
+        if memo is not None:
+            memo.values(id(self.shared)).clear()
+        if self.hot is not None:
+            self.hot.local.clear()
 
     def clear(self):
-        self.cache.clear()
+        self._clear_local_copies()
+        if self.fallback is not None:
+            self.fallback.clear()
+        if self.namespaced_clear:
+            # Orphan own keys only instead of flushing the real cache
+            self._bump_generation(GENERATION_KEY)
+            return
+        for alias in self.caches:
+            try:
+                self._call(alias, 'clear')
+            except Exception:
+                if self.fallback is None:
+                    raise
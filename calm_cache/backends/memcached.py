@@ -1,3 +1,18 @@
+import pickle
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.core.cache.backends.memcached import (
     BaseMemcachedCache,
     PyLibMCCache as DjangoPyLibMCCache)
@@ -6,6 +21,22 @@ from django.utils.functional import cached_property
 from functools import partial
 from django.conf import settings
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Header of values compressed with a zstd dictionary
+ZSTD_MAGIC = b'CCZ1'
+
+# Loaded zstd dictionaries by file path
+_zstd_dictionaries = {}
+
+# Client pools shared by backend instances of all threads
+_pools = {}
+_pools_lock = threading.Lock()
+
 
 class ZippedMCMixin(object):
     """
@@ -37,6 +68,557 @@ class ZippedMCMixin(object):
         return cache
 
 
+def load_zstd_dictionary(path):
+    """
+    Returns `zstandard.ZstdCompressionDict` read from `path`, every file is
+    read once per process
+    """
+    dictionary = _zstd_dictionaries.get(path)
+    if dictionary is None:
+        with open(path, 'rb') as f:
+            dictionary = zstandard.ZstdCompressionDict(f.read())
+        _zstd_dictionaries[path] = dictionary
+    return dictionary
+
+
+class ZstdMCMixin(object):
+    """
+    Mixin class for memcached backends compressing values with zstd
+    dictionaries trained on samples of similar values
+    (see `train_zstd_dictionary` management command).
+
+    `ZSTD_DICTIONARIES` among backend options (or Django setting
+    `MEMCACHE_ZSTD_DICTIONARIES`) maps key prefixes to dictionary file paths
+    or lists of them: values of keys starting with the longest matching
+    prefix are compressed with the first dictionary, others are kept for
+    decompression of values stored before the dictionary was replaced.
+    Compressed values are stored as `ZSTD_MAGIC` followed by zstd frame that
+    carries the dictionary id. Values that can't be decompressed are
+    treated as cache misses.
+
+    Requires `zstandard` package.
+    """
+
+    zstd_dictionaries = getattr(settings, 'MEMCACHE_ZSTD_DICTIONARIES', {})
+    zstd_level = getattr(settings, 'MEMCACHE_ZSTD_LEVEL', 3)
+    zstd_min_len = getattr(settings, 'MEMCACHE_ZSTD_MIN_LEN', 64)
+
+    def __init__(self, server, params):
+        super(ZstdMCMixin, self).__init__(server, params)
+        if self._options is not None:
+            self._options = self._options.copy()
+            self.zstd_dictionaries = self._options.pop(
+                'ZSTD_DICTIONARIES', self.zstd_dictionaries)
+            self.zstd_level = self._options.pop('ZSTD_LEVEL', self.zstd_level)
+            self.zstd_min_len = self._options.pop('ZSTD_MIN_LEN',
+                                                  self.zstd_min_len)
+        if self.zstd_dictionaries and zstandard is None:
+            raise ImproperlyConfigured(
+                "ZSTD_DICTIONARIES requires zstandard package")
+
+    @cached_property
+    def _zstd(self):
+        """
+        A tuple of a list of `(prefix, compressor)` sorted by prefix length
+        and a dictionary of decompressors by dictionary id
+        """
+        compressors = []
+        decompressors = {}
+        for prefix, paths in self.zstd_dictionaries.items():
+            if isinstance(paths, str):
+                paths = [paths]
+            for index, path in enumerate(paths):
+                dictionary = load_zstd_dictionary(path)
+                if index == 0:
+                    compressors.append((prefix, zstandard.ZstdCompressor(
+                        level=self.zstd_level, dict_data=dictionary)))
+                decompressors[dictionary.dict_id()] = \
+                    zstandard.ZstdDecompressor(dict_data=dictionary)
+        compressors.sort(key=lambda c: len(c[0]), reverse=True)
+        return compressors, decompressors
+
+    def _compress(self, key, value):
+        if not self.zstd_dictionaries:
+            return value
+        for prefix, compressor in self._zstd[0]:
+            if str(key).startswith(prefix):
+                break
+        else:
+            return value
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) < self.zstd_min_len:
+            return value
+        frame = compressor.compress(data)
+        if len(ZSTD_MAGIC) + len(frame) >= len(data):
+            return value
+        return ZSTD_MAGIC + frame
+
+    def _decompress(self, value, default=None):
+        if not isinstance(value, bytes) or not value.startswith(ZSTD_MAGIC):
+            return value
+        if zstandard is None:
+            return default
+        frame = value[len(ZSTD_MAGIC):]
+        try:
+            dict_id = zstandard.get_frame_parameters(frame).dict_id
+            decompressor = self._zstd[1].get(dict_id)
+            if decompressor is None:
+                return default
+            return pickle.loads(decompressor.decompress(frame))
+        except zstandard.ZstdError:
+            return default
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return super(ZstdMCMixin, self).add(
+            key, self._compress(key, value), timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return super(ZstdMCMixin, self).set(
+            key, self._compress(key, value), timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        data = dict((k, self._compress(k, v)) for k, v in data.items())
+        return super(ZstdMCMixin, self).set_many(data, timeout, version)
+
+    def get(self, key, default=None, version=None):
+        return self._decompress(
+            super(ZstdMCMixin, self).get(key, default, version), default)
+
+    def get_many(self, keys, version=None):
+        result = {}
+        missing = object()
+        values = super(ZstdMCMixin, self).get_many(keys, version)
+        for key, value in values.items():
+            value = self._decompress(value, missing)
+            if value is not missing:
+                result[key] = value
+        return result
+
+
+class ChunkManifest(object):
+    """
+    Stored instead of a value split into `count` chunks, `checksum` is CRC32
+    of the whole pickled value
+    """
+
+    def __init__(self, token, count, checksum):
+        self.token = token
+        self.count = count
+        self.checksum = checksum
+
+
+class ChunkedMCMixin(object):
+    """
+    Mixin class for memcached backends storing values that are larger than
+    memcached item size limit.
+
+    A value which pickled size exceeds `CHUNK_SIZE` among backend options
+    (or Django setting `MEMCACHE_CHUNK_SIZE`) is split into chunks of that
+    size stored under derived keys, while the key itself stores a small
+    `ChunkManifest`. Chunks of every stored version have distinct keys,
+    so readers never mix chunks of different versions, and are fetched with
+    a single `get_multi` call. A value with missing or corrupted chunks is
+    a cache miss.
+    """
+
+    chunk_size = getattr(settings, 'MEMCACHE_CHUNK_SIZE', 0)
+    _missing = object()
+    _failed = object()
+
+    def __init__(self, server, params):
+        super(ChunkedMCMixin, self).__init__(server, params)
+        if self._options is not None:
+            self._options = self._options.copy()
+            self.chunk_size = int(self._options.pop('CHUNK_SIZE',
+                                                    self.chunk_size))
+
+    def _chunk_key(self, token, index):
+        return self.make_and_validate_key('__chunk__:%s:%d' % (token, index))
+
+    def _split(self, value, timeout):
+        """
+        Stores chunks of a large value and returns its manifest, returns
+        other values as they are
+        """
+        if not self.chunk_size:
+            return value
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) <= self.chunk_size:
+            return value
+        token = uuid.uuid4().hex
+        chunks = {}
+        for index, start in enumerate(range(0, len(data), self.chunk_size)):
+            chunks[self._chunk_key(token, index)] = \
+                data[start:start + self.chunk_size]
+        if self._cache.set_multi(chunks, self.get_backend_timeout(timeout)):
+            return self._failed
+        return ChunkManifest(token, len(chunks), zlib.crc32(data))
+
+    def _join(self, manifests):
+        """
+        Returns a list of values assembled from chunks for every manifest,
+        `_missing` for those which chunks can't be fetched
+        """
+        keys = [[self._chunk_key(m.token, i) for i in range(m.count)]
+                for m in manifests]
+        found = self._cache.get_multi([k for ks in keys for k in ks])
+        values = []
+        for manifest, chunk_keys in zip(manifests, keys):
+            try:
+                data = b''.join(found[k] for k in chunk_keys)
+            except KeyError:
+                values.append(self._missing)
+                continue
+            if zlib.crc32(data) != manifest.checksum:
+                values.append(self._missing)
+                continue
+            values.append(pickle.loads(data))
+        return values
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self._split(value, timeout)
+        if value is self._failed:
+            return False
+        return super(ChunkedMCMixin, self).add(key, value, timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self._split(value, timeout)
+        if value is self._failed:
+            self.delete(key, version)
+            return
+        return super(ChunkedMCMixin, self).set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = []
+        values = {}
+        for key, value in data.items():
+            value = self._split(value, timeout)
+            if value is self._failed:
+                failed.append(key)
+            else:
+                values[key] = value
+        if failed:
+            self.delete_many(failed, version)
+        return failed + list(super(ChunkedMCMixin, self).set_many(
+            values, timeout, version) or [])
+
+    def get(self, key, default=None, version=None):
+        value = super(ChunkedMCMixin, self).get(key, self._missing, version)
+        if isinstance(value, ChunkManifest):
+            value = self._join([value])[0]
+        if value is self._missing:
+            return default
+        return value
+
+    def get_many(self, keys, version=None):
+        result = super(ChunkedMCMixin, self).get_many(keys, version)
+        chunked = [k for k, v in result.items()
+                   if isinstance(v, ChunkManifest)]
+        if chunked:
+            values = self._join([result[k] for k in chunked])
+            for key, value in zip(chunked, values):
+                if value is self._missing:
+                    del result[key]
+                else:
+                    result[key] = value
+        return result
+
+
+class NoReplyMCMixin(object):
+    """
+    Mixin class for memcached backends sending `set`, `delete` and their
+    multi-key versions without waiting for the server's reply.
+
+    Enabled either by setting `NOREPLY_WRITES: True` among backend options
+    or globally as Django setting `MEMCACHE_NOREPLY_WRITES = True`.
+    Such writes always look successful to the caller, `add` still waits
+    for the reply because its result matters.
+    """
+
+    noreply_writes = getattr(settings, 'MEMCACHE_NOREPLY_WRITES', False)
+    noreply_methods = ('set', 'delete', 'set_multi', 'delete_multi')
+
+    def __init__(self, server, params):
+        super(NoReplyMCMixin, self).__init__(server, params)
+        if self._options is not None:
+            self._options = self._options.copy()
+            self.noreply_writes = self._options.pop('NOREPLY_WRITES',
+                                                    self.noreply_writes)
+
+    def _noreply_client(self, cache):
+        """
+        Returns an object with `noreply_methods` sending no replies
+        """
+        parent = super(NoReplyMCMixin, self)
+        if hasattr(parent, '_noreply_client'):
+            return parent._noreply_client(cache)
+        client = SimpleNamespace()
+        for name in self.noreply_methods:
+            setattr(client, name, partial(getattr(cache, name), noreply=True))
+        return client
+
+    @cached_property
+    def _cache(self):
+        cache = super(NoReplyMCMixin, self)._cache
+        if self.noreply_writes:
+            client = self._noreply_client(cache)
+            for name in self.noreply_methods:
+                setattr(cache, name, getattr(client, name))
+        return cache
+
+
+class WritePipelineMCMixin(object):
+    """
+    Mixin class for memcached backends adding `pipeline()` context manager.
+
+    Inside it `set()`, `delete()`, `set_many()` and `delete_many()` calls
+    are buffered and sent at the end with as few `set_multi`/`delete_multi`
+    calls as possible, only the last write of every key is sent. Any other
+    call sends buffered writes first, so reads see them.
+
+    Example usage:
+
+        with caches['memcached'].pipeline():
+            caches['default'].set('key-1', 1)  # CalmCache over 'memcached'
+            caches['memcached'].delete('key-2')
+    """
+
+    _deleted = object()
+
+    def __init__(self, server, params):
+        super(WritePipelineMCMixin, self).__init__(server, params)
+        self._pipeline = None
+
+    @contextmanager
+    def pipeline(self):
+        if self._pipeline is not None:
+            # Nested pipeline is a part of the outer one
+            yield self
+            return
+        self._pipeline = {}
+        try:
+            yield self
+        finally:
+            self.flush_pipeline()
+            self._pipeline = None
+
+    def flush_pipeline(self):
+        """
+        Sends buffered writes, grouping `set`s by timeout
+        """
+        pipeline = self._pipeline
+        if not pipeline:
+            return
+        self._pipeline = {}
+        groups = {}
+        deleted = []
+        for key, (value, timeout) in pipeline.items():
+            if value is self._deleted:
+                deleted.append(key)
+            else:
+                groups.setdefault(timeout, {})[key] = value
+        for timeout, data in groups.items():
+            self._cache.set_multi(data, timeout)
+        if deleted:
+            self._cache.delete_multi(deleted)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._pipeline is None:
+            return super(WritePipelineMCMixin, self).set(key, value, timeout,
+                                                         version)
+        key = self.make_and_validate_key(key, version=version)
+        self._pipeline[key] = (value, self.get_backend_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if self._pipeline is None:
+            return super(WritePipelineMCMixin, self).set_many(data, timeout,
+                                                              version)
+        for key, value in data.items():
+            self.set(key, value, timeout, version)
+        return []
+
+    def delete(self, key, version=None):
+        if self._pipeline is None:
+            return super(WritePipelineMCMixin, self).delete(key, version)
+        key = self.make_and_validate_key(key, version=version)
+        self._pipeline[key] = (self._deleted, None)
+        return True
+
+    def delete_many(self, keys, version=None):
+        if self._pipeline is None:
+            return super(WritePipelineMCMixin, self).delete_many(keys,
+                                                                 version)
+        for key in keys:
+            self.delete(key, version)
+
+    def add(self, *args, **kwargs):
+        self.flush_pipeline()
+        return super(WritePipelineMCMixin, self).add(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        self.flush_pipeline()
+        return super(WritePipelineMCMixin, self).get(*args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        self.flush_pipeline()
+        return super(WritePipelineMCMixin, self).get_many(*args, **kwargs)
+
+    def touch(self, *args, **kwargs):
+        self.flush_pipeline()
+        return super(WritePipelineMCMixin, self).touch(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        self.flush_pipeline()
+        return super(WritePipelineMCMixin, self).incr(*args, **kwargs)
+
+    def decr(self, *args, **kwargs):
+        self.flush_pipeline()
+        return super(WritePipelineMCMixin, self).decr(*args, **kwargs)
+
+    def clear(self):
+        if self._pipeline:
+            self._pipeline = {}
+        return super(WritePipelineMCMixin, self).clear()
+
+
+class ClientPool(object):
+    """
+    A fixed size pool of memcached clients that are reserved for a single
+    call at a time, recording time spent waiting for a free client
+    """
+
+    def __init__(self, factory, size):
+        self.size = size
+        self.queue = Queue(size)
+        for _ in range(size):
+            self.queue.put(factory())
+        self.lock = threading.Lock()
+        self.stats = dict(reservations=0, waits=0, wait_time=0.0,
+                          max_wait_time=0.0, exhausted=0)
+
+    @contextmanager
+    def reserve(self, block=True, timeout=None):
+        started = time.time()
+        try:
+            client = self.queue.get_nowait()
+            waited = None
+        except Empty:
+            try:
+                if not block:
+                    raise Empty()
+                client = self.queue.get(True, timeout)
+            except Empty:
+                with self.lock:
+                    self.stats['exhausted'] += 1
+                raise
+            waited = time.time() - started
+        with self.lock:
+            self.stats['reservations'] += 1
+            if waited is not None:
+                self.stats['waits'] += 1
+                self.stats['wait_time'] += waited
+                self.stats['max_wait_time'] = max(
+                    self.stats['max_wait_time'], waited)
+        try:
+            yield client
+        finally:
+            self.queue.put(client)
+
+
+class PooledClient(object):
+    """
+    Exposes memcached client API, performing every call with a client
+    reserved from the pool
+    """
+
+    def __init__(self, pool, block=True, timeout=None):
+        self.pool = pool
+        self.block = block
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            with self.pool.reserve(self.block, self.timeout) as client:
+                return getattr(client, name)(*args, **kwargs)
+        method.__name__ = name
+        return method
+
+
+class PooledMCMixin(object):
+    """
+    Mixin class for memcached backends sharing a pool of `POOL_SIZE`
+    clients among all threads of the process instead of using a client
+    per thread that is disconnected at the end of every request.
+
+    When all clients are busy, the caller waits up to `POOL_TIMEOUT` seconds
+    (forever if it's `None`) if `POOL_BLOCK` is `True` or `queue.Empty`
+    is raised immediately otherwise. With several servers in `LOCATION`
+    every pooled client keeps its own connection to every server.
+    """
+
+    pool_size = getattr(settings, 'MEMCACHE_POOL_SIZE', 0)
+    pool_block = getattr(settings, 'MEMCACHE_POOL_BLOCK', True)
+    pool_timeout = getattr(settings, 'MEMCACHE_POOL_TIMEOUT', None)
+
+    def __init__(self, server, params):
+        super(PooledMCMixin, self).__init__(server, params)
+        if self._options is not None:
+            self._options = self._options.copy()
+            self.pool_size = int(self._options.pop('POOL_SIZE',
+                                                   self.pool_size))
+            self.pool_block = self._options.pop('POOL_BLOCK', self.pool_block)
+            self.pool_timeout = self._options.pop('POOL_TIMEOUT',
+                                                  self.pool_timeout)
+
+    def _new_client(self):
+        parent = super(PooledMCMixin, self)
+        if hasattr(parent, '_new_client'):
+            return parent._new_client()
+        return self._class(self.client_servers, **self._options)
+
+    @property
+    def pool(self):
+        if not self.pool_size:
+            return None
+        key = (self.__class__, tuple(self._servers),
+               repr(sorted((self._options or {}).items())),
+               getattr(self, 'binary_proto', None), self.pool_size)
+        pool = _pools.get(key)
+        if pool is None:
+            with _pools_lock:
+                pool = _pools.get(key)
+                if pool is None:
+                    pool = _pools[key] = ClientPool(self._new_client,
+                                                    self.pool_size)
+        return pool
+
+    @cached_property
+    def _cache(self):
+        pool = self.pool
+        if pool is None:
+            return super(PooledMCMixin, self)._cache
+        return PooledClient(pool, self.pool_block, self.pool_timeout)
+
+    def pool_stats(self):
+        """
+        Returns a dictionary with pool size and usage counters, `None` if
+        pooling is disabled
+        """
+        pool = self.pool
+        if pool is None:
+            return None
+        with pool.lock:
+            stats = dict(pool.stats)
+        stats['size'] = pool.size
+        stats['available'] = pool.queue.qsize()
+        return stats
+
+    def close(self, **kwargs):
+        # Pooled connections outlive requests
+        if not self.pool_size:
+            super(PooledMCMixin, self).close(**kwargs)
+
+
 class BinPyLibMCCache(DjangoPyLibMCCache):
     """
     Extend standard `PyLibMCCache` to support binary protocol.
@@ -53,18 +635,32 @@ class BinPyLibMCCache(DjangoPyLibMCCache):
             self._options = self._options.copy()
             self.binary_proto = self._options.pop('BINARY', self.binary_proto)
 
-    @cached_property
-    def _cache(self):
+    def _new_client(self):
         cache = self._lib.Client(self._servers, binary=self.binary_proto)
         if self._options is not None:
             cache.behaviors = self._options
         return cache
 
+    def _noreply_client(self, cache):
+        # libmemcached sends quiet/noreply commands when this behavior is
+        # set, so a separate client is used to keep replies for `add`
+        client = self._new_client()
+        client.behaviors = {'_noreply': True}
+        return client
+
+    @cached_property
+    def _cache(self):
+        return self._new_client()
+
 
-class MemcachedCache(ZippedMCMixin, DjangoMemcachedCache):
+class MemcachedCache(ZippedMCMixin, ZstdMCMixin, ChunkedMCMixin,
+                     NoReplyMCMixin, WritePipelineMCMixin, PooledMCMixin,
+                     DjangoMemcachedCache):
     """
     An extension of standard `django.cache.backends.MemcachedCache`
-    supporting optional compression of stored values
+    supporting optional compression of stored values, optional pool
+    of clients shared among threads, noreply and pipelined writes,
+    chunking of large values and zstd dictionary compression
 
     Example configuration:
 
@@ -74,6 +670,12 @@ class MemcachedCache(ZippedMCMixin, DjangoMemcachedCache):
                 'LOCATION': '127.0.0.1:11211',
                 'OPTIONS': {
                     'MIN_COMPRESS_LEN': 1024,
+                    'POOL_SIZE': 16,
+                    'NOREPLY_WRITES': True,
+                    'CHUNK_SIZE': 1000000,
+                    'ZSTD_DICTIONARIES': {
+                        'page:': '/var/lib/zstd/page.dict',
+                    },
                 },
             },
         }
@@ -81,11 +683,15 @@ class MemcachedCache(ZippedMCMixin, DjangoMemcachedCache):
     pass
 
 
-class PyLibMCCache(ZippedMCMixin, BinPyLibMCCache):
+class PyLibMCCache(ZippedMCMixin, ZstdMCMixin, ChunkedMCMixin,
+                   NoReplyMCMixin, WritePipelineMCMixin, PooledMCMixin,
+                   BinPyLibMCCache):
     """
     An extension of standard `django.cache.backends.PyLibMCCache`
-    supporting optional compression of stored values and optional binary
-    memcached protocol
+    supporting optional compression of stored values, optional binary
+    memcached protocol, optional pool of clients shared among threads,
+    noreply and pipelined writes, chunking of large values and zstd
+    dictionary compression
 
     Example configuration:
 
@@ -96,6 +702,13 @@ class PyLibMCCache(ZippedMCMixin, BinPyLibMCCache):
                 'OPTIONS': {
                     'MIN_COMPRESS_LEN': 1024,
                     'BINARY': True,
+                    'POOL_SIZE': 16,
+                    'POOL_BLOCK': True,
+                    'NOREPLY_WRITES': True,
+                    'CHUNK_SIZE': 1000000,
+                    'ZSTD_DICTIONARIES': {
+                        'page:': '/var/lib/zstd/page.dict',
+                    },
                 },
             },
         }
@@ -0,0 +1,310 @@
+"Memcached backend speaking meta protocol"
+
+import pickle
+import socket
+import threading
+from types import SimpleNamespace
+
+from django.core.cache.backends.memcached import BaseMemcachedCache
+
+from calm_cache.hashring import HashRing
+
+
+FLAG_BYTES = 0
+FLAG_PICKLE = 1
+FLAG_INT = 2
+FLAG_TEXT = 3
+
+
+class MetaProtocolError(Exception):
+    pass
+
+
+def serialize(value):
+    if isinstance(value, bytes):
+        return value, FLAG_BYTES
+    if type(value) is int:
+        return str(value).encode('ascii'), FLAG_INT
+    if isinstance(value, str):
+        return value.encode('utf-8'), FLAG_TEXT
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL), FLAG_PICKLE
+
+
+def deserialize(data, flags):
+    if flags == FLAG_BYTES:
+        return data
+    if flags == FLAG_INT:
+        return int(data)
+    if flags == FLAG_TEXT:
+        return data.decode('utf-8')
+    return pickle.loads(data)
+
+
+def _flags(tokens):
+    """
+    Parses returned meta flags into a dictionary `{flag: token}`
+    """
+    return dict((t[:1], t[1:]) for t in tokens)
+
+
+class MetaConnection(object):
+    """
+    A single connection to memcached server `host:port` or `unix:/path`
+    """
+
+    def __init__(self, server, timeout=None):
+        if server.startswith('unix:'):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = server[5:]
+        else:
+            host, _, port = server.rpartition(':')
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = (host or '127.0.0.1', int(port or 11211))
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb')
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def readline(self):
+        line = self.rfile.readline()
+        if not line.endswith(b'\r\n'):
+            raise MetaProtocolError("Connection closed")
+        return line[:-2].decode('utf-8').split(' ')
+
+    def read_value(self, size):
+        data = self.rfile.read(size + 2)
+        if len(data) != size + 2:
+            raise MetaProtocolError("Connection closed")
+        return data[:-2]
+
+    def close(self):
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class MetaClient(object):
+    """
+    Minimal memcached client using meta commands (`mg`, `ms`, `md`, `ma`),
+    exposing the subset of `pymemcache`-like API used by Django
+    memcached backends plus `get_stale()`.
+
+    Connections are kept per thread, keys are distributed among several
+    servers with consistent hashing.
+    """
+
+    def __init__(self, servers, timeout=None):
+        self.servers = list(servers)
+        self.timeout = timeout
+        self.ring = HashRing(self.servers) if len(self.servers) > 1 else None
+        self._local = threading.local()
+
+    def _connection(self, server):
+        connections = self._local.__dict__.setdefault('connections', {})
+        connection = connections.get(server)
+        if connection is None:
+            connection = connections[server] = MetaConnection(server,
+                                                              self.timeout)
+        return connection
+
+    def _server(self, key):
+        if self.ring is None:
+            return self.servers[0]
+        return self.ring.get_node(key)
+
+    def _group(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._server(key), []).append(key)
+        return groups.items()
+
+    def _execute(self, server, request, read):
+        """
+        Sends `request` and calls `read(connection)` to read the response,
+        dropping the connection on any error
+        """
+        connection = self._connection(server)
+        try:
+            connection.send(request)
+            return read(connection)
+        except Exception:
+            self._local.connections.pop(server, None)
+            connection.close()
+            raise
+
+    def _command(self, key, line, data=None):
+        request = line.encode('utf-8') + b'\r\n'
+        if data is not None:
+            request += data + b'\r\n'
+
+        def read(connection):
+            tokens = connection.readline()
+            value = None
+            if tokens[0] == 'VA':
+                value = connection.read_value(int(tokens[1]))
+                return tokens[0], _flags(tokens[2:]), value
+            if tokens[0] in ('ERROR', 'CLIENT_ERROR', 'SERVER_ERROR'):
+                raise MetaProtocolError(' '.join(tokens))
+            return tokens[0], _flags(tokens[1:]), value
+        return self._execute(self._server(key), request, read)
+
+    def _store(self, key, value, expire, mode):
+        data, flags = serialize(value)
+        code, _, _ = self._command(
+            key, 'ms %s %d T%d F%d M%s' % (key, len(data), expire, flags, mode),
+            data)
+        return code == 'HD'
+
+    def get(self, key, default=None):
+        code, flags, data = self._command(key, 'mg %s v f' % key)
+        if code != 'VA':
+            return default
+        return deserialize(data, int(flags.get('f') or 0))
+
+    def get_stale(self, key, recache):
+        """
+        Returns `None` on miss, otherwise a tuple `(value, win)` where `win`
+        is `True` for the only client that should refresh the value because
+        it's stale or its remaining TTL is less than `recache` seconds
+        """
+        code, flags, data = self._command(key, 'mg %s v f R%d' % (key, recache))
+        if code != 'VA':
+            return None
+        return (deserialize(data, int(flags.get('f') or 0)), 'W' in flags)
+
+    def get_multi(self, keys):
+        result = {}
+        for server, server_keys in self._group(keys):
+            request = b''.join(('mg %s v f k q\r\n' % key).encode('utf-8')
+                               for key in server_keys) + b'mn\r\n'
+
+            def read(connection):
+                while True:
+                    tokens = connection.readline()
+                    if tokens[0] == 'MN':
+                        return
+                    if tokens[0] == 'VA':
+                        data = connection.read_value(int(tokens[1]))
+                        flags = _flags(tokens[2:])
+                        result[flags['k']] = deserialize(
+                            data, int(flags.get('f') or 0))
+            self._execute(server, request, read)
+        return result
+
+    def set(self, key, value, expire=0):
+        return self._store(key, value, expire, 'S')
+
+    def add(self, key, value, expire=0):
+        return self._store(key, value, expire, 'E')
+
+    def set_multi(self, values, expire=0):
+        failed = []
+        for server, server_keys in self._group(values):
+            request = b''
+            for key in server_keys:
+                data, flags = serialize(values[key])
+                request += ('ms %s %d T%d F%d k q\r\n' % (
+                    key, len(data), expire, flags)).encode('utf-8')
+                request += data + b'\r\n'
+            request += b'mn\r\n'
+
+            def read(connection):
+                while True:
+                    tokens = connection.readline()
+                    if tokens[0] == 'MN':
+                        return
+                    failed.append(_flags(tokens[1:]).get('k'))
+            self._execute(server, request, read)
+        return failed
+
+    def delete(self, key):
+        return self._command(key, 'md %s' % key)[0] == 'HD'
+
+    def delete_multi(self, keys):
+        for server, server_keys in self._group(keys):
+            request = b''.join(('md %s q\r\n' % key).encode('utf-8')
+                               for key in server_keys) + b'mn\r\n'
+
+            def read(connection):
+                while connection.readline()[0] != 'MN':
+                    pass
+            self._execute(server, request, read)
+
+    def touch(self, key, expire=0):
+        return self._command(key, 'mg %s T%d' % (key, expire))[0] == 'HD'
+
+    def _arithmetic(self, key, delta, mode):
+        code, _, data = self._command(key, 'ma %s D%d M%s v' % (key, delta,
+                                                                mode))
+        if code != 'VA':
+            return None
+        return int(data)
+
+    def incr(self, key, delta=1):
+        return self._arithmetic(key, delta, 'I')
+
+    def decr(self, key, delta=1):
+        return self._arithmetic(key, delta, 'D')
+
+    def flush_all(self):
+        for server in self.servers:
+            def read(connection):
+                connection.readline()
+            self._execute(server, b'flush_all\r\n', read)
+
+    def disconnect_all(self):
+        connections = self._local.__dict__.get('connections', {})
+        for connection in connections.values():
+            connection.close()
+        connections.clear()
+
+
+class MetaMemcachedCache(BaseMemcachedCache):
+    """
+    Memcached backend using meta protocol (memcached 1.6+).
+
+    `CalmCache` detects this backend and lets memcached handle mint period
+    atomically: instead of storing packed values and re-setting them with
+    the refreshing flag, it asks the server to hand out a single "win" token
+    to the first client reading the value during the last
+    `MINT_PERIOD + GRACE_PERIOD` seconds of its TTL, while everyone else gets
+    the stale value.
+
+    Example configuration:
+
+        CACHES = {
+            'default': {
+                'BACKEND': 'calm_cache.backends.CalmCache',
+                'LOCATION': 'meta-memcached',
+                'OPTIONS': {
+                    'MINT_PERIOD': 10,
+                },
+            },
+            'meta-memcached': {
+                'BACKEND': 'calm_cache.backends.MetaMemcachedCache',
+                'LOCATION': '127.0.0.1:11211',
+                'OPTIONS': {
+                    'timeout': 1,
+                },
+            },
+        }
+    """
+
+    supports_stale_while_revalidate = True
+
+    def __init__(self, server, params):
+        super(MetaMemcachedCache, self).__init__(
+            server, params, library=SimpleNamespace(Client=MetaClient),
+            value_not_found_exception=KeyError)
+
+    def get_stale(self, key, recache, version=None):
+        """
+        See `MetaClient.get_stale()`
+        """
+        key = self.make_and_validate_key(key, version=version)
+        return self._cache.get_stale(key, int(recache))
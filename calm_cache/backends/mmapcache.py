@@ -0,0 +1,326 @@
+"Cache backend sharing a memory mapped file among processes of one host"
+
+import fcntl
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import md5
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+
+
+MAGIC = b'CCMMAP01'
+
+# magic, buckets, ways, slot size
+FILE_HEADER = struct.Struct('<8sIII')
+# CLOCK hand
+BUCKET_HEADER = struct.Struct('<I4x')
+# used, referenced, key length, key hash, expiry time (0 - never),
+# value length
+SLOT_HEADER = struct.Struct('<BBHQdI')
+
+# Tables opened by this process, keyed by path, process id and layout
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def _hash(key):
+    return struct.unpack('<Q', md5(key).digest()[:8])[0]
+
+
+class MmapTable(object):
+    """
+    A hash table stored in a memory mapped file: `buckets` buckets of `ways`
+    fixed size slots each. Every bucket is locked separately with both
+    a thread lock and `fcntl` lock on its header byte, so it can be used
+    by all threads of all processes mapping the same file. When all slots of
+    a bucket are taken, CLOCK algorithm chooses the one to reuse.
+    """
+
+    def __init__(self, path, buckets, ways, slot_size):
+        if slot_size <= SLOT_HEADER.size:
+            raise ImproperlyConfigured("SLOT_SIZE is too small")
+        self.path = path
+        self.buckets = buckets
+        self.ways = ways
+        self.slot_size = slot_size
+        self.bucket_size = BUCKET_HEADER.size + ways * slot_size
+        self.size = FILE_HEADER.size + buckets * self.bucket_size
+        self.locks = [threading.Lock() for _ in range(buckets)]
+        self.time_func = time.time
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, FILE_HEADER.size, 0)
+        try:
+            header = FILE_HEADER.pack(MAGIC, buckets, ways, slot_size)
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, header, 0)
+            elif os.pread(self.fd, FILE_HEADER.size, 0) != header:
+                os.close(self.fd)
+                raise ImproperlyConfigured(
+                    "%s was created with different BUCKETS, WAYS or "
+                    "SLOT_SIZE" % path)
+        finally:
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, FILE_HEADER.size, 0)
+            except OSError:
+                pass
+        self.map = mmap.mmap(self.fd, self.size)
+
+    def capacity(self, key):
+        """
+        Returns maximum size of a value stored under `key`
+        """
+        return self.slot_size - SLOT_HEADER.size - len(key)
+
+    @contextmanager
+    def locked(self, key):
+        """
+        Locks the bucket of `key`, yields `(bucket offset, key hash)`
+        """
+        key_hash = _hash(key)
+        bucket = key_hash % self.buckets
+        offset = FILE_HEADER.size + bucket * self.bucket_size
+        with self.locks[bucket]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, offset)
+            try:
+                yield offset, key_hash
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offset)
+
+    def _slot(self, bucket, way):
+        return bucket + BUCKET_HEADER.size + way * self.slot_size
+
+    def _header(self, slot):
+        return SLOT_HEADER.unpack_from(self.map, slot)
+
+    def _expired(self, expiry, now):
+        return expiry and expiry <= now
+
+    def find(self, bucket, key_hash, key):
+        """
+        Returns offset of the live slot holding `key` or `None`, frees
+        the slot if it has expired. Must be called with the bucket locked.
+        """
+        for way in range(self.ways):
+            slot = self._slot(bucket, way)
+            used, _, key_len, slot_hash, expiry, _ = self._header(slot)
+            if not used or slot_hash != key_hash:
+                continue
+            start = slot + SLOT_HEADER.size
+            if self.map[start:start + key_len] != key:
+                continue
+            if self._expired(expiry, self.time_func()):
+                self.map[slot] = 0
+                return None
+            return slot
+        return None
+
+    def read(self, slot):
+        """
+        Returns stored value bytes marking the slot as recently used
+        """
+        _, _, key_len, _, _, value_len = self._header(slot)
+        self.map[slot + 1] = 1
+        start = slot + SLOT_HEADER.size + key_len
+        return self.map[start:start + value_len]
+
+    def expiry(self, slot):
+        return self._header(slot)[4]
+
+    def write(self, bucket, key_hash, key, value, expiry, slot=None):
+        """
+        Stores `value` in `slot` or in a free or evicted slot of the bucket.
+        Returns `False` if it's too large.
+        """
+        if len(value) > self.capacity(key):
+            if slot is not None:
+                self.map[slot] = 0
+            return False
+        if slot is None:
+            slot = self._free_slot(bucket)
+        SLOT_HEADER.pack_into(self.map, slot, 1, 0, len(key), key_hash,
+                              expiry or 0, len(value))
+        start = slot + SLOT_HEADER.size
+        self.map[start:start + len(key)] = key
+        self.map[start + len(key):start + len(key) + len(value)] = value
+        return True
+
+    def _free_slot(self, bucket):
+        now = self.time_func()
+        for way in range(self.ways):
+            slot = self._slot(bucket, way)
+            used, _, _, _, expiry, _ = self._header(slot)
+            if not used or self._expired(expiry, now):
+                return slot
+        hand = BUCKET_HEADER.unpack_from(self.map, bucket)[0]
+        while True:
+            slot = self._slot(bucket, hand % self.ways)
+            hand = (hand + 1) % self.ways
+            if self.map[slot + 1]:
+                # Recently used, give a second chance
+                self.map[slot + 1] = 0
+                continue
+            BUCKET_HEADER.pack_into(self.map, bucket, hand)
+            return slot
+
+    def update_expiry(self, slot, expiry):
+        used, referenced, key_len, key_hash, _, value_len = self._header(slot)
+        SLOT_HEADER.pack_into(self.map, slot, used, referenced, key_len,
+                              key_hash, expiry or 0, value_len)
+
+    def delete(self, slot):
+        self.map[slot] = 0
+
+    def clear(self):
+        for bucket in range(self.buckets):
+            offset = FILE_HEADER.size + bucket * self.bucket_size
+            with self.locks[bucket]:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, offset)
+                try:
+                    for way in range(self.ways):
+                        self.map[self._slot(offset, way)] = 0
+                finally:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offset)
+
+
+def get_table(path, buckets, ways, slot_size):
+    """
+    Returns `MmapTable` for `path` opened once per process
+    """
+    key = (path, os.getpid(), buckets, ways, slot_size)
+    table = _tables.get(key)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(key)
+            if table is None:
+                table = _tables[key] = MmapTable(path, buckets, ways,
+                                                 slot_size)
+    return table
+
+
+class MmapCache(BaseCache):
+    """
+    Cache backend storing values in a memory mapped file, so all processes
+    of the host share the same entries. `LOCATION` is the file path.
+
+    The file is a fixed size hash table of `BUCKETS` buckets of `WAYS`
+    slots each, `SLOT_SIZE` bytes per slot including 24 bytes of header and
+    the key. Values that don't fit into a slot are not stored. Requires
+    `fcntl` (Unix).
+
+    Example configuration:
+
+        CACHES = {
+            'default': {
+                'BACKEND' : 'calm_cache.backends.CalmCache',
+                'LOCATION': 'host-cache',
+                'OPTIONS': {
+                    'MINT_PERIOD': 10,
+                },
+            },
+            'host-cache': {
+                'BACKEND': 'calm_cache.backends.MmapCache',
+                'LOCATION': '/dev/shm/django-cache',
+                'OPTIONS': {
+                    'BUCKETS': 1024,
+                    'WAYS': 8,
+                    'SLOT_SIZE': 4096,
+                },
+            },
+        }
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, path, params):
+        super(MmapCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = path
+        self.buckets = int(options.get('BUCKETS', 1024))
+        self.ways = int(options.get('WAYS', 8))
+        self.slot_size = int(options.get('SLOT_SIZE', 4096))
+
+    @property
+    def table(self):
+        return get_table(self.path, self.buckets, self.ways, self.slot_size)
+
+    def _key(self, key, version):
+        return self.make_and_validate_key(key, version=version).encode('utf-8')
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        table = self.table
+        with table.locked(key) as (bucket, key_hash):
+            if table.find(bucket, key_hash, key) is not None:
+                return False
+            return table.write(bucket, key_hash, key, pickled,
+                               self.get_backend_timeout(timeout))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        table = self.table
+        with table.locked(key) as (bucket, key_hash):
+            slot = table.find(bucket, key_hash, key)
+            if slot is None:
+                return default
+            pickled = table.read(slot)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        table = self.table
+        with table.locked(key) as (bucket, key_hash):
+            slot = table.find(bucket, key_hash, key)
+            table.write(bucket, key_hash, key, pickled,
+                        self.get_backend_timeout(timeout), slot)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        table = self.table
+        with table.locked(key) as (bucket, key_hash):
+            slot = table.find(bucket, key_hash, key)
+            if slot is None:
+                return False
+            table.update_expiry(slot, self.get_backend_timeout(timeout))
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        table = self.table
+        with table.locked(key) as (bucket, key_hash):
+            slot = table.find(bucket, key_hash, key)
+            if slot is None:
+                raise ValueError("Key '%s' not found" % key.decode('utf-8'))
+            value = pickle.loads(table.read(slot)) + delta
+            table.write(bucket, key_hash, key,
+                        pickle.dumps(value, self.pickle_protocol),
+                        table.expiry(slot), slot)
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        table = self.table
+        with table.locked(key) as (bucket, key_hash):
+            return table.find(bucket, key_hash, key) is not None
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        table = self.table
+        with table.locked(key) as (bucket, key_hash):
+            slot = table.find(bucket, key_hash, key)
+            if slot is None:
+                return False
+            table.delete(slot)
+            return True
+
+    def clear(self):
+        self.table.clear()
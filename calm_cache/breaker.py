@@ -0,0 +1,164 @@
+"Circuit breaker protecting requests from a slow or unavailable cache"
+
+import threading
+import time
+from collections import deque, OrderedDict
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a backend while its circuit is open
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Tracks outcomes of recent calls to a backend. When the share of failed
+    or slow calls among the last `window` ones reaches `error_rate`, the
+    circuit opens and calls are rejected immediately for `cool_down`
+    seconds. After that up to `probes` calls are let through (half-open
+    state), closing the circuit if they succeed or opening it again if they
+    fail.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, error_rate=0.5, window=20, min_calls=5, slow_call=None,
+                 cool_down=10, probes=1, ignore=()):
+        """
+        Args:
+
+            `error_rate`: share of failed calls opening the circuit.
+                Default: `0.5`
+            `window`: number of last calls considered. Default: `20`
+            `min_calls`: the circuit is never opened until this many calls
+                are recorded. Default: `5`
+            `slow_call`: calls taking longer than this many seconds count as
+                failed. Default: `None` (Disabled)
+            `cool_down`: seconds the circuit stays open. Default: `10`
+            `probes`: number of calls let through in half-open state.
+                Default: `1`
+            `ignore`: a tuple of exception classes that are raised by
+                a healthy backend, e.g. `ValueError` of `incr()` of a missing
+                key. Such calls are recorded as successful. Default: `()`
+        """
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.cool_down = cool_down
+        self.probes = probes
+        self.ignore = tuple(ignore)
+        self.time_func = time.time
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self.probes_sent = 0
+        self.counters = dict.fromkeys(
+            ('calls', 'failures', 'slow_calls', 'rejected', 'opened'), 0)
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                if self.time_func() < self.opened_at + self.cool_down:
+                    self.counters['rejected'] += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.probes_sent = 0
+            if self.state == self.HALF_OPEN:
+                if self.probes_sent >= self.probes:
+                    self.counters['rejected'] += 1
+                    return False
+                self.probes_sent += 1
+            return True
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = self.time_func()
+        self.outcomes.clear()
+        self.counters['opened'] += 1
+
+    def record(self, success, duration=0):
+        with self.lock:
+            self.counters['calls'] += 1
+            if success and self.slow_call is not None and \
+                    duration > self.slow_call:
+                self.counters['slow_calls'] += 1
+                success = False
+            if not success:
+                self.counters['failures'] += 1
+            if self.state == self.HALF_OPEN:
+                if success:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                else:
+                    self._open()
+                return
+            if self.state == self.OPEN:
+                return
+            self.outcomes.append(success)
+            failed = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_calls and \
+                    failed >= self.error_rate * len(self.outcomes):
+                self._open()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls `func`, recording the outcome, or raises `CircuitOpen`
+        """
+        if not self.allow():
+            raise CircuitOpen()
+        started = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except self.ignore:
+            self.record(True, time.time() - started)
+            raise
+        except Exception:
+            self.record(False)
+            raise
+        self.record(True, time.time() - started)
+        return result
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['state'] = self.state
+            return stats
+
+
+class LocalFallback(object):
+    """
+    A small thread-safe LRU mapping keeping copies of recently seen values
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.pop(key, None)
+            if value is not None:
+                self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
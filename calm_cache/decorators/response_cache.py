@@ -1,11 +1,47 @@
-from functools import wraps
+from functools import partial, wraps
 import re
+import time
 
 from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
 from django.utils.http import http_date
 from django.template.response import SimpleTemplateResponse
 from django.conf import settings
 
+from calm_cache.sizes import parse_size, recording, serialize, view_sizes
+
+
+class CachedStream(object):
+    """
+    Picklable copy of a streaming response that was sent completely
+    """
+
+    def __init__(self, status_code, headers, chunks):
+        self.status_code = status_code
+        self.headers = headers
+        self.chunks = chunks
+
+    def to_response(self):
+        response = StreamingHttpResponse(iter(self.chunks),
+                                         status=self.status_code)
+        for header, value in self.headers:
+            response[header] = value
+        return response
+
+
+def _view_name(view):
+    """
+    Returns dotted path of `view`: a function, a method, a `partial` of
+    them or an instance of a callable class
+    """
+    while isinstance(view, partial):
+        view = view.func
+    name = getattr(view, '__qualname__', None) or \
+        getattr(view, '__name__', None) or type(view).__qualname__
+    module = getattr(view, '__module__', None) or type(view).__module__
+    return '%s.%s' % (module, name)
+
 
 class ResponseCache(object):
     """
@@ -29,6 +65,8 @@ class ResponseCache(object):
     excluded_cookies = getattr(settings, 'CCRC_EXCLUDED_REQ_COOKIES', ())
     methods = getattr(settings, 'CCRC_CACHE_REQ_METHDODS', ('GET', ))
     codes = getattr(settings, 'CCRC_CACHE_RSP_CODES', (200, ))
+    negative_codes = getattr(settings, 'CCRC_NEGATIVE_RSP_CODES', ())
+    negative_timeout = getattr(settings, 'CCRC_NEGATIVE_TIMEOUT', None)
     nocache_req = getattr(settings, 'CCRC_NOCACHE_REQ_HEADERS', {})
     nocache_rsp = getattr(settings, 'CCRC_NOCACHE_RSP_HEADERS',
                           ('Set-Cookie', 'Vary'))
@@ -37,6 +75,21 @@ class ResponseCache(object):
     include_host = getattr(settings, 'CCRC_KEY_HOST', True)
     hitmiss_header = getattr(settings, 'CCRC_HITMISS_HEADER',
                              ('X-Cache', 'Hit', 'Miss'))
+    cache_streaming = getattr(settings, 'CCRC_CACHE_STREAMING', False)
+    streaming_max_size = getattr(settings, 'CCRC_STREAMING_MAX_SIZE',
+                                 10 * 1024 * 1024)
+    collapse = getattr(settings, 'CCRC_COLLAPSE', False)
+    collapse_timeout = getattr(settings, 'CCRC_COLLAPSE_TIMEOUT', 10)
+    collapse_wait = getattr(settings, 'CCRC_COLLAPSE_WAIT', 5)
+    cache_control = getattr(settings, 'CCRC_CACHE_CONTROL', False)
+    surrogate_keys = getattr(settings, 'CCRC_SURROGATE_KEYS', ())
+    surrogate_key_header = getattr(settings, 'CCRC_SURROGATE_KEY_HEADER',
+                                   'Surrogate-Key')
+    size_accounting = getattr(settings, 'CCRC_SIZE_ACCOUNTING', False)
+    max_entry_size = getattr(settings, 'CCRC_MAX_ENTRY_SIZE', None)
+    # First and maximum delay between polls while waiting for a collapsed
+    # request, seconds
+    collapse_poll = (0.05, 1)
 
     def __init__(self, cache_timeout, **kwargs):
         """
@@ -51,6 +104,13 @@ class ResponseCache(object):
                 Default: `('GET', )`. Django setting: `CCRC_CACHE_REQ_METHDODS`
             `codes`: a list/tuple with cacheable response codes.
                 Default: `(200, )`. Django setting: `CCRC_CACHE_RSP_CODES`
+            `negative_codes`: a list/tuple with response codes meaning that
+                there is nothing there (e.g. `(404, 410)`), cached for
+                `negative_timeout` seconds. Default: `()`.
+                Django setting: `CCRC_NEGATIVE_RSP_CODES`
+            `negative_timeout`: integer, TTL for responses with
+                `negative_codes`. Default: `None` (same as `cache_timeout`).
+                Django setting: `CCRC_NEGATIVE_TIMEOUT`
             `nocache_req`: a dictionary with request headers as keys and
                 regular expressions as values (strings or compiled),
                 so that when request has a header with value matching
@@ -82,6 +142,46 @@ class ResponseCache(object):
                 If set to `None`, the header is never added
                 Default: `('X-Cache', 'Hit', 'Miss')'`.
                 Django setting: `CCRC_HITMISS_HEADER`
+            `cache_streaming`: boolean, if `True` streaming responses
+                (`StreamingHttpResponse`, `FileResponse`) are stored once
+                their content is sent completely. Asynchronous streams are
+                never cached. Default: `False`.
+                Django setting: `CCRC_CACHE_STREAMING`
+            `streaming_max_size`: streaming responses with longer content
+                are not cached, bytes. Default: `10485760` (10 MiB).
+                Django setting: `CCRC_STREAMING_MAX_SIZE`
+            `collapse`: boolean, if `True` only the first request missing
+                the cache renders the response, while other requests for
+                the same key wait for it to be stored. Default: `False`.
+                Django setting: `CCRC_COLLAPSE`
+            `collapse_timeout`: integer, the longest time a request is
+                considered rendering the response, seconds. Default: `10`.
+                Django setting: `CCRC_COLLAPSE_TIMEOUT`
+            `collapse_wait`: the longest time a request waits for another one
+                to store the response before rendering it itself, seconds.
+                Default: `5`. Django setting: `CCRC_COLLAPSE_WAIT`
+            `cache_control`: boolean, if `True` stored responses get
+                `Cache-Control` with `s-maxage` of the cache timeout,
+                `stale-while-revalidate` of the backend's `MINT_PERIOD` and
+                `stale-if-error` of `MINT_PERIOD` plus `GRACE_PERIOD`, unless
+                the view marked them `private`, `no-store` or `no-cache`.
+                Default: `False`. Django setting: `CCRC_CACHE_CONTROL`
+            `surrogate_keys`: a list/tuple of tags of stored responses or
+                a callable accepting request and response and returning one,
+                sent in `surrogate_key_header` along with tags the view set
+                in `response.surrogate_keys`. Default: `()`.
+                Django setting: `CCRC_SURROGATE_KEYS`
+            `surrogate_key_header`: header to send tags in.
+                Default: `'Surrogate-Key'`.
+                Django setting: `CCRC_SURROGATE_KEY_HEADER`
+            `size_accounting`: boolean, if `True` serialized and compressed
+                sizes of stored responses are recorded per view, see
+                `size_stats()`. Default: `False`.
+                Django setting: `CCRC_SIZE_ACCOUNTING`
+            `max_entry_size`: responses larger than this when serialized are
+                not stored, bytes or a string like `'512K'` or `'1M'`.
+                Default: `None` (unlimited).
+                Django setting: `CCRC_MAX_ENTRY_SIZE`
             `key_func`: optional callable that should be used instead of
                 built-in key function.
                 Has to accept request as its only argument and return either
@@ -92,20 +192,31 @@ class ResponseCache(object):
         self.cache = caches[kwargs.get('cache', self.cache)]
         self.key_func = kwargs.get('key_func', self._key_func)
         options = ('anonymous_only', 'cache_cookies', 'excluded_cookies',
-                   'methods', 'codes', 'nocache_req', 'nocache_rsp',
+                   'methods', 'codes', 'negative_codes', 'negative_timeout',
+                   'nocache_req', 'nocache_rsp',
                    'key_prefix', 'include_scheme', 'include_host',
-                   'hitmiss_header')
+                   'hitmiss_header', 'cache_streaming', 'streaming_max_size',
+                   'collapse', 'collapse_timeout', 'collapse_wait',
+                   'cache_control', 'surrogate_keys', 'surrogate_key_header',
+                   'size_accounting', 'max_entry_size')
         for option in options:
             setattr(self, option, kwargs.get(option, getattr(self, option)))
+        self.time_func = time.time
+        self.sleep_func = time.sleep
+        # Name of the decorated view sizes are accounted under
+        self.view_name = self.key_prefix
 
     def __call__(self, view):
         self.wrapped = view
+        self.view_name = _view_name(view)
         # Update __name__, __doc__ and __module__
         # It's impossible to change these attributes for a method, hence this
         # function
         @wraps(view)
         def _wrapper(request, *args, **kwargs):
             return self.wrapper(request, *args, **kwargs)
+        # Lets tools find keys and timeouts of the view
+        _wrapper.response_cache = self
         return _wrapper
 
     def _key_func(self, request):
@@ -162,8 +273,11 @@ class ResponseCache(object):
         Returns `True` if this response could be cached, `False` otherwise.
         """
         if getattr(response, 'streaming', False):
-            return False
-        if not response.status_code in self.codes:
+            if not self.cache_streaming or getattr(response, 'is_async',
+                                                   False):
+                return False
+        if response.status_code not in self.codes and \
+                response.status_code not in self.negative_codes:
             return False
         for header in self.nocache_rsp:
             if response.has_header(header):
@@ -183,20 +297,152 @@ class ResponseCache(object):
         hitmiss_header, hit_value, miss_value = self.hitmiss_header
         response[hitmiss_header] = hit_value if hit else miss_value
 
-    def store(self, cache_key, request, response):
+    def check_size(self, cache_key, value):
+        """
+        Records the serialized size of `value` under the view name, returns
+        `False` if it exceeds `max_entry_size` and must not be stored
+        """
+        record = self.size_accounting or recording()
+        if self.max_entry_size is None and not record:
+            return True
+        data = serialize(value)
+        if self.max_entry_size is not None and \
+                len(data) > parse_size(self.max_entry_size):
+            view_sizes.reject(self.view_name, cache_key, len(data))
+            return False
+        if record:
+            view_sizes.record(self.view_name, cache_key, data)
+        return True
+
+    def size_stats(self):
+        """
+        Returns a dictionary with numbers and sizes of responses of
+        the decorated view stored and rejected by this process
+        """
+        return view_sizes.stats(self.view_name)
+
+    def update_cdn_headers(self, request, response, timeout):
         """
-        Conditionally saves response to the cache
+        Adds `Cache-Control` and surrogate key headers letting shared caches
+        serve the response with the same staleness as the backend
+        """
+        if self.cache_control:
+            directives = set(
+                d.split('=', 1)[0].strip().lower()
+                for d in response.get('Cache-Control', '').split(','))
+            if not directives & set(('private', 'no-store', 'no-cache')):
+                mint_period = getattr(self.cache, 'mint_period', 0)
+                grace_period = getattr(self.cache, 'grace_period', 0)
+                kwargs = {'s_maxage': timeout}
+                if mint_period:
+                    kwargs['stale_while_revalidate'] = mint_period
+                if mint_period + grace_period:
+                    kwargs['stale_if_error'] = mint_period + grace_period
+                patch_cache_control(response, **kwargs)
+        tags = self.surrogate_keys
+        if callable(tags):
+            tags = tags(request, response)
+        tags = list(tags or ()) + list(getattr(response, 'surrogate_keys', ()))
+        if tags and self.surrogate_key_header:
+            response[self.surrogate_key_header] = ' '.join(
+                str(tag) for tag in tags)
+
+    def store(self, cache_key, request, response, done=None):
+        """
+        Conditionally saves response to the cache. Returns `True` if it's
+        a streaming response stored once its content is sent, then `done`
+        is called when the stream is finished or closed
         """
         if not self.should_store(request, response):
-            return
+            return False
         # Set Last-Modified to the response, if it's not set already:
         if not response.has_header('Last-Modified'):
             response['Last-Modified'] = http_date()
         # Set cache: hit header so it's always served from cache
         self.update_response(response, hit=True)
-        self.cache.set(cache_key, response, self.cache_timeout)
+        timeout = self.cache_timeout
+        if response.status_code in self.negative_codes and \
+                self.negative_timeout is not None:
+            timeout = self.negative_timeout
+        self.update_cdn_headers(request, response, timeout)
+        deferred = False
+        if getattr(response, 'streaming', False):
+            # Store it when the content is sent
+            response.streaming_content = self.tee(
+                cache_key, timeout, response.status_code,
+                list(response.items()), response.streaming_content, done)
+            deferred = True
+        elif self.check_size(cache_key, response):
+            self.cache.set(cache_key, response, timeout)
         # Add cache miss header before serving first time after missed and stored
         self.update_response(response, hit=False)
+        return deferred
+
+    def tee(self, cache_key, timeout, status_code, headers, content,
+            done=None):
+        """
+        Yields chunks of streaming `content` collecting them and stores
+        `CachedStream` if the content is sent completely and its size is
+        within `streaming_max_size`. Calls `done` afterwards, or when the
+        stream fails or is closed
+        """
+        chunks = []
+        size = 0
+        try:
+            for chunk in content:
+                if chunks is not None:
+                    size += len(chunk)
+                    if size > self.streaming_max_size:
+                        chunks = None
+                    else:
+                        chunks.append(chunk)
+                yield chunk
+            # Not reached if the client disconnects or the iterator fails
+            if chunks is not None:
+                stream = CachedStream(status_code, headers, chunks)
+                if self.check_size(cache_key, stream):
+                    self.cache.set(cache_key, stream, timeout)
+        finally:
+            if done is not None:
+                done()
+
+    def lock_key(self, cache_key):
+        """
+        Returns the key of the collapse lock. With `CalmCache` it belongs to
+        the counters namespace, so `collapse_timeout` is its real expiry
+        without mint and grace periods or jitter
+        """
+        return '%s%s:lock' % (getattr(self.cache, 'counter_prefix', ''),
+                              cache_key)
+
+    def acquire(self, cache_key):
+        """
+        Returns `True` if this request should render the response, `False`
+        if another request is already rendering it
+        """
+        return bool(self.cache.add(self.lock_key(cache_key), 1,
+                                   self.collapse_timeout))
+
+    def release(self, cache_key):
+        self.cache.delete(self.lock_key(cache_key))
+
+    def wait(self, cache_key):
+        """
+        Polls the cache with growing delays until the response rendered by
+        another request appears there or `collapse_wait` seconds pass.
+        Returns the response or `None`
+        """
+        deadline = self.time_func() + self.collapse_wait
+        delay, max_delay = self.collapse_poll
+        while True:
+            remaining = deadline - self.time_func()
+            if remaining <= 0:
+                return None
+            self.sleep_func(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+            response = self.cache.get(cache_key)
+            if response is not None:
+                return response
 
     def wrapper(self, request, *args, **kwargs):
         """
@@ -208,22 +454,55 @@ class ResponseCache(object):
             return self.wrapped(request, *args, **kwargs)
         # Fetch from cache and return if found
         cached_response = self.cache.get(cache_key)
+        if cached_response is not None and recording():
+            # Measure responses stored before, e.g. by `cache_sizes` command
+            view_sizes.record(self.view_name, cache_key,
+                              serialize(cached_response))
+        if isinstance(cached_response, CachedStream):
+            return cached_response.to_response()
         if cached_response is not None:
             return cached_response
 
+        locked = False
+        if self.collapse:
+            locked = self.acquire(cache_key)
+            if not locked:
+                cached_response = self.wait(cache_key)
+                if isinstance(cached_response, CachedStream):
+                    return cached_response.to_response()
+                if cached_response is not None:
+                    return cached_response
+                # Waited long enough, render it here
+
         # Execute the view
-        response = self.wrapped(request, *args, **kwargs)
+        try:
+            response = self.wrapped(request, *args, **kwargs)
+        except Exception:
+            if locked:
+                self.release(cache_key)
+            raise
+
+        def release():
+            if locked:
+                self.release(cache_key)
+
+        def store(r):
+            deferred = False
+            try:
+                deferred = self.store(cache_key, request, r, release)
+            finally:
+                # Streaming responses hold the lock until they are sent
+                if not deferred:
+                    release()
 
         # Check if this is TemplateResponse and it's not rendered yet
         if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
             # SimpleTemplateResponse and TemplateResponse are different
             # Should store reponses after they are rendered
-            response.add_post_render_callback(
-                lambda r: self.store(cache_key, request, r)
-            )
+            response.add_post_render_callback(store)
         else:
             # Store the response straight away
-            self.store(cache_key, request, response)
+            store(response)
         return response
 
 
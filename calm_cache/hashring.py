@@ -0,0 +1,65 @@
+"Consistent hashing ring"
+
+from bisect import bisect
+from hashlib import md5
+
+
+def _hash(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return int(md5(value).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """
+    Consistent hashing ring distributing keys among named nodes.
+
+    Every node is placed on the ring `vnodes * weight` times, so that
+    removing or adding a node only moves keys from/to that node and nodes
+    with greater weight get proportionally more keys.
+
+    Example usage:
+
+        ring = HashRing({'cache-a': 1, 'cache-b': 2}, vnodes=160)
+        ring.get_nodes('some-key', 2)  # ['cache-b', 'cache-a']
+    """
+
+    def __init__(self, nodes, vnodes=160):
+        """
+        Args:
+
+            `nodes`: a dictionary with node names as keys and weights as
+                values or a list/tuple of node names all having weight `1`
+            `vnodes`: number of points on the ring for a node of weight `1`
+        """
+        if not isinstance(nodes, dict):
+            nodes = dict((node, 1) for node in nodes)
+        self.nodes = nodes
+        points = []
+        for node, weight in nodes.items():
+            for i in range(int(vnodes * weight)):
+                points.append((_hash('%s-%d' % (node, i)), node))
+        points.sort()
+        self._hashes = [p[0] for p in points]
+        self._nodes = [p[1] for p in points]
+
+    def get_nodes(self, key, count=1):
+        """
+        Returns a list of up to `count` distinct nodes responsible for `key`,
+        the primary one goes first
+        """
+        if not self._nodes:
+            return []
+        count = min(count, len(self.nodes))
+        start = bisect(self._hashes, _hash(key))
+        result = []
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in result:
+                result.append(node)
+                if len(result) == count:
+                    break
+        return result
+
+    def get_node(self, key):
+        return self.get_nodes(key, 1)[0]
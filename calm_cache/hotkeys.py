@@ -0,0 +1,154 @@
+"Detection of hot keys and a local tier absorbing their reads"
+
+import random
+import threading
+from collections import OrderedDict
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving summary (Metwally et al.) of the most frequent items of
+    a stream using `size` counters. Every counter holds the estimated count
+    and the maximum overestimation error.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.counters = {}
+
+    def offer(self, item):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += 1
+            return
+        if len(self.counters) < self.size:
+            self.counters[item] = [1, 0]
+            return
+        # Replace the least frequent item inheriting its count as the error
+        victim = min(self.counters, key=lambda i: self.counters[i][0])
+        count = self.counters.pop(victim)[0]
+        self.counters[item] = [count + 1, count]
+
+    def top(self, k=None):
+        """
+        Returns a list of `(item, count, error)` by descending count
+        """
+        items = sorted(((item, c[0], c[1])
+                        for item, c in self.counters.items()),
+                       key=lambda i: -i[1])
+        return items[:k] if k is not None else items
+
+
+class LocalTier(object):
+    """
+    A small thread-safe LRU mapping of values expiring after `ttl` seconds
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.hits = 0
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.data.pop(key, None)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                return None
+            self.data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, now):
+        if self.size <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (value, now + self.ttl)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class HotKeys(object):
+    """
+    Finds up to `top_k` keys read at least `threshold` times per second
+    in this process. Reads are sampled at `sample_rate` and counted with
+    Space-Saving over windows of `window` seconds, keys found hot in
+    a window stay hot during the next one. Values of hot keys are kept
+    in a local tier for `local_ttl` seconds.
+    """
+
+    # Candidates tracked per hot key reported
+    candidates = 4
+
+    def __init__(self, sample_rate=0.01, top_k=20, threshold=50, window=10,
+                 local_ttl=1):
+        self.sample_rate = sample_rate
+        self.top_k = top_k
+        self.threshold = threshold
+        self.window = window
+        self.lock = threading.Lock()
+        self.summary = SpaceSaving(top_k * self.candidates)
+        self.window_start = None
+        # Estimated read rates of the hot keys by key
+        self.hot = {}
+        self.local = LocalTier(top_k, local_ttl)
+        self.rand_func = random.random
+
+    def record(self, key, now):
+        """
+        Samples a read of `key`
+        """
+        if self.rand_func() >= self.sample_rate:
+            return
+        with self.lock:
+            if self.window_start is None:
+                self.window_start = now
+            elif now - self.window_start >= self.window:
+                self._roll(now)
+            self.summary.offer(key)
+
+    def _roll(self, now):
+        elapsed = now - self.window_start
+        hot = {}
+        for key, count, error in self.summary.top(self.top_k):
+            # Guaranteed count, so rare keys are never reported
+            rate = (count - error) / self.sample_rate / elapsed
+            if rate >= self.threshold:
+                hot[key] = rate
+        self.hot = hot
+        self.summary = SpaceSaving(self.top_k * self.candidates)
+        self.window_start = now
+
+    def is_hot(self, key):
+        return key in self.hot
+
+    def get_local(self, key, cache_key, now):
+        """
+        Returns the local copy of hot `key` or `None`
+        """
+        if key not in self.hot:
+            return None
+        return self.local.get(cache_key, now)
+
+    def set_local(self, key, cache_key, value, now):
+        if key in self.hot and value is not None:
+            self.local.set(cache_key, value, now)
+
+    def hot_keys(self):
+        """
+        Returns a list of `(key, estimated reads per second)` of hot keys,
+        the hottest first
+        """
+        return sorted(self.hot.items(), key=lambda i: -i[1])
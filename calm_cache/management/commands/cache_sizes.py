@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from calm_cache.backends import CalmCache
+from calm_cache.sizes import format_size, record_sizes, view_sizes
+from calm_cache.warming import read_sitemap, warm_urls
+
+
+class Command(BaseCommand):
+    help = ("Render URLs through the views decorated with cache_response "
+            "and report sizes of their cached responses by view and of "
+            "values written to CalmCache backends by key prefix")
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*',
+                            help="URLs or paths to request")
+        parser.add_argument('--sitemap', action='append', default=[],
+                            help="Read URLs from this sitemap file. "
+                                 "Could be given several times")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of concurrent requests. Default: 4")
+        parser.add_argument('--rate', type=float, default=0,
+                            help="Maximum number of requests per second. "
+                                 "Default: 0 (unlimited)")
+        parser.add_argument('--host', default=None,
+                            help="Host: to use for relative URLs. Default: "
+                                 "first entry of ALLOWED_HOSTS")
+        parser.add_argument('--secure', action='store_true', default=False,
+                            help="Request relative URLs over HTTPS")
+
+    def report(self, title, stats):
+        """
+        Writes `stats` of groups sorted by bytes written
+        """
+        for group, s in sorted(stats.items(), key=lambda i: -i[1]['bytes']):
+            self.stdout.write(
+                "%s %s: %d writes, %s total, %s compressed, %s average, "
+                "%s max (%s), %d rejected" % (
+                    title, group, s['writes'], format_size(s['bytes']),
+                    format_size(s['compressed_bytes']),
+                    format_size(s['average_bytes']),
+                    format_size(s['max_bytes']), s['max_key'],
+                    s['rejected']))
+
+    def handle(self, *args, **options):
+        urls = list(options['urls'])
+        for sitemap in options['sitemap']:
+            try:
+                urls.extend(read_sitemap(sitemap))
+            except (IOError, OSError, SyntaxError) as e:
+                raise CommandError("Cannot read sitemap %s: %s" % (sitemap, e))
+        if not urls:
+            raise CommandError("No URLs to measure")
+
+        with record_sizes():
+            warm_urls(urls, workers=options['workers'], rate=options['rate'],
+                      host=options['host'], secure=options['secure'])
+
+        self.report("View", view_sizes.stats())
+        for alias in settings.CACHES:
+            cache = caches[alias]
+            if isinstance(cache, CalmCache):
+                self.report("Cache %s prefix" % alias, cache.size_stats())
@@ -0,0 +1,90 @@
+from itertools import product
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.management.base import BaseCommand, CommandError
+
+from calm_cache.replay import Config, map_requests, read_log, replay
+from calm_cache.sizes import format_size, parse_size
+
+
+class Command(BaseCommand):
+    help = ("Replay access logs against a model of CalmCache over an LRU "
+            "cache, reporting hit ratio, memory and regenerations for every "
+            "combination of the given settings")
+
+    def add_arguments(self, parser):
+        parser.add_argument('logs', nargs='+',
+                            help="Access logs in common/combined log format "
+                                 "or CSV of method, host, path, timestamp, "
+                                 "status, size")
+        parser.add_argument('--capacity', action='append', default=[],
+                            help="Cache size, e.g. 64M. Could be given "
+                                 "several times. Default: 64M")
+        parser.add_argument('--mint-period', type=int, action='append',
+                            default=[],
+                            help="MINT_PERIOD to try. Could be given several "
+                                 "times. Default: the one of --cache")
+        parser.add_argument('--grace-period', type=int, action='append',
+                            default=[],
+                            help="GRACE_PERIOD to try. Could be given "
+                                 "several times. Default: the one of --cache")
+        parser.add_argument('--jitter', type=int, action='append', default=[],
+                            help="JITTER to try. Could be given several "
+                                 "times. Default: the one of --cache")
+        parser.add_argument('--cache', default=DEFAULT_CACHE_ALIAS,
+                            help="Take default periods and jitter from this "
+                                 "cache. Default: %s" % DEFAULT_CACHE_ALIAS)
+        parser.add_argument('--host', default=None,
+                            help="Host: of requests from logs not "
+                                 "recording it. Default: first entry of "
+                                 "ALLOWED_HOSTS")
+        parser.add_argument('--secure', action='store_true', default=False,
+                            help="Build keys of HTTPS requests")
+        parser.add_argument('--size', default='10K',
+                            help="Response size when the log has none. "
+                                 "Default: 10K")
+        parser.add_argument('--regen-time', type=float, default=0,
+                            help="Seconds it takes to render a response. "
+                                 "Default: 0")
+
+    def handle(self, *args, **options):
+        cache = caches[options['cache']]
+        try:
+            capacities = [parse_size(c) for c in
+                          options['capacity'] or ['64M']]
+            default_size = parse_size(options['size'])
+        except ValueError as e:
+            raise CommandError("Invalid size: %s" % e)
+        configs = [Config(*c) for c in product(
+            capacities,
+            options['mint_period'] or [getattr(cache, 'mint_period', 0)],
+            options['grace_period'] or [getattr(cache, 'grace_period', 0)],
+            options['jitter'] or [getattr(cache, 'jitter', 0)])]
+
+        entries = []
+        for path in options['logs']:
+            try:
+                with open(path) as f:
+                    entries.extend(read_log(f, host=options['host']))
+            except (IOError, OSError) as e:
+                raise CommandError("Cannot read %s: %s" % (path, e))
+        if not entries:
+            raise CommandError("No requests found")
+        entries.sort(key=lambda e: e.time)
+        requests = list(map_requests(entries, secure=options['secure'],
+                                     default_size=default_size))
+
+        for config, report in replay(requests, configs,
+                                     regen_time=options['regen_time']):
+            self.stdout.write(
+                "capacity=%s mint=%d grace=%d jitter=%d: hit ratio %.1f%%, "
+                "%d hits, %d stale hits, %d misses, %d regenerations, "
+                "%d evictions, peak memory %s in %d entries, "
+                "%d requests not cached" % (
+                    format_size(config.capacity), config.mint_period,
+                    config.grace_period, config.jitter,
+                    report['hit_ratio'] * 100, report['hits'],
+                    report['stale_hits'], report['misses'],
+                    report['regenerations'], report['evictions'],
+                    format_size(report['peak_memory']),
+                    report['peak_entries'], report['uncached']))
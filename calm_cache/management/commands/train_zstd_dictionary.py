@@ -0,0 +1,66 @@
+import pickle
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Command(BaseCommand):
+    help = ("Train a zstd dictionary for ZSTD_DICTIONARIES option of "
+            "calm_cache memcached backends from cached values or files")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output',
+                            help="Write the dictionary to this file")
+        parser.add_argument('--cache', default=DEFAULT_CACHE_ALIAS,
+                            help="Read sample values from this cache. "
+                                 "Default: %s" % DEFAULT_CACHE_ALIAS)
+        parser.add_argument('--key', action='append', default=[],
+                            help="Use the value of this key as a sample. "
+                                 "Could be given several times")
+        parser.add_argument('--keys-file', action='append', default=[],
+                            help="Read sample keys from this file, "
+                                 "one per line")
+        parser.add_argument('--sample', action='append', default=[],
+                            help="Use contents of this file as a sample. "
+                                 "Could be given several times")
+        parser.add_argument('--size', type=int, default=112640,
+                            help="Dictionary size, bytes. Default: 112640")
+
+    def handle(self, *args, **options):
+        if zstandard is None:
+            raise CommandError("zstandard package is not installed")
+
+        keys = list(options['key'])
+        for path in options['keys_file']:
+            with open(path) as f:
+                keys.extend(line.strip() for line in f if line.strip())
+
+        samples = []
+        if keys:
+            cache = caches[options['cache']]
+            for key, value in cache.get_many(keys).items():
+                # Backends compress pickled values
+                samples.append(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        for path in options['sample']:
+            with open(path, 'rb') as f:
+                samples.append(f.read())
+        if not samples:
+            raise CommandError("No samples found")
+
+        try:
+            dictionary = zstandard.train_dictionary(options['size'], samples)
+        except zstandard.ZstdError as e:
+            raise CommandError("Cannot train dictionary from %d samples: %s" %
+                               (len(samples), e))
+        with open(options['output'], 'wb') as f:
+            f.write(dictionary.as_bytes())
+        if options['verbosity'] > 0:
+            self.stdout.write("Trained dictionary %d (%d bytes) from %d "
+                              "samples" % (dictionary.dict_id(),
+                                           len(dictionary.as_bytes()),
+                                           len(samples)))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from calm_cache.warming import read_sitemap, warm_urls
+
+
+class Command(BaseCommand):
+    help = ("Pre-populate the cache by rendering URLs through the views "
+            "decorated with cache_response")
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*',
+                            help="URLs or paths to request")
+        parser.add_argument('--sitemap', action='append', default=[],
+                            help="Read URLs from this sitemap file. "
+                                 "Could be given several times")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of concurrent requests. Default: 4")
+        parser.add_argument('--rate', type=float, default=0,
+                            help="Maximum number of requests per second. "
+                                 "Default: 0 (unlimited)")
+        parser.add_argument('--host', default=None,
+                            help="Host: to use for relative URLs. Default: "
+                                 "first entry of ALLOWED_HOSTS")
+        parser.add_argument('--secure', action='store_true', default=False,
+                            help="Request relative URLs over HTTPS")
+
+    def handle(self, *args, **options):
+        urls = list(options['urls'])
+        for sitemap in options['sitemap']:
+            try:
+                urls.extend(read_sitemap(sitemap))
+            except (IOError, OSError, SyntaxError) as e:
+                raise CommandError("Cannot read sitemap %s: %s" % (sitemap, e))
+        if not urls:
+            raise CommandError("No URLs to warm")
+
+        verbosity = options['verbosity']
+
+        def report(result):
+            if verbosity > 1:
+                self.stdout.write("%s %s %s" % result)
+
+        results = warm_urls(urls,
+                            workers=options['workers'],
+                            rate=options['rate'],
+                            host=options['host'],
+                            secure=options['secure'],
+                            callback=report)
+        failed = [r for r in results if r[1] is None or r[1] >= 500]
+        if verbosity > 0:
+            self.stdout.write("Warmed %d URLs, %d failed" %
+                              (len(results) - len(failed), len(failed)))
@@ -0,0 +1,99 @@
+"Request scoped memoization of CalmCache lookups"
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+_current = ContextVar('calm_cache_memo', default=None)
+
+# Lookups saved and performed by all memos of this process
+_totals = {'hits': 0, 'misses': 0}
+_totals_lock = threading.Lock()
+
+
+class RequestMemo(object):
+    """
+    Values read from and written to `CalmCache` backends during one request,
+    a separate dictionary per backend configuration
+    """
+
+    def __init__(self):
+        self.caches = {}
+        # Lookups served from the memo and the ones passed to the cache
+        self.hits = 0
+        self.misses = 0
+
+    def values(self, name):
+        """
+        Returns the dictionary of values of cache `name` by cache key
+        """
+        return self.caches.setdefault(name, {})
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def get_memo():
+    """
+    Returns `RequestMemo` of the current request or `None`
+    """
+    return _current.get()
+
+
+@contextmanager
+def request_memo():
+    """
+    Memoizes `CalmCache` lookups inside the block, yields `RequestMemo`
+    """
+    memo = RequestMemo()
+    token = _current.set(memo)
+    try:
+        yield memo
+    finally:
+        _current.reset(token)
+        with _totals_lock:
+            _totals['hits'] += memo.hits
+            _totals['misses'] += memo.misses
+
+
+def memo_totals():
+    """
+    Returns numbers of lookups saved (`hits`) and performed (`misses`) by
+    all finished request memos of this process
+    """
+    with _totals_lock:
+        return dict(_totals)
+
+
+class RequestMemoMiddleware(object):
+    """
+    Dedupes repeated `get()` and `get_many()` calls of `CalmCache` for
+    the same keys within one request, for both WSGI and ASGI.
+
+    Example configuration:
+
+        MIDDLEWARE = [
+            'calm_cache.memo.RequestMemoMiddleware',
+            ...
+        ]
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with request_memo():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with request_memo():
+            return await self.get_response(request)
@@ -0,0 +1,156 @@
+"Caching of evaluated querysets invalidated by model changes"
+
+import logging
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.exceptions import EmptyResultSet
+from django.db import transaction
+
+
+# Defaults
+ORM_CACHE = getattr(settings, 'CCORM_CACHE', DEFAULT_CACHE_ALIAS)
+ORM_TIMEOUT = getattr(settings, 'CCORM_TIMEOUT', None)
+ORM_KEY_PREFIX = getattr(settings, 'CCORM_KEY_PREFIX', 'orm')
+ORM_SIGNALS = getattr(settings, 'CCORM_SIGNALS', False)
+
+log = logging.getLogger(__name__)
+
+
+def get_cache(cache=None):
+    """
+    Returns cache backend `cache` given either as an alias or an instance
+    """
+    if cache is None or isinstance(cache, str):
+        return caches[cache or ORM_CACHE]
+    return cache
+
+
+def table_version_key(cache, table):
+    """
+    Returns the key of version counter of `table`. It starts with
+    `COUNTER_PREFIX` when `cache` is `CalmCache`, so it's incremented
+    atomically and stored without mint and grace periods.
+    """
+    return '%stable:%s' % (getattr(cache, 'counter_prefix', ''), table)
+
+
+def get_table_versions(tables, cache=None):
+    """
+    Returns a list of current versions of `tables`, creating missing ones
+    """
+    cache = get_cache(cache)
+    keys = [table_version_key(cache, table) for table in tables]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if versions.get(key) is None]
+    if missing:
+        # `None` is the backend's default timeout (`CalmCache` never stores
+        # counters forever), so counters do expire or get evicted. Start
+        # from current time, so a new counter never goes back to a version
+        # some cached result was stored with
+        initial = int(time.time() * 1000)
+        for key in missing:
+            cache.add(key, initial, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def invalidate_tables(tables, cache=None):
+    """
+    Bumps versions of `tables`, so all cached results involving any of them
+    become misses. Backend errors are logged, not raised, so a cache outage
+    doesn't fail writes to the database
+    """
+    cache = get_cache(cache)
+    for table in tables:
+        try:
+            cache.incr(table_version_key(cache, table))
+        except ValueError:
+            # No counter means no cached results depend on it
+            pass
+        except Exception:
+            log.exception("Failed to invalidate cached querysets of %s",
+                          table)
+
+
+def model_tables(model):
+    """
+    Returns tables storing instances of `model`, including its parents
+    """
+    models = [model._meta.concrete_model]
+    models.extend(model._meta.get_parent_list())
+    return sorted(set(m._meta.db_table for m in models))
+
+
+def invalidate_model(model, cache=None):
+    invalidate_tables(model_tables(model), cache)
+
+
+def queryset_tables(query):
+    """
+    Returns tables joined by compiled `query`
+    """
+    return sorted(set(join.table_name for join in query.alias_map.values()))
+
+
+def cached_queryset(queryset, timeout=None, cache=None, key_prefix=None):
+    """
+    Returns the list of results of `queryset` (model instances, or whatever
+    `values()` and `values_list()` yield) caching it under a key built from
+    its compiled SQL, parameters, database alias and current versions of
+    all tables it selects from. With `CCORM_SIGNALS` setting set to `True`
+    saving or deleting an instance of a model bumps versions of its tables,
+    otherwise call `invalidate_model()` or `invalidate_tables()` after
+    changes. Bulk updates, raw SQL, tables used only in subqueries and
+    results of `prefetch_related()` are not tracked, so they may be served
+    stale until `timeout` passes.
+
+    Example usage:
+
+        from calm_cache.orm import cached_queryset
+
+        articles = cached_queryset(
+            Article.objects.filter(published=True).select_related('author'),
+            timeout=300)
+    """
+    cache = get_cache(cache)
+    if timeout is None:
+        timeout = ORM_TIMEOUT
+    query = queryset.query.clone()
+    try:
+        sql, params = query.get_compiler(using=queryset.db).as_sql()
+    except EmptyResultSet:
+        return []
+    tables = queryset_tables(query)
+    versions = get_table_versions(tables, cache)
+    stamp = '%s:%r:%s:%r' % (sql, params, queryset.db,
+                             list(zip(tables, versions)))
+    key = '%s:%s:%s' % (key_prefix or ORM_KEY_PREFIX,
+                        queryset.model._meta.label_lower,
+                        md5(stamp.encode('utf-8')).hexdigest())
+    result = cache.get(key)
+    if result is None:
+        # Evaluate a clone, leaving result cache of `queryset` empty
+        result = list(queryset.all())
+        if timeout is None:
+            cache.set(key, result)
+        else:
+            cache.set(key, result, timeout)
+    return result
+
+
+def _invalidate_on_change(sender, using=None, **kwargs):
+    """
+    Signal receiver bumping table versions of the changed model right away
+    and once more on commit, so results read by other connections before
+    the transaction commits aren't left cached. Connected only when
+    `CCORM_SIGNALS` setting is `True`
+    """
+    if kwargs.get('action', 'post_').startswith('pre_'):
+        # m2m_changed is sent both before and after the change
+        return
+    tables = model_tables(sender)
+    invalidate_tables(tables)
+    transaction.on_commit(lambda: invalidate_tables(tables), using=using)
@@ -0,0 +1,168 @@
+"Proactive refreshing of registered CalmCache keys"
+
+import logging
+import threading
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+
+
+log = logging.getLogger(__name__)
+
+
+class RefreshEntry(object):
+
+    def __init__(self, key, loader, timeout, version):
+        self.key = key
+        self.loader = loader
+        self.timeout = timeout
+        self.version = version
+        self.hits = 0
+
+
+class Refresher(object):
+    """
+    Keeps popular keys of a `CalmCache` backend fresh by calling their
+    loaders shortly before the stored values become stale, so that clients
+    never get a miss at the beginning of the mint period.
+
+    Example usage:
+
+        from calm_cache.refresh import Refresher
+
+        refresher = Refresher(cache='default', interval=1, min_hits=10)
+        refresher.register('front-page', render_front_page, 60)
+
+        @refresher.loader('top-articles', 300)
+        def top_articles():
+            return list(Article.objects.top())
+
+        refresher.start()
+    """
+
+    def __init__(self, cache=DEFAULT_CACHE_ALIAS, interval=1, lead_time=None,
+                 min_hits=1):
+        """
+        Args:
+
+            `cache`: name of `CalmCache` backend. Default: default backend
+            `interval`: seconds between two checks of registered keys.
+                Default: `1`
+            `lead_time`: keys are refreshed this many seconds before their
+                refresh time. Default: `2 * interval`
+            `min_hits`: minimal number of reads of a key since its last
+                refresh that makes it worth refreshing. Default: `1`
+        """
+        self.cache_alias = cache
+        self.interval = interval
+        self.lead_time = 2 * interval if lead_time is None else lead_time
+        self.min_hits = min_hits
+        self.entries = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.cache.access_hooks.append(self.record_access)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def register(self, key, loader, timeout=None, version=None):
+        """
+        Registers `loader`, a callable without arguments, producing the value
+        for `key` that will be stored for `timeout` seconds
+        """
+        self.entries[(key, version)] = RefreshEntry(key, loader, timeout,
+                                                    version)
+
+    def unregister(self, key, version=None):
+        self.entries.pop((key, version), None)
+
+    def loader(self, key, timeout=None, version=None):
+        """
+        Decorator registering decorated function as a loader for `key`.
+
+        The decorated function reads the value through the cache, calling
+        the loader only on a miss.
+        """
+        def decorator(func):
+            self.register(key, func, timeout, version)
+
+            def _get():
+                value = self.cache.get(key, version=version)
+                if value is None:
+                    value = func()
+                    self.cache.set(key, value, timeout, version=version)
+                return value
+            _get.__name__ = func.__name__
+            _get.__doc__ = func.__doc__
+            return _get
+        return decorator
+
+    def record_access(self, key, version):
+        entry = self.entries.get((key, version))
+        if entry is not None:
+            entry.hits += 1
+
+    def needs_refresh(self, entry, now):
+        if entry.hits < self.min_hits:
+            return False
+        cache = self.cache
+        refresh_time = cache.get_refresh_time(entry.key, version=entry.version)
+        if refresh_time is None:
+            return True
+        if not cache.packing_enabled:
+            return False
+        return refresh_time - self.lead_time <= now
+
+    def refresh(self, entry):
+        try:
+            value = entry.loader()
+        except Exception:
+            log.exception("Failed to refresh %r", entry.key)
+            return False
+        entry.hits = 0
+        self.cache.set(entry.key, value, entry.timeout, version=entry.version)
+        return True
+
+    def run_once(self):
+        """
+        Refreshes all registered keys that are due. Returns refreshed keys
+        """
+        now = self.cache._time()
+        refreshed = []
+        for entry in list(self.entries.values()):
+            if self.needs_refresh(entry, now) and self.refresh(entry):
+                refreshed.append(entry.key)
+        return refreshed
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("Refresher iteration failed")
+
+    def start(self):
+        """
+        Starts refreshing in a background daemon thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run,
+                                        name='calm-cache-refresher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """
+        Stops refreshing and detaches from the cache backend
+        """
+        self.stop()
+        if self.record_access in self.cache.access_hooks:
+            self.cache.access_hooks.remove(self.record_access)
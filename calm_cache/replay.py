@@ -0,0 +1,247 @@
+"Replaying access logs against a model of CalmCache to size and tune it"
+
+import csv
+import heapq
+import random
+import re
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+
+from django.test.client import RequestFactory
+from django.urls import resolve, Resolver404
+
+from calm_cache.warming import default_host
+
+
+# Common and combined log formats, Host: is not logged there
+LOG_RE = re.compile(
+    r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" '
+    r'(?P<status>\d{3}) (?P<size>\d+|-)')
+LOG_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+# Request from the log: time is a UNIX timestamp, size and status
+# are `None` when unknown
+LogEntry = namedtuple('LogEntry', 'time method host path status size')
+
+# Request mapped to the cache: key and timeout are `None` for requests
+# that are not cached
+CacheRequest = namedtuple('CacheRequest', 'time key timeout size storable')
+
+# Simulation parameters, sizes are in bytes, periods in seconds
+Config = namedtuple('Config', 'capacity mint_period grace_period jitter')
+
+
+def parse_time(value):
+    """
+    Returns UNIX timestamp of a log timestamp, ISO 8601 date or a number
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, LOG_TIME_FORMAT).timestamp()
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def read_log(lines, host=None):
+    """
+    Yields `LogEntry` for every line of common or combined log format or of
+    CSV with method, host, path, timestamp and, optionally, status and size
+    columns. Lines that can't be parsed are skipped.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        match = LOG_RE.match(line)
+        if match is not None:
+            size = match.group('size')
+            yield LogEntry(parse_time(match.group('time')),
+                           match.group('method'), host, match.group('path'),
+                           int(match.group('status')),
+                           None if size == '-' else int(size))
+            continue
+        try:
+            row = next(csv.reader([line]))
+            entry = LogEntry(parse_time(row[3]), row[0].upper(),
+                             row[1] or host, row[2],
+                             int(row[4]) if len(row) > 4 and row[4] else None,
+                             int(row[5]) if len(row) > 5 and row[5] else None)
+        except (IndexError, ValueError):
+            continue
+        yield entry
+
+
+def find_response_cache(path, urlconf=None):
+    """
+    Returns `ResponseCache` of the view `path` is routed to, if it's
+    decorated with `cache_response`
+    """
+    try:
+        match = resolve(path.split('?', 1)[0], urlconf)
+    except Resolver404:
+        return None
+    return getattr(match.func, 'response_cache', None)
+
+
+def map_requests(entries, secure=False, default_size=10240, urlconf=None):
+    """
+    Yields `CacheRequest` for every `LogEntry`, building keys with
+    `key_func` of `ResponseCache` of the view the path is routed to
+    """
+    factory = RequestFactory()
+    for entry in entries:
+        rsp_cache = find_response_cache(entry.path, urlconf)
+        size = entry.size if entry.size is not None else default_size
+        key = None
+        timeout = None
+        storable = False
+        if rsp_cache is not None:
+            request = factory.generic(entry.method, entry.path, secure=secure,
+                                      HTTP_HOST=entry.host or default_host())
+            try:
+                if rsp_cache.should_fetch(request):
+                    key = rsp_cache.key_func(request)
+            except Exception:
+                # e.g. Host: not in ALLOWED_HOSTS
+                key = None
+            status = entry.status if entry.status is not None else 200
+            timeout = rsp_cache.cache_timeout
+            if status in rsp_cache.negative_codes and \
+                    rsp_cache.negative_timeout is not None:
+                timeout = rsp_cache.negative_timeout
+            storable = status in rsp_cache.codes or \
+                status in rsp_cache.negative_codes
+        yield CacheRequest(entry.time, key, timeout, size, storable)
+
+
+class Simulator(object):
+    """
+    A model of `CalmCache` over an LRU cache of `capacity` bytes running in
+    the virtual time of replayed requests, so hours of traffic take seconds.
+
+    Every miss regenerates the response, which is stored `regen_time`
+    seconds later. Like `CalmCache`, the first request after the timeout
+    regenerates it while others get the stale value during the mint period,
+    and the stale value is served once more during the grace period.
+    Entries take `overhead` bytes in addition to their keys and responses.
+    """
+
+    def __init__(self, config, regen_time=0, overhead=64, seed=0):
+        self.config = config
+        self.regen_time = regen_time
+        self.overhead = overhead
+        self.rand = random.Random(seed)
+        # key: [size, refresh time, expiry time, refreshing]
+        self.entries = OrderedDict()
+        self.pending = []
+        self.memory = 0
+        self.stats = dict.fromkeys((
+            'requests', 'uncached', 'hits', 'stale_hits', 'misses',
+            'regenerations', 'evictions', 'peak_memory', 'peak_entries'), 0)
+
+    def _expire(self, key, entry, now):
+        if entry[2] <= now:
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.memory -= entry[0]
+
+    def store(self, key, size, timeout, now):
+        config = self.config
+        size += len(key) + self.overhead
+        self._remove(key)
+        if size > config.capacity:
+            return
+        jitter = self.rand.randint(0, config.jitter) if config.jitter else 0
+        refresh = now + timeout + jitter
+        self.entries[key] = [size, refresh, refresh + config.mint_period +
+                             config.grace_period, False]
+        self.memory += size
+        while self.memory > config.capacity:
+            self._remove(next(iter(self.entries)))
+            self.stats['evictions'] += 1
+        self.stats['peak_memory'] = max(self.stats['peak_memory'],
+                                        self.memory)
+        self.stats['peak_entries'] = max(self.stats['peak_entries'],
+                                         len(self.entries))
+
+    def regenerate(self, request):
+        self.stats['regenerations'] += 1
+        if not request.storable:
+            return
+        done = request.time + self.regen_time
+        if self.regen_time <= 0:
+            self.store(request.key, request.size, request.timeout, done)
+        else:
+            heapq.heappush(self.pending, (done, request.key, request.size,
+                                          request.timeout))
+
+    def access(self, request):
+        """
+        Replays one `CacheRequest`
+        """
+        now = request.time
+        while self.pending and self.pending[0][0] <= now:
+            done, key, size, timeout = heapq.heappop(self.pending)
+            self.store(key, size, timeout, done)
+        self.stats['requests'] += 1
+        if request.key is None:
+            self.stats['uncached'] += 1
+            return
+        entry = self.entries.get(request.key)
+        if entry is not None:
+            entry = self._expire(request.key, entry, now)
+        if entry is None:
+            self.stats['misses'] += 1
+            self.regenerate(request)
+            return
+        self.entries.move_to_end(request.key)
+        size, refresh, expiry, refreshing = entry
+        if now <= refresh:
+            self.stats['hits'] += 1
+        elif now <= refresh + self.config.mint_period:
+            if refreshing:
+                self.stats['stale_hits'] += 1
+            else:
+                # The first request in the mint period regenerates it
+                entry[3] = True
+                self.stats['misses'] += 1
+                self.regenerate(request)
+        else:
+            # Grace period: served stale once and removed
+            self.stats['stale_hits'] += 1
+            self._remove(request.key)
+
+    def report(self):
+        """
+        Returns statistics with `hit_ratio` of requests to cached views
+        """
+        stats = dict(self.stats)
+        cached = stats['requests'] - stats['uncached']
+        stats['hit_ratio'] = (float(stats['hits'] + stats['stale_hits']) /
+                              cached if cached else 0.0)
+        stats['memory'] = self.memory
+        return stats
+
+
+def replay(requests, configs, regen_time=0, overhead=64):
+    """
+    Replays a list of `CacheRequest` sorted by time for every `Config`,
+    returns a list of `(config, report)`
+    """
+    results = []
+    for config in configs:
+        simulator = Simulator(config, regen_time=regen_time,
+                              overhead=overhead)
+        for request in requests:
+            simulator.access(request)
+        results.append((config, simulator.report()))
+    return results
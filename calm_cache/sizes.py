@@ -0,0 +1,157 @@
+"Accounting of sizes of values written to caches"
+
+import logging
+import pickle
+import threading
+import zlib
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+# Number of active `record_sizes()` blocks
+_recording = [0]
+_recording_lock = threading.Lock()
+
+
+@contextmanager
+def record_sizes():
+    """
+    Makes all `CalmCache` backends and `cache_response` views account
+    sizes inside the block regardless of their settings
+    """
+    with _recording_lock:
+        _recording[0] += 1
+    try:
+        yield
+    finally:
+        with _recording_lock:
+            _recording[0] -= 1
+
+
+def recording():
+    return _recording[0] > 0
+
+
+def serialize(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def parse_size(value):
+    """
+    Returns number of bytes of a size like `512`, `64K`, `64M` or `1G`
+    """
+    value = str(value).strip().upper()
+    multiplier = 1
+    if value and value[-1] in 'KMG':
+        multiplier = 1024 ** ('KMG'.index(value[-1]) + 1)
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def format_size(size):
+    """
+    Returns `size` in bytes in the form accepted by `parse_size()`
+    """
+    for unit in ('', 'K', 'M'):
+        if size < 1024:
+            return '%g%s' % (round(size, 1), unit)
+        size /= 1024.0
+    return '%gG' % round(size, 1)
+
+
+def max_entry_size(limits, group):
+    """
+    Returns the size limit of `group` in bytes given `limits` as a size
+    accepted by `parse_size()`, a dictionary of them by group with optional
+    `'*'` default, or `None`
+    """
+    if isinstance(limits, dict):
+        limits = limits.get(group, limits.get('*'))
+    return parse_size(limits) if limits is not None else None
+
+
+class SizeStats(object):
+    """
+    Sizes of values written under one group (key prefix or view)
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+        self.compressed_bytes = 0
+        self.max_bytes = 0
+        self.max_key = None
+        self.rejected = 0
+        self.rejected_bytes = 0
+
+    def describe(self):
+        return {
+            'writes': self.writes,
+            'bytes': self.bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'average_bytes': self.bytes // self.writes if self.writes else 0,
+            'max_bytes': self.max_bytes,
+            'max_key': self.max_key,
+            'rejected': self.rejected,
+            'rejected_bytes': self.rejected_bytes,
+        }
+
+
+class SizeAccounting(object):
+    """
+    Thread-safe statistics of serialized and compressed (with fast zlib
+    level, as an estimate of what compressing backends store) sizes of
+    written values by group. Once `max_groups` groups are tracked, values of
+    new ones are recorded under `'*'`
+    """
+
+    # Maximum number of groups with their own statistics
+    max_groups = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def _group(self, group):
+        if group not in self.groups and len(self.groups) >= self.max_groups:
+            group = '*'
+        return self.groups.setdefault(group, SizeStats())
+
+    def record(self, group, key, data):
+        compressed = len(zlib.compress(data, 1))
+        with self.lock:
+            stats = self._group(group)
+            stats.writes += 1
+            stats.bytes += len(data)
+            stats.compressed_bytes += compressed
+            if len(data) > stats.max_bytes:
+                stats.max_bytes = len(data)
+                stats.max_key = key
+
+    def reject(self, group, key, size):
+        log.warning("Not caching %r of %d bytes exceeding the limit of %r",
+                    key, size, group)
+        with self.lock:
+            stats = self._group(group)
+            stats.rejected += 1
+            stats.rejected_bytes += size
+
+    def stats(self, group=None):
+        """
+        Returns a dictionary describing sizes written under `group`, or
+        a dictionary of them for all groups, if `group` is not given
+        """
+        with self.lock:
+            if group is not None:
+                stats = self.groups.get(group)
+                return stats.describe() if stats is not None else None
+            return dict((g, s.describe()) for g, s in self.groups.items())
+
+    def clear(self):
+        with self.lock:
+            self.groups.clear()
+
+
+# Sizes of responses stored by `cache_response` by view
+view_sizes = SizeAccounting()
@@ -0,0 +1,123 @@
+"Persisted snapshots of process-local cache entries for warm restarts"
+
+import mmap
+import os
+import struct
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+MAGIC = b'CCSNAP01'
+
+# magic, number of entries
+HEADER = struct.Struct('<8sI')
+# key length, value length, expiry time (0 - never),
+# refresh time (0 - unknown)
+ENTRY = struct.Struct('<HIdd')
+
+
+def _check_backend(cache):
+    if not all(hasattr(cache, a) for a in ('_cache', '_expire_info', '_lock')):
+        raise ImproperlyConfigured(
+            "Snapshots are only supported for LocMemCache, not %s" %
+            cache.__class__.__name__)
+
+
+def dump_snapshot(cache, path, size=1000, refresh_time=None):
+    """
+    Writes up to `size` most recently used live entries of `LocMemCache`
+    backend `cache` to file `path`, replacing it atomically.
+    `refresh_time(pickled)` returns the time when the entry becomes stale,
+    it is stored along with the entry. Returns the number of entries written.
+    """
+    _check_backend(cache)
+    now = time.time()
+    entries = []
+    with cache._lock:
+        # LocMemCache keeps the most recently used entries first
+        for key, pickled in cache._cache.items():
+            expiry = cache._expire_info.get(key)
+            if expiry is not None and expiry <= now:
+                continue
+            entries.append((key, pickled, expiry))
+            if len(entries) >= size:
+                break
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for key, pickled, expiry in entries:
+            key = key.encode('utf-8')
+            refresh = refresh_time(pickled) if refresh_time else 0
+            f.write(ENTRY.pack(len(key), len(pickled), expiry or 0,
+                               refresh or 0))
+            f.write(key)
+            f.write(pickled)
+    os.rename(tmp_path, path)
+    return len(entries)
+
+
+def read_snapshot(path, now=None):
+    """
+    Returns a list of `(key, pickled value, expiry time)` of entries stored
+    in snapshot `path` that have neither expired nor become stale by `now`,
+    the most recently used first. Missing, foreign or truncated snapshot
+    yields as many entries as could be read.
+    """
+    if now is None:
+        now = time.time()
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return []
+    with f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            return []
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    entries = []
+    try:
+        magic, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            return []
+        offset = HEADER.size
+        for _ in range(count):
+            key_len, value_len, expiry, refresh = ENTRY.unpack_from(data,
+                                                                    offset)
+            offset += ENTRY.size
+            end = offset + key_len + value_len
+            if end > len(data):
+                break
+            if (expiry and expiry <= now) or (refresh and refresh <= now):
+                offset = end
+                continue
+            key = data[offset:offset + key_len].decode('utf-8')
+            entries.append((key, data[offset + key_len:end], expiry or None))
+            offset = end
+    except struct.error:
+        pass
+    finally:
+        data.close()
+    return entries
+
+
+def load_snapshot(cache, path, now=None):
+    """
+    Loads live entries of snapshot `path` into `LocMemCache` backend `cache`
+    up to its `MAX_ENTRIES`, keeping entries it already has.
+    Returns the number of entries loaded.
+    """
+    _check_backend(cache)
+    entries = read_snapshot(path, now)
+    loaded = 0
+    with cache._lock:
+        room = max(cache._max_entries - len(cache._cache), 0)
+        # Insert the hottest entries last, so they end up first
+        for key, pickled, expiry in reversed(entries[:room]):
+            if key in cache._cache:
+                continue
+            cache._cache[key] = pickled
+            cache._cache.move_to_end(key, last=False)
+            cache._expire_info[key] = expiry
+            loaded += 1
+    return loaded
@@ -0,0 +1,183 @@
+"Template fragment caching through CalmCache with batched lookups"
+
+from hashlib import md5
+
+from django import template
+from django.core.cache import caches, InvalidCacheBackendError
+from django.template import Node, TemplateSyntaxError, VariableDoesNotExist
+from django.template.defaulttags import ForNode
+
+from calm_cache.backends import CalmCache
+
+
+register = template.Library()
+
+# render_context key of fragments fetched by {% calmcache_prefetch %}
+PREFETCHED = 'calm_cache_prefetched'
+
+
+def make_fragment_key(name, vary_on=None):
+    """
+    Returns cache key of fragment `name` varying on `vary_on` values
+    """
+    vary = ':'.join(str(v) for v in vary_on or ())
+    return 'fragment.%s:%s' % (name, md5(vary.encode('utf-8')).hexdigest())
+
+
+def default_alias():
+    try:
+        caches['template_fragments']
+    except InvalidCacheBackendError:
+        return 'default'
+    return 'template_fragments'
+
+
+class CalmCacheNode(Node):
+
+    def __init__(self, nodelist, timeout, name, vary_on, using, jitter):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.vary_on = vary_on
+        self.using = using
+        self.jitter = jitter
+
+    def resolve(self, context):
+        """
+        Returns `(alias, key)` of the fragment in `context`
+        """
+        alias = self.using.resolve(context) if self.using else default_alias()
+        vary_on = [v.resolve(context) for v in self.vary_on]
+        return alias, make_fragment_key(self.name, vary_on)
+
+    def render(self, context):
+        try:
+            timeout = self.timeout.resolve(context)
+        except VariableDoesNotExist:
+            raise TemplateSyntaxError(
+                '"calmcache" tag got an unknown variable: %r' %
+                self.timeout.var)
+        if timeout is not None:
+            try:
+                timeout = int(timeout)
+            except (ValueError, TypeError):
+                raise TemplateSyntaxError(
+                    '"calmcache" tag got a non-integer timeout value: %r' %
+                    timeout)
+        alias, key = self.resolve(context)
+        cache = caches[alias]
+        prefetched = context.render_context.get(PREFETCHED, {})
+        if (alias, key) in prefetched:
+            value = prefetched.pop((alias, key))
+        else:
+            value = cache.get(key)
+        if value is None:
+            value = self.nodelist.render(context)
+            kwargs = {}
+            if self.jitter is not None and isinstance(cache, CalmCache):
+                kwargs['jitter'] = int(self.jitter.resolve(context))
+            cache.set(key, value, timeout, **kwargs)
+        return value
+
+
+class CalmCachePrefetchNode(Node):
+
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def fragments(self, nodelist):
+        """
+        Yields fragment nodes rendered once per rendering of `nodelist`
+        """
+        for node in nodelist:
+            if isinstance(node, CalmCacheNode):
+                yield node
+                continue
+            if isinstance(node, ForNode):
+                # Loop variables can't be resolved before the loop runs
+                continue
+            for attr in node.child_nodelists:
+                child = getattr(node, attr, None)
+                if child:
+                    for fragment in self.fragments(child):
+                        yield fragment
+
+    def render(self, context):
+        keys = {}
+        for node in self.fragments(self.nodelist):
+            try:
+                alias, key = node.resolve(context)
+            except VariableDoesNotExist:
+                continue
+            keys.setdefault(alias, []).append(key)
+        prefetched = context.render_context.setdefault(PREFETCHED, {})
+        for alias, aliased_keys in keys.items():
+            found = caches[alias].get_many(aliased_keys)
+            for key in aliased_keys:
+                prefetched[(alias, key)] = found.get(key)
+        return self.nodelist.render(context)
+
+
+@register.tag('calmcache')
+def do_calmcache(parser, token):
+    """
+    Caches the contents of a template fragment for a given amount of time
+    in `CalmCache`, so stale fragments are served while one request
+    re-renders them.
+
+    Usage::
+
+        {% load calm_cache %}
+        {% calmcache [timeout] [fragment_name] [var1] [var2] ..
+            [using="cachename"] [jitter=10] %}
+            .. some expensive processing ..
+        {% endcalmcache %}
+
+    The fragment is stored in `template_fragments` cache if it exists,
+    otherwise in `default` one. `timeout` of `None` is passed to the cache
+    as is: `CalmCache` uses its default timeout plus mint and grace periods,
+    other Django backends keep the fragment forever.
+    `jitter` overrides `JITTER` of `CalmCache` for this fragment.
+    """
+    nodelist = parser.parse(('endcalmcache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise TemplateSyntaxError(
+            "'%r' tag requires at least 2 arguments." % tokens[0])
+    using = jitter = None
+    while len(tokens) > 3:
+        if tokens[-1].startswith('using='):
+            using = parser.compile_filter(tokens.pop()[len('using='):])
+        elif tokens[-1].startswith('jitter='):
+            jitter = parser.compile_filter(tokens.pop()[len('jitter='):])
+        else:
+            break
+    return CalmCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(t) for t in tokens[3:]],
+        using,
+        jitter,
+    )
+
+
+@register.tag('calmcache_prefetch')
+def do_calmcache_prefetch(parser, token):
+    """
+    Fetches all fragments of `{% calmcache %}` tags inside the block with
+    one `get_many()` call per cache before rendering it.
+    Fragments inside `{% for %}` loops are fetched one by one.
+
+    Usage::
+
+        {% load calm_cache %}
+        {% calmcache_prefetch %}
+            {% calmcache 600 header request.user.pk %}..{% endcalmcache %}
+            {% calmcache 60 sidebar %}..{% endcalmcache %}
+        {% endcalmcache_prefetch %}
+    """
+    nodelist = parser.parse(('endcalmcache_prefetch',))
+    parser.delete_first_token()
+    return CalmCachePrefetchNode(nodelist)
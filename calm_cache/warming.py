@@ -0,0 +1,143 @@
+"Cache warming helpers"
+
+import threading
+import time
+from xml.etree import ElementTree
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.test.client import Client
+
+from calm_cache.decorators import ResponseCache
+
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to `wait()` so that no more than `rate` calls per second
+    are let through, regardless of the number of threads calling it.
+
+    `rate` of `0` or `None` disables limiting.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_slot = 0
+        self.lock = threading.Lock()
+        self.time_func = time.time
+        self.sleep_func = time.sleep
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = self.time_func()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            self.sleep_func(slot - now)
+
+
+def read_sitemap(path):
+    """
+    Returns the list of URLs found in `<loc>` elements of a sitemap file
+    """
+    tree = ElementTree.parse(path)
+    urls = []
+    for element in tree.iter():
+        if element.tag in ('loc', SITEMAP_NS + 'loc') and element.text:
+            urls.append(element.text.strip())
+    return urls
+
+
+def default_host():
+    """
+    First non-wildcard entry of `ALLOWED_HOSTS`, `localhost` otherwise
+    """
+    for host in settings.ALLOWED_HOSTS:
+        if host and '*' not in host and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+def warm_url(client, url, host=None, secure=False):
+    """
+    Requests a single URL with the given client and returns a tuple
+    `(url, status code, hit/miss header value)`.
+
+    Absolute URLs (as found in sitemaps) override `host` and `secure`, so
+    that resulting cache keys match the ones built for real traffic.
+    """
+    parts = urlsplit(url)
+    if parts.netloc:
+        host = parts.netloc
+        secure = parts.scheme == 'https'
+    path = parts.path or '/'
+    if parts.query:
+        path = '%s?%s' % (path, parts.query)
+    response = client.get(path, HTTP_HOST=host or default_host(),
+                          secure=secure)
+    hitmiss_header = ResponseCache.hitmiss_header
+    hitmiss = response.get(hitmiss_header[0]) if hitmiss_header else None
+    return (url, response.status_code, hitmiss)
+
+
+def warm_urls(urls, workers=4, rate=0, host=None, secure=False,
+              callback=None):
+    """
+    Renders `urls` through the full Django request handling stack so that
+    views decorated with `cache_response` store their responses with their
+    own keys and timeouts (including jitter, if the backend adds it).
+
+    Requests are performed by at most `workers` threads and are limited to
+    `rate` requests per second in total (`0` for no limit).
+
+    `callback`, if given, is called with each result as soon as it's
+    available. Returns the list of `(url, status code, hit/miss)` tuples.
+    """
+    queue = Queue()
+    for url in urls:
+        queue.put(url)
+    limiter = RateLimiter(rate)
+    results = []
+    results_lock = threading.Lock()
+
+    def worker():
+        client = Client(raise_request_exception=False)
+        try:
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except Empty:
+                    return
+                limiter.wait()
+                try:
+                    result = warm_url(client, url, host=host, secure=secure)
+                except Exception as e:
+                    result = (url, None, repr(e))
+                with results_lock:
+                    results.append(result)
+                    if callback is not None:
+                        callback(result)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(workers, queue.qsize())))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
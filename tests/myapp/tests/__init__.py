@@ -1,4 +1,21 @@
 from .test_calmcache import CalmCacheTest
 from .test_key_func import KeyFuncTest
-from .test_memcache import MemcacheZipMixinTest, BinPyLibMCCacheTest
+from .test_memcache import (
+    MemcacheZipMixinTest, BinPyLibMCCacheTest, PooledMCMixinTest,
+    NoReplyMCMixinTest, WritePipelineMCMixinTest, ChunkedMCMixinTest,
+    ZstdMCMixinTest)
 from .test_response_cache import ResponseCacheTest
+from .test_warming import WarmingTest
+from .test_refresh import RefresherTest
+from .test_adaptive import AdaptiveTest
+from .test_hashring import HashRingTest, ShardedCalmCacheTest
+from .test_breaker import CircuitBreakerTest, CalmCacheBreakerTest
+from .test_metacache import MetaMemcachedCacheTest, CalmCacheMetaTest
+from .test_mmapcache import MmapCacheTest
+from .test_snapshot import SnapshotTest
+from .test_templatetags import CalmCacheTagTest
+from .test_orm import CachedQuerysetTest
+from .test_memo import RequestMemoTest
+from .test_hotkeys import HotKeysTest
+from .test_replay import ReplayTest
+from .test_sizes import SizesTest
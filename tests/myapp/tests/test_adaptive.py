@@ -0,0 +1,151 @@
+import threading
+
+from django.test import TestCase
+from django.core.cache import caches
+
+from calm_cache.adaptive import AdaptiveTuner, PrefixStats, key_prefix_of
+from calm_cache.backends import CalmCache
+
+testcache = caches['testcache']
+
+
+class AdaptiveTest(TestCase):
+
+    def setUp(self):
+        self.cache = CalmCache('testcache', {
+            'KEY_PREFIX': 'adaptive-%s' % self._testMethodName,
+            'OPTIONS': {
+                'MINT_PERIOD': 2,
+                'GRACE_PERIOD': 10,
+                'JITTER': 1,
+                'ADAPTIVE': True,
+                'MAX_MINT_PERIOD': 30,
+                'MAX_JITTER': 20,
+            }})
+        self.now = 100
+        self.cache.time_func = lambda: self.now
+        self.cache.rand_func = lambda x, y: y
+
+    def tearDown(self):
+        testcache.clear()
+
+    def test_key_prefix_of(self):
+        self.assertEqual(key_prefix_of('article:12:body'), 'article')
+        self.assertEqual(key_prefix_of(b'article:12'), 'article')
+        self.assertEqual(key_prefix_of('plain'), 'plain')
+        self.assertEqual(key_prefix_of('a/b', '/'), 'a')
+        self.assertEqual(key_prefix_of('plain', ':', '*'), '*')
+        self.assertEqual(key_prefix_of('a:b', ':', '*'), 'a')
+
+    def test_static_values_without_statistics(self):
+        self.assertEqual(self.cache.get_mint_period('article:1'), 2)
+        self.assertEqual(self.cache.get_jitter('article:1'), 1)
+        self.assertEqual(self.cache.tuning('article')['mint_period'], 2)
+
+    def test_regeneration_time_widens_mint_and_jitter(self):
+        # Miss, then regenerate for 4 seconds
+        self.assertIsNone(self.cache.get('slow:1'))
+        self.now += 4
+        self.cache.set('slow:1', 'value', 60)
+        tuning = self.cache.tuning('slow')
+        self.assertEqual(tuning['regen_time'], 4)
+        self.assertEqual(tuning['regenerations'], 1)
+        self.assertEqual(tuning['mint_period'], 8)
+        self.assertEqual(tuning['jitter'], 20)
+        # Stored refresh time includes the adapted jitter
+        self.assertEqual(testcache.get(self.cache.make_key('slow:1')),
+                         ('value', 104 + 60 + 20, False))
+        # Other prefixes are not affected
+        self.assertIsNone(self.cache.get('fast:1'))
+        self.cache.set('fast:1', 'value', 60)
+        self.assertEqual(self.cache.tuning('fast')['mint_period'], 2)
+        self.assertEqual(self.cache.tuning('fast')['jitter'], 1)
+
+    def test_mint_refresh_is_not_a_regeneration(self):
+        self.cache.set('k:1', 'value', 10)
+        self.now = 100 + 10 + 1 + 1
+        # Mint miss, the value is re-set as refreshing
+        self.assertIsNone(self.cache.get('k:1'))
+        self.assertEqual(self.cache.tuning('k')['regenerations'], 0)
+        self.now += 1
+        self.cache.set('k:1', 'new value', 10)
+        self.assertEqual(self.cache.tuning('k')['regenerations'], 1)
+        self.assertEqual(self.cache.tuning('k')['regen_time'], 1)
+
+    def test_stale_serves_counted(self):
+        self.cache.set('g:1', 'value', 10)
+        self.now = 100 + 10 + 1 + 2 + 1
+        self.assertEqual(self.cache.get('g:1'), 'value')
+        self.assertEqual(self.cache.tuning('g')['stale_serves'], 1)
+        self.assertEqual(self.cache.tuning()['g']['reads'], 1)
+
+    def test_stale_serves_stretch_mint_to_read_interval(self):
+        tuner = AdaptiveTuner(1, 30, 0, 10, window=10)
+        stats = PrefixStats(0, 10)
+        stats.record_miss('k', 0)
+        stats.record_set('k', 1)
+        self.assertEqual(tuner.mint_period(stats, 1), 2)
+        # One read every 5 seconds, one of them served stale in grace period
+        for t in (0, 5, 10):
+            stats.record_read(t)
+        stats.record_stale(10)
+        stats.record_read(20)
+        self.assertEqual(tuner.mint_period(stats, 20), 10)
+
+    def test_bounds(self):
+        tuner = AdaptiveTuner(2, 5, 1, 3)
+        stats = PrefixStats(0, 60)
+        stats.record_miss('k', 0)
+        stats.record_set('k', 100)
+        self.assertEqual(tuner.mint_period(stats, 100), 5)
+        self.assertEqual(tuner.jitter(stats), 3)
+
+    def test_pending_misses_bounded(self):
+        stats = PrefixStats(0, 10)
+        stats.max_pending = 2
+        for i in range(3):
+            stats.record_miss('k%d' % i, i)
+        # The oldest miss makes room for new ones
+        self.assertEqual(list(stats.pending), ['k1', 'k2'])
+        stats.record_miss('k3', 1000)
+        # Misses never followed by set() are dropped
+        self.assertEqual(list(stats.pending), ['k3'])
+        stats.record_set('k3', 1001)
+        self.assertEqual(stats.regen_time, 1)
+
+    def test_pending_misses_threads(self):
+        stats = PrefixStats(0, 10)
+        stats.max_pending = 10
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(2000):
+                    stats.record_miss('k%d-%d' % (n, i), i)
+                    stats.record_set('k%d-%d' % (n, i - 5), i)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(n, ))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(stats.pending), 10)
+
+    def test_unprefixed_keys_share_stats(self):
+        tuner = AdaptiveTuner(1, 30, 0, 10)
+        tuner.max_prefixes = 3
+        for i in range(10):
+            tuner.get_stats('#GET#http#host#/page/%d' % i, 0)
+        self.assertEqual(list(tuner.stats), ['*'])
+        for i in range(5):
+            tuner.get_stats('prefix%d:key' % i, 0)
+        # New prefixes go to the shared statistics over the limit
+        self.assertEqual(sorted(tuner.stats), ['*', 'prefix0', 'prefix1'])
+        self.assertIs(tuner.get_stats('prefix4:key', 0), tuner.stats['*'])
+
+    def test_disabled(self):
+        self.assertEqual(caches['default'].tuning(), {})
+        self.assertIsNone(caches['default'].tuning('article'))
@@ -0,0 +1,177 @@
+from django.test import TestCase
+from django.core.cache import caches
+
+from calm_cache.backends import CalmCache
+from calm_cache.breaker import CircuitBreaker, CircuitOpen, LocalFallback
+
+testcache = caches['testcache']
+
+
+class FlakyCache(object):
+    """
+    Proxy to the test cache that fails every call while `broken` is set
+    """
+
+    def __init__(self):
+        self.broken = False
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(testcache, name)
+
+        def wrapper(*args, **kwargs):
+            self.calls += 1
+            if self.broken:
+                raise IOError("Cache is down")
+            return method(*args, **kwargs)
+        return wrapper
+
+
+class CircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(error_rate=0.5, window=4, min_calls=4,
+                                      cool_down=10, probes=1)
+        self.now = 100
+        self.breaker.time_func = lambda: self.now
+
+    def call_failing(self):
+        def func():
+            raise IOError()
+        self.assertRaises(IOError, self.breaker.call, func)
+
+    def test_opens_on_error_rate(self):
+        self.breaker.call(lambda: 1)
+        self.call_failing()
+        self.breaker.call(lambda: 1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.call_failing()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpen, self.breaker.call, lambda: 1)
+        stats = self.breaker.stats()
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['failures'], 2)
+        self.assertEqual(stats['opened'], 1)
+
+    def test_half_open_probe_closes(self):
+        for _ in range(4):
+            self.call_failing()
+        self.now += 10
+        self.assertTrue(self.breaker.allow())
+        # Only one probe at a time
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_probe_reopens(self):
+        for _ in range(4):
+            self.call_failing()
+        self.now += 10
+        self.call_failing()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.stats()['opened'], 2)
+
+    def test_slow_calls(self):
+        self.breaker.slow_call = 1
+        for _ in range(4):
+            self.breaker.record(True, 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.stats()['slow_calls'], 4)
+
+    def test_ignored_errors(self):
+        self.breaker.ignore = (ValueError, )
+
+        def func():
+            raise ValueError()
+        for _ in range(4):
+            self.assertRaises(ValueError, self.breaker.call, func)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.stats()['failures'], 0)
+
+    def test_local_fallback(self):
+        fallback = LocalFallback(2)
+        fallback.set('a', 1)
+        fallback.set('b', 2)
+        fallback.get('a')
+        fallback.set('c', 3)
+        self.assertEqual(fallback.get('a'), 1)
+        self.assertIsNone(fallback.get('b'))
+        fallback.delete('a')
+        self.assertIsNone(fallback.get('a'))
+
+
+class CalmCacheBreakerTest(TestCase):
+
+    def setUp(self):
+        self.cache = CalmCache('testcache', {
+            'KEY_PREFIX': 'breaker-%s' % self._testMethodName,
+            'OPTIONS': {
+                'MINT_PERIOD': 10,
+                'CIRCUIT_BREAKER': {
+                    'MIN_CALLS': 2,
+                    'WINDOW': 2,
+                    'COOL_DOWN': 30,
+                    'FALLBACK_SIZE': 10,
+                },
+            }})
+        self.backend = FlakyCache()
+        self.cache.caches['testcache'] = self.backend
+
+    def tearDown(self):
+        testcache.clear()
+
+    def test_string_options(self):
+        cache = CalmCache('testcache', {
+            'KEY_PREFIX': 'breaker-%s' % self._testMethodName,
+            'OPTIONS': {'CIRCUIT_BREAKER': {
+                'ERROR_RATE': '0.2', 'MIN_CALLS': '3', 'SLOW_CALL': '0.5',
+                'COOL_DOWN': '5', 'FALLBACK_SIZE': '10'}}})
+        breaker = cache.breakers['testcache']
+        self.assertEqual(breaker.slow_call, 0.5)
+        self.assertEqual(breaker.error_rate, 0.2)
+        self.assertEqual(breaker.min_calls, 3)
+        self.assertIsNone(self.cache.breakers['testcache'].slow_call)
+
+    def test_missing_counters_keep_circuit_closed(self):
+        for i in range(5):
+            self.assertRaises(ValueError, self.cache.incr,
+                              '__counter__:missing-%d' % i)
+        self.assertEqual(
+            self.cache.breaker_stats()['testcache']['state'], 'closed')
+        self.cache.set('key-1', 'v', 60)
+        self.assertEqual(self.cache.get('key-1'), 'v')
+
+    def test_fail_open(self):
+        self.backend.broken = True
+        self.assertIsNone(self.cache.get('key-1'))
+        self.cache.set('key-1', 'v', 60)
+        self.assertFalse(self.cache.add('key-2', 'v', 60))
+        self.cache.delete('key-1')
+        self.assertFalse(self.cache.has_key('key-2'))
+        self.cache.clear()
+
+    def test_open_circuit_skips_backend(self):
+        self.backend.broken = True
+        self.cache.get('key-1')
+        self.cache.get('key-1')
+        calls = self.backend.calls
+        self.assertEqual(
+            self.cache.breaker_stats()['testcache']['state'], 'open')
+        self.assertIsNone(self.cache.get('key-1'))
+        self.assertEqual(self.backend.calls, calls)
+        self.assertEqual(
+            self.cache.breaker_stats()['testcache']['rejected'], 1)
+
+    def test_stale_from_local_copy(self):
+        self.cache.set('key-1', 'v1', 60)
+        self.assertEqual(self.cache.get('key-1'), 'v1')
+        self.backend.broken = True
+        self.assertEqual(self.cache.get('key-1'), 'v1')
+        self.assertTrue(self.cache.has_key('key-1'))
+
+    def test_errors_raised_without_breaker(self):
+        cache = CalmCache('testcache', {})
+        cache.caches['testcache'] = self.backend
+        self.backend.broken = True
+        self.assertRaises(IOError, cache.get, 'key-1')
+        self.assertEqual(cache.breaker_stats(), {})
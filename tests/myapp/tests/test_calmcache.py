@@ -4,9 +4,15 @@ when you run "manage.py test".
 
 Replace this with more appropriate tests for your application.
 """
+import time
+
 from django.test import TestCase
 from django.core.cache import cache, caches
 
+from calm_cache.backends import CalmCache, NEGATIVE
+from calm_cache.backends import calmcache
+from calm_cache.backends.calmcache import GENERATION_KEY
+
 testcache = caches['testcache']
 
 class CalmCacheTest(TestCase):
@@ -81,3 +87,153 @@ class CalmCacheTest(TestCase):
         # make sure the value was removed from the underlying cache
         r = testcache.get(cache.make_key('test-key-6'))
         self.assertIsNone(r)
+
+    def test_get_without_packing(self):
+        plain = CalmCache('testcache', {'KEY_PREFIX': 'plain'})
+        plain.set('test-key-7', 'test-value-7', timeout=60)
+        self.assertEqual(testcache.get(plain.make_key('test-key-7')),
+                         'test-value-7')
+        # Value is not removed after being read
+        self.assertEqual(plain.get('test-key-7'), 'test-value-7')
+        self.assertEqual(plain.get('test-key-7'), 'test-value-7')
+
+    def test_counter_unpacked(self):
+        cache.set('__counter__:hits', 5, timeout=60)
+        self.assertEqual(testcache.get(cache.make_key('__counter__:hits')), 5)
+        self.assertEqual(cache.get('__counter__:hits'), 5)
+        self.assertEqual(cache.incr('__counter__:hits'), 6)
+        self.assertEqual(cache.decr('__counter__:hits', 2), 4)
+        self.assertEqual(testcache.get(cache.make_key('__counter__:hits')), 4)
+        self.assertRaises(ValueError, cache.incr, '__counter__:missing')
+        self.assertTrue(cache.add('__counter__:new', 0))
+        self.assertEqual(cache.incr('__counter__:new', 10), 10)
+        self.assertEqual(cache.get('__counter__:missing', 'default'),
+                         'default')
+
+    def test_incr_packed(self):
+        cache.set('test-key-6', 1, timeout=60)
+        self.assertEqual(cache.incr('test-key-6'), 2)
+        self.assertEqual(testcache.get(cache.make_key('test-key-6')),
+                         (2, 303, False))
+
+    def test_incr_without_packing(self):
+        nopack = CalmCache('testcache', {'KEY_PREFIX': self._testMethodName})
+        nopack.set('hits', 1)
+        self.assertEqual(nopack.incr('hits', 2), 3)
+        self.assertTrue(nopack.touch('hits', 10))
+        self.assertFalse(nopack.touch('missing', 10))
+
+    def test_touch(self):
+        cache.set('test-key-7', 'test-value-7', timeout=60)
+        self.assertTrue(cache.touch('test-key-7', 600))
+        self.assertEqual(testcache.get(cache.make_key('test-key-7')),
+                         ('test-value-7', 603, False))
+        key = testcache.make_key(cache.make_key('test-key-7'))
+        self.assertAlmostEqual(testcache._expire_info[key] - time.time(),
+                               600 + 10 + 60 + 2, delta=1)
+        self.assertFalse(cache.touch('non-existant-key', 600))
+        cache.set('__counter__:touched', 1, timeout=60)
+        self.assertTrue(cache.touch('__counter__:touched', 600))
+        key = testcache.make_key(cache.make_key('__counter__:touched'))
+        self.assertAlmostEqual(testcache._expire_info[key] - time.time(),
+                               600, delta=1)
+
+    def test_negative(self):
+        cache.set_negative('test-key-8')
+        # Stored with its own timeout, mint period and jitter are the same
+        self.assertEqual(testcache.get(cache.make_key('test-key-8')),
+                         (NEGATIVE, 63, False))
+        r = cache.get('test-key-8', 'default')
+        self.assertIs(r, NEGATIVE)
+        self.assertFalse(r)
+        self.assertEqual(cache.get_many(['test-key-8', 'non-existant-key']),
+                         {'test-key-8': NEGATIVE})
+        cache.set_negative('test-key-9', 5)
+        self.assertEqual(testcache.get(cache.make_key('test-key-9'))[1], 8)
+
+    def test_negative_jitter(self):
+        negative = CalmCache('testcache', {
+            'KEY_PREFIX': self._testMethodName,
+            'OPTIONS': {'MINT_PERIOD': 10, 'JITTER': 10, 'NEGATIVE_JITTER': 0,
+                        'NEGATIVE_TIMEOUT': 30}})
+        negative.time_func = lambda: 1
+        negative.set_negative('key')
+        self.assertEqual(testcache.get(negative.make_key('key')),
+                         (NEGATIVE, 31, False))
+
+    def test_namespaced_clear(self):
+        params = {'KEY_PREFIX': self._testMethodName,
+                  'OPTIONS': {'MINT_PERIOD': 10, 'NAMESPACED_CLEAR': True}}
+        calm = CalmCache('testcache', params)
+        calm.set('page:1', 'value-1')
+        calm.set('user:1', 'value-2')
+        testcache.set('foreign', 'value-3')
+        key = calm.make_key('page:1')
+        self.assertEqual(calm.get('page:1'), 'value-1')
+        calm.clear_prefix('page')
+        self.assertNotEqual(calm.make_key('page:1'), key)
+        self.assertIsNone(calm.get('page:1'))
+        self.assertEqual(calm.get('user:1'), 'value-2')
+        calm.clear()
+        self.assertIsNone(calm.get('user:1'))
+        # The real cache is not flushed
+        self.assertEqual(testcache.get('foreign'), 'value-3')
+        # Other processes pick up new generation after GENERATION_TTL
+        calm.set('user:1', 'value-4')
+        other = CalmCache('testcache', params)
+        self.assertEqual(other.get('user:1'), 'value-4')
+        self.assertRaises(ValueError, cache.clear_prefix, 'page')
+
+    def test_namespaced_clear_evicted_generation(self):
+        calm = CalmCache('testcache', {'KEY_PREFIX': self._testMethodName,
+                                       'OPTIONS': {'NAMESPACED_CLEAR': True,
+                                                   'GENERATION_TTL': 0}})
+        calm.set('page:1', 'value-1')
+        key = calm.make_key('page:1')
+        testcache.clear()
+        time.sleep(0.002)
+        calm.set('page:1', 'value-2')
+        self.assertNotEqual(calm.make_key('page:1'), key)
+        # Bumping missing generation
+        testcache.clear()
+        calm.clear_prefix('page')
+        self.assertIsNone(calm.get('page:1'))
+
+    def test_namespaced_clear_unprefixed_keys(self):
+        calm = CalmCache('testcache', {'KEY_PREFIX': self._testMethodName,
+                                       'OPTIONS': {'NAMESPACED_CLEAR': True}})
+        for i in range(20):
+            calm.set('page-%d' % i, i)
+        self.assertEqual(list(calm.shared['generations']), [GENERATION_KEY])
+        self.assertEqual(calm.get('page-1'), 1)
+        calm.clear()
+        self.assertIsNone(calm.get('page-1'))
+
+    def test_namespaced_clear_generations_bounded(self):
+        calm = CalmCache('testcache', {'KEY_PREFIX': self._testMethodName,
+                                       'OPTIONS': {'NAMESPACED_CLEAR': True}})
+        max_generations = calmcache.MAX_GENERATIONS
+        calmcache.MAX_GENERATIONS = 5
+        try:
+            for i in range(20):
+                calm.set('page-%d:1' % i, i)
+        finally:
+            calmcache.MAX_GENERATIONS = max_generations
+        self.assertEqual(len(calm.shared['generations']), 5)
+        self.assertEqual(calm.get('page-19:1'), 19)
+
+    def test_get_many(self):
+        cache.set('many-1', 'value-1', timeout=60)
+        cache.set('many-2', 'value-2', timeout=60)
+        cache.set('many-3', 'value-3', timeout=10)
+        # many-3 is in the mint period
+        cache.time_func = lambda: 20
+        r = cache.get_many(['many-1', 'many-2', 'many-3', 'many-4'])
+        self.assertEqual(r, {'many-1': 'value-1', 'many-2': 'value-2'})
+        # many-3 is being refreshed by the first reader
+        r = cache.get_many(['many-3'])
+        self.assertEqual(r, {'many-3': 'value-3'})
+        # Beyond mint period stale value is served once
+        cache.time_func = lambda: 80
+        self.assertEqual(cache.get_many(['many-1']), {'many-1': 'value-1'})
+        self.assertEqual(cache.get_many(['many-1']), {})
@@ -0,0 +1,134 @@
+from collections import Counter
+
+from django.test import TestCase
+from django.core.cache import caches
+
+from calm_cache.backends import CalmCache
+from calm_cache.hashring import HashRing
+
+SHARDS = ('testshard-a', 'testshard-b', 'testshard-c')
+
+
+class BrokenCache(object):
+    """
+    Backend stub failing on every call
+    """
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            raise IOError("Node is down")
+        return method
+
+
+class HashRingTest(TestCase):
+
+    def test_distribution(self):
+        ring = HashRing(['a', 'b', 'c'])
+        counts = Counter(ring.get_node('key-%d' % i) for i in range(3000))
+        for node in ('a', 'b', 'c'):
+            self.assertGreater(counts[node], 700)
+
+    def test_weights(self):
+        ring = HashRing({'a': 1, 'b': 3})
+        counts = Counter(ring.get_node('key-%d' % i) for i in range(4000))
+        self.assertGreater(counts['b'], 2 * counts['a'])
+
+    def test_stability(self):
+        # Removing a node moves only the keys that belonged to it
+        keys = ['key-%d' % i for i in range(1000)]
+        ring1 = HashRing(['a', 'b', 'c'])
+        ring2 = HashRing(['a', 'b'])
+        for key in keys:
+            node = ring1.get_node(key)
+            if node != 'c':
+                self.assertEqual(ring2.get_node(key), node)
+
+    def test_get_nodes(self):
+        ring = HashRing(['a', 'b', 'c'])
+        nodes = ring.get_nodes('key', 2)
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(nodes[0], ring.get_node('key'))
+        self.assertNotEqual(nodes[0], nodes[1])
+        self.assertEqual(sorted(ring.get_nodes('key', 5)), ['a', 'b', 'c'])
+
+
+class ShardedCalmCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = CalmCache(list(SHARDS), {'OPTIONS': {
+            'MINT_PERIOD': 10,
+            'REPLICAS': 2,
+            'REPLICATED_PREFIXES': ('hot:', ),
+        }})
+
+    def tearDown(self):
+        for alias in SHARDS:
+            caches[alias].clear()
+
+    def stored_on(self, key):
+        cache_key = self.cache.make_key(key)
+        return [alias for alias in SHARDS
+                if caches[alias].get(cache_key) is not None]
+
+    def test_keys_spread_among_nodes(self):
+        for i in range(300):
+            self.cache.set('key-%d' % i, i, 60)
+        for alias in SHARDS:
+            self.assertGreater(len(caches[alias]._cache), 50)
+        for i in range(300):
+            self.assertEqual(self.cache.get('key-%d' % i), i)
+            self.assertEqual(len(self.stored_on('key-%d' % i)), 1)
+
+    def test_hot_keys_replicated(self):
+        self.cache.set('hot:article', 'v', 60)
+        self.assertEqual(len(self.stored_on('hot:article')), 2)
+        self.assertTrue(self.cache.has_key('hot:article'))
+        self.cache.delete('hot:article')
+        self.assertEqual(self.stored_on('hot:article'), [])
+
+    def test_replica_read_after_node_restart(self):
+        self.cache.set('hot:front', 'v', 60)
+        primary, replica = self.cache._backends(
+            'hot:front', self.cache.make_key('hot:front'))
+        caches[primary].clear()
+        self.assertEqual(self.cache.get('hot:front'), 'v')
+
+    def test_replica_read_on_error(self):
+        self.cache.set('hot:front', 'v', 60)
+        cache_key = self.cache.make_key('hot:front')
+        primary = self.cache.ring.get_node(cache_key)
+        self.cache.caches[primary] = BrokenCache()
+        self.assertEqual(self.cache.get('hot:front'), 'v')
+        # Writes succeed as long as one of the replicas is alive
+        self.cache.set('hot:front', 'v2', 60)
+        self.assertEqual(self.cache.get('hot:front'), 'v2')
+
+    def test_error_without_replica(self):
+        cache_key = self.cache.make_key('cold')
+        self.cache.caches[self.cache.ring.get_node(cache_key)] = BrokenCache()
+        self.assertRaises(IOError, self.cache.get, 'cold')
+
+    def test_get_many_replica_read_on_error(self):
+        keys = ['hot:%d' % i for i in range(20)]
+        self.cache.set_many(dict((key, key) for key in keys), 60)
+        self.cache.caches[SHARDS[0]] = BrokenCache()
+        self.assertEqual(self.cache.get_many(keys),
+                         dict((key, key) for key in keys))
+        # Keys without replicas on the broken node still fail
+        cold = [key for key in ('cold-%d' % i for i in range(20))
+                if self.cache.ring.get_node(self.cache.make_key(key)) ==
+                SHARDS[0]]
+        self.assertRaises(IOError, self.cache.get_many, keys + cold[:1])
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('hot:a', 1, 60))
+        self.assertFalse(self.cache.add('hot:a', 2, 60))
+        self.assertEqual(self.cache.get('hot:a'), 1)
+        self.assertEqual(len(self.stored_on('hot:a')), 2)
+
+    def test_clear(self):
+        for i in range(30):
+            self.cache.set('key-%d' % i, i, 60)
+        self.cache.clear()
+        for alias in SHARDS:
+            self.assertEqual(len(caches[alias]._cache), 0)
@@ -0,0 +1,99 @@
+from django.core.cache import caches
+from django.test import TestCase
+
+from calm_cache.backends import CalmCache
+from calm_cache.hotkeys import SpaceSaving, HotKeys, LocalTier
+
+testcache = caches['testcache']
+
+
+class HotKeysTest(TestCase):
+
+    def test_space_saving(self):
+        summary = SpaceSaving(3)
+        for item in 'aaaaabbbcdde':
+            summary.offer(item)
+        top = summary.top()
+        self.assertEqual(len(top), 3)
+        self.assertEqual(top[0], ('a', 5, 0))
+        # Every count is an upper bound and count - error a lower one
+        for item, count, error in top:
+            true_count = 'aaaaabbbcdde'.count(item)
+            self.assertTrue(count - error <= true_count <= count)
+
+    def test_local_tier(self):
+        tier = LocalTier(2, 1)
+        tier.set('a', 1, 0)
+        tier.set('b', 2, 0)
+        self.assertEqual(tier.get('a', 0.5), 1)
+        tier.set('c', 3, 0.5)
+        # 'b' is the least recently used one
+        self.assertIsNone(tier.get('b', 0.5))
+        self.assertIsNone(tier.get('a', 1))
+        self.assertEqual(tier.get('c', 1), 3)
+        self.assertEqual(tier.hits, 2)
+
+    def test_detector(self):
+        hot = HotKeys(sample_rate=0.5, top_k=2, threshold=6, window=10)
+        samples = iter([0.1, 0.1, 0.9, 0.9] * 1000)
+        hot.rand_func = lambda: next(samples)
+        for i in range(100):
+            hot.record('viral', i * 0.1)
+            hot.record('popular:%d' % (i % 4), i * 0.1)
+        self.assertEqual(hot.hot_keys(), [])
+        hot.record('viral', 10)
+        # 'viral' was read 100 times during 10 seconds, half sampled
+        self.assertEqual(hot.hot_keys(), [('viral', 10.0)])
+        self.assertTrue(hot.is_hot('viral'))
+        self.assertFalse(hot.is_hot('popular:0'))
+        # Keys cool down in the next window
+        hot.record('other', 20)
+        hot.record('other', 20)
+        self.assertEqual(hot.hot_keys(), [])
+
+    def make_cache(self):
+        calm = CalmCache('testcache', {
+            'KEY_PREFIX': self._testMethodName,
+            'OPTIONS': {
+                'MINT_PERIOD': 10,
+                'HOT_KEYS': {'SAMPLE_RATE': 1, 'TOP_K': 2, 'THRESHOLD': 1,
+                             'WINDOW': 10, 'LOCAL_TTL': 5},
+            },
+        })
+        self.now = 0
+        calm.time_func = lambda: self.now
+        return calm
+
+    def tearDown(self):
+        testcache.clear()
+
+    def test_local_replication(self):
+        calm = self.make_cache()
+        calm.set('article:1', 'value-1', 60)
+        for _ in range(20):
+            self.assertEqual(calm.get('article:1'), 'value-1')
+        self.now = 10
+        self.assertEqual(calm.get('article:1'), 'value-1')
+        self.assertEqual(calm.hot_keys(), [('article:1', 2.0)])
+        # Served from the local tier
+        testcache.clear()
+        self.assertEqual(calm.get('article:1'), 'value-1')
+        self.now = 15
+        self.assertIsNone(calm.get('article:1'))
+
+    def test_local_invalidation(self):
+        calm = self.make_cache()
+        calm.set('article:1', 'value-1', 60)
+        for _ in range(20):
+            calm.get('article:1')
+        self.now = 10
+        calm.get('article:1')
+        calm.set('article:1', 'value-2', 60)
+        self.assertEqual(calm.get('article:1'), 'value-2')
+        calm.delete('article:1')
+        self.assertIsNone(calm.get('article:1'))
+
+    def test_disabled(self):
+        calm = CalmCache('testcache', {})
+        self.assertIsNone(calm.hot)
+        self.assertEqual(calm.hot_keys(), [])
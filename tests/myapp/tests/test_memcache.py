@@ -1,9 +1,24 @@
+import json
+import os
+import tempfile
+
 from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test.utils import override_settings
 from unittest import skipUnless
 from django.core.cache.backends.memcached import BaseMemcachedCache
 
-from calm_cache.backends.memcached import ZippedMCMixin, BinPyLibMCCache
+from calm_cache.backends.memcached import (
+    ZippedMCMixin, BinPyLibMCCache, PooledMCMixin, MemcachedCache,
+    NoReplyMCMixin, WritePipelineMCMixin, ChunkedMCMixin, ChunkManifest,
+    ZstdMCMixin, ZSTD_MAGIC)
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 
 try:
     import pylibmc as _
@@ -12,6 +27,16 @@ except ImportError:
 else:
     has_pylibmc = True
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 
 class FakeLibMC(object):
     """
@@ -44,6 +69,10 @@ class FakeLibMC(object):
             self.delete_args = args
             self.delete_kwargs = kwargs
 
+        def delete_multi(self, *args, **kwargs):
+            self.delete_multi_args = args
+            self.delete_multi_kwargs = kwargs
+
 
 class FakeMemcachedCache(BaseMemcachedCache):
     """
@@ -59,6 +88,91 @@ class FakeZipMemcachedCache(ZippedMCMixin, FakeMemcachedCache):
     pass
 
 
+class StoreLibMC(object):
+    """
+    A stub memcached library keeping values in a dictionary and recording
+    names of called methods
+    """
+
+    class Client(object):
+
+        def __init__(self, *args, **kwargs):
+            self.data = {}
+            self.calls = []
+
+        def get(self, key, default=None):
+            self.calls.append('get')
+            return self.data.get(key, (default, None))[0]
+
+        def set(self, key, value, expire=0):
+            self.calls.append('set')
+            self.data[key] = (value, expire)
+            return True
+
+        def get_multi(self, keys):
+            self.calls.append('get_multi')
+            return dict((k, self.data[k][0]) for k in keys if k in self.data)
+
+        def add(self, key, value, expire=0):
+            self.calls.append('add')
+            if key in self.data:
+                return False
+            self.data[key] = (value, expire)
+            return True
+
+        def set_multi(self, data, expire=0):
+            self.calls.append('set_multi')
+            for key, value in data.items():
+                self.data[key] = (value, expire)
+            return []
+
+        def delete(self, key):
+            self.calls.append('delete')
+            return self.data.pop(key, None) is not None
+
+        def delete_multi(self, keys):
+            self.calls.append('delete_multi')
+            for key in keys:
+                self.data.pop(key, None)
+
+        def decr(self, key, delta=1):
+            self.calls.append('decr')
+            if key not in self.data:
+                return None
+            value, expire = self.data[key]
+            self.data[key] = (value - delta, expire)
+            return value - delta
+
+
+class StoreMemcachedCache(BaseMemcachedCache):
+
+    def __init__(self, server, params):
+        super(StoreMemcachedCache, self).__init__(server, params, StoreLibMC,
+                                                  KeyError)
+
+
+class PipelineMemcachedCache(WritePipelineMCMixin, StoreMemcachedCache):
+    pass
+
+
+class ChunkedMemcachedCache(ChunkedMCMixin, StoreMemcachedCache):
+    pass
+
+
+class ZstdMemcachedCache(ZstdMCMixin, ChunkedMCMixin, StoreMemcachedCache):
+    pass
+
+
+class FakeNoReplyMemcachedCache(ZippedMCMixin, NoReplyMCMixin,
+                                FakeMemcachedCache):
+    pass
+
+
+class FakePooledMemcachedCache(ZippedMCMixin, PooledMCMixin,
+                               FakeMemcachedCache):
+    pass
+
+
 class MemcacheZipMixinTest(TestCase):
 
     def test_min_compress_length_kw(self):
@@ -120,3 +234,273 @@ class BinPyLibMCCacheTest(TestCase):
         _ = BinPyLibMCCache('localhost:11211', config)
         cache = BinPyLibMCCache('localhost:11211', config)
         self.assertTrue(cache.binary_proto)
+
+
+class PooledMCMixinTest(TestCase):
+
+    def make_cache(self, **options):
+        options.setdefault('POOL_SIZE', 2)
+        return FakePooledMemcachedCache(
+            'localhost:11211-%s' % self._testMethodName, {'OPTIONS': options})
+
+    def test_pooling_disabled_by_default(self):
+        cache = FakePooledMemcachedCache('localhost:11211', {})
+        self.assertIsInstance(cache._cache, FakeLibMC.Client)
+        self.assertIsNone(cache.pool_stats())
+
+    def test_calls_use_pooled_clients(self):
+        cache = self.make_cache(MIN_COMPRESS_LEN=10)
+        self.assertNotIn('POOL_SIZE', cache._options)
+        cache.add('key', 'value')
+        client = cache.pool.queue.queue[-1]
+        self.assertEqual(client.add_kwargs['min_compress_len'], 10)
+        self.assertEqual(cache.pool_stats(), {
+            'size': 2, 'available': 2, 'reservations': 1, 'waits': 0,
+            'wait_time': 0.0, 'max_wait_time': 0.0, 'exhausted': 0})
+
+    def test_pool_shared_between_instances(self):
+        cache = self.make_cache()
+        other = self.make_cache()
+        self.assertIs(cache.pool, other.pool)
+        self.assertIsNot(cache._cache, other._cache)
+        # Closing at the end of request keeps pooled connections
+        cache.close()
+        self.assertEqual(cache.pool_stats()['available'], 2)
+
+    def test_exhausted_pool_non_blocking(self):
+        cache = self.make_cache(POOL_SIZE=1, POOL_BLOCK=False)
+        with cache.pool.reserve():
+            self.assertRaises(Empty, cache.add, 'key', 'value')
+        self.assertEqual(cache.pool_stats()['exhausted'], 1)
+        cache.add('key', 'value')
+
+    def test_exhausted_pool_timeout(self):
+        cache = self.make_cache(POOL_SIZE=1, POOL_TIMEOUT=0.01)
+        with cache.pool.reserve():
+            self.assertRaises(Empty, cache.delete, 'key')
+        stats = cache.pool_stats()
+        self.assertEqual(stats['exhausted'], 1)
+        self.assertEqual(stats['reservations'], 1)
+
+    def test_pymemcache_pool(self):
+        cache = MemcachedCache('127.0.0.1:11299',
+                               {'OPTIONS': {'POOL_SIZE': 3}})
+        self.assertEqual(cache.pool.size, 3)
+        self.assertEqual(cache.pool.queue.qsize(), 3)
+
+
+class NoReplyMCMixinTest(TestCase):
+
+    def test_noreply_writes(self):
+        cache = FakeNoReplyMemcachedCache(
+            'localhost:11211', {'OPTIONS': {'NOREPLY_WRITES': True,
+                                            'MIN_COMPRESS_LEN': 10}})
+        self.assertNotIn('NOREPLY_WRITES', cache._options)
+        cache.set('key', 'value')
+        self.assertTrue(cache._cache.set_kwargs['noreply'])
+        self.assertEqual(cache._cache.set_kwargs['min_compress_len'], 10)
+        cache.delete('key')
+        self.assertTrue(cache._cache.delete_kwargs['noreply'])
+        # add needs the reply
+        cache.add('key', 'value')
+        self.assertNotIn('noreply', cache._cache.add_kwargs)
+
+    def test_noreply_disabled_by_default(self):
+        cache = FakeNoReplyMemcachedCache('localhost:11211', {})
+        cache.delete('key')
+        self.assertNotIn('noreply', cache._cache.delete_kwargs)
+
+
+class WritePipelineMCMixinTest(TestCase):
+
+    def setUp(self):
+        self.cache = PipelineMemcachedCache('localhost:11211', {})
+        self.client = self.cache._cache
+
+    def test_writes_batched(self):
+        with self.cache.pipeline():
+            self.cache.set('key-1', 1, 10)
+            self.cache.set('key-2', 2, 10)
+            self.cache.set_many({'key-3': 3}, 20)
+            self.cache.delete('key-4')
+            self.cache.delete_many(['key-5'])
+            self.assertEqual(self.client.calls, [])
+        self.assertEqual(sorted(self.client.calls),
+                         ['delete_multi', 'set_multi', 'set_multi'])
+        self.assertEqual(self.cache.get('key-2'), 2)
+        self.assertEqual(self.client.data[':1:key-3'][0], 3)
+
+    def test_last_write_wins(self):
+        self.cache.set('key', 'old')
+        with self.cache.pipeline():
+            self.cache.set('key', 'new')
+            self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        with self.cache.pipeline():
+            self.cache.delete('key')
+            self.cache.set('key', 'newer')
+        self.assertEqual(self.cache.get('key'), 'newer')
+
+    def test_read_flushes(self):
+        with self.cache.pipeline():
+            self.cache.set('key', 'value')
+            with self.cache.pipeline():
+                self.cache.set('other', 'value')
+            self.assertEqual(self.client.calls, [])
+            self.assertEqual(self.cache.get('key'), 'value')
+            self.assertEqual(self.client.calls, ['set_multi', 'get'])
+
+    def test_without_pipeline(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.client.calls, ['set'])
+        self.cache.delete_many(['key', 'other'])
+        self.assertEqual(self.client.calls, ['set', 'delete_multi'])
+
+    def test_decr_flushes(self):
+        with self.cache.pipeline():
+            self.cache.set('counter', 10)
+            self.assertEqual(self.cache.decr('counter'), 9)
+            self.assertEqual(self.client.calls, ['set_multi', 'decr'])
+
+
+class ChunkedMCMixinTest(TestCase):
+
+    def setUp(self):
+        self.cache = ChunkedMemcachedCache('localhost:11211',
+                                           {'OPTIONS': {'CHUNK_SIZE': 100}})
+        self.client = self.cache._cache
+        self.value = 'x' * 250
+
+    def chunk_keys(self):
+        return sorted(k for k in self.client.data if '__chunk__' in k)
+
+    def test_small_values_not_chunked(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.client.data[':1:key'][0], 'value')
+        self.assertEqual(self.chunk_keys(), [])
+
+    def test_large_value_roundtrip(self):
+        self.cache.set('key', self.value, 30)
+        manifest = self.client.data[':1:key'][0]
+        self.assertIsInstance(manifest, ChunkManifest)
+        self.assertEqual(manifest.count, 3)
+        self.assertEqual(len(self.chunk_keys()), 3)
+        # Chunks expire together with the manifest
+        self.assertEqual(set(self.client.data[k][1]
+                             for k in self.chunk_keys()), set([30]))
+        del self.client.calls[:]
+        self.assertEqual(self.cache.get('key'), self.value)
+        self.assertEqual(self.client.calls, ['get', 'get_multi'])
+
+    def test_get_many(self):
+        self.cache.set_many({'key-1': self.value, 'key-2': 'small'})
+        self.cache.set('key-3', self.value * 2)
+        del self.client.calls[:]
+        self.assertEqual(self.cache.get_many(['key-1', 'key-2', 'key-3']), {
+            'key-1': self.value, 'key-2': 'small', 'key-3': self.value * 2})
+        self.assertEqual(self.client.calls, ['get_multi', 'get_multi'])
+
+    def test_missing_or_corrupted_chunk(self):
+        self.cache.set('key', self.value)
+        chunk_key = self.chunk_keys()[0]
+        self.client.data[chunk_key] = (b'broken', 0)
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        del self.client.data[chunk_key]
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        self.assertEqual(self.cache.get_many(['key']), {})
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('key', self.value))
+        self.assertFalse(self.cache.add('key', self.value))
+        self.assertEqual(self.cache.get('key'), self.value)
+
+    def test_new_version_uses_new_chunks(self):
+        self.cache.set('key', self.value)
+        old_keys = self.chunk_keys()
+        self.cache.set('key', 'y' * 250)
+        self.assertEqual(len(set(self.chunk_keys()) - set(old_keys)), 3)
+        self.assertEqual(self.cache.get('key'), 'y' * 250)
+
+
+def json_sample(i):
+    return json.dumps({'id': i, 'name': 'user %d' % i,
+                       'html': '<div class="profile">%d</div>' % (i * 7),
+                       'tags': ['tag-%d' % (i % 13), 'tag-%d' % (i % 7)]})
+
+
+@skipUnless(zstandard, "zstandard is not present")
+class ZstdMCMixinTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = self.write_dict('user.dict', 0)
+
+    def tearDown(self):
+        for name in os.listdir(self.tmp):
+            os.unlink(os.path.join(self.tmp, name))
+        os.rmdir(self.tmp)
+
+    def write_dict(self, name, offset):
+        samples = [json_sample(i + offset).encode('utf-8')
+                   for i in range(300)]
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(zstandard.train_dictionary(2048, samples).as_bytes())
+        return path
+
+    def make_cache(self, dictionaries, **options):
+        options['ZSTD_DICTIONARIES'] = dictionaries
+        return ZstdMemcachedCache('localhost:11211', {'OPTIONS': options})
+
+    def test_compressed_roundtrip(self):
+        cache = self.make_cache({'user:': self.path})
+        value = json_sample(1000)
+        cache.set('user:1000', value)
+        stored = cache._cache.data[':1:user:1000'][0]
+        self.assertTrue(stored.startswith(ZSTD_MAGIC))
+        self.assertLess(len(stored), len(value))
+        self.assertEqual(cache.get('user:1000'), value)
+        cache.set_many({'user:1': value, 'other': value})
+        self.assertEqual(cache._cache.data[':1:other'][0], value)
+        self.assertEqual(cache.get_many(['user:1', 'other']),
+                         {'user:1': value, 'other': value})
+
+    def test_small_values_not_compressed(self):
+        cache = self.make_cache({'user:': self.path}, ZSTD_MIN_LEN=1000)
+        cache.add('user:1', json_sample(1))
+        self.assertEqual(cache._cache.data[':1:user:1'][0], json_sample(1))
+
+    def test_replaced_dictionary(self):
+        value = json_sample(5)
+        old_cache = self.make_cache({'user:': self.path})
+        old_cache.set('user:5', value)
+        new_path = self.write_dict('new.dict', 10000)
+        # Old dictionary is still used to read older values
+        cache = self.make_cache({'user:': [new_path, self.path]})
+        cache._cache.data = old_cache._cache.data
+        self.assertEqual(cache.get('user:5'), value)
+        # Unknown dictionary means cache miss
+        cache = self.make_cache({'user:': new_path})
+        cache._cache.data = old_cache._cache.data
+        self.assertEqual(cache.get('user:5', 'default'), 'default')
+        self.assertEqual(cache.get_many(['user:5']), {})
+
+    def test_train_command(self):
+        cache = caches['testcache']
+        cache.set_many(dict(('user:%d' % i, json_sample(i))
+                            for i in range(200)))
+        keys_file = os.path.join(self.tmp, 'keys.txt')
+        with open(keys_file, 'w') as f:
+            f.write('\n'.join('user:%d' % i for i in range(200)))
+        output = os.path.join(self.tmp, 'trained.dict')
+        stdout = StringIO()
+        call_command('train_zstd_dictionary', output, cache='testcache',
+                     keys_file=[keys_file], size=2048, stdout=stdout)
+        self.assertIn('from 200 samples', stdout.getvalue())
+        cache = self.make_cache({'user:': output})
+        cache.set('user:1', json_sample(1))
+        self.assertTrue(cache._cache.data[':1:user:1'][0].startswith(
+            ZSTD_MAGIC))
+        self.assertRaises(CommandError, call_command, 'train_zstd_dictionary',
+                          output, cache='testcache', key=['missing'],
+                          stdout=stdout)
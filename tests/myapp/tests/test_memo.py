@@ -0,0 +1,146 @@
+import asyncio
+import threading
+
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory
+
+from calm_cache.backends import CalmCache
+from calm_cache.decorators import ResponseCache
+from calm_cache.memo import (
+    get_memo, memo_totals, request_memo, RequestMemoMiddleware)
+
+testcache = caches['testcache']
+
+
+class RequestMemoTest(TestCase):
+
+    def tearDown(self):
+        cache.clear()
+        testcache.clear()
+
+    def test_get(self):
+        cache.set('memo-1', 'value-1')
+        with request_memo() as memo:
+            self.assertEqual(cache.get('memo-1'), 'value-1')
+            # Served from the memo even though it's gone from the cache
+            testcache.clear()
+            self.assertEqual(cache.get('memo-1'), 'value-1')
+            # Misses are not remembered
+            self.assertIsNone(cache.get('memo-2'))
+            self.assertEqual(cache.get('memo-2', 'default'), 'default')
+            self.assertEqual(memo.stats(), {'hits': 1, 'misses': 3})
+        self.assertIsNone(get_memo())
+        self.assertIsNone(cache.get('memo-1'))
+
+    def test_writes(self):
+        with request_memo():
+            self.assertIsNone(cache.get('memo-1'))
+            cache.set('memo-1', 'value-1')
+            testcache.clear()
+            self.assertEqual(cache.get('memo-1'), 'value-1')
+            cache.delete('memo-1')
+            self.assertIsNone(cache.get('memo-1'))
+            self.assertTrue(cache.add('memo-1', 'value-2'))
+            self.assertEqual(cache.get('memo-1'), 'value-2')
+            testcache.clear()
+            cache.set('memo-2', 'value-3')
+            self.assertFalse(cache.add('memo-2', 'value-4'))
+            self.assertEqual(cache.get('memo-2'), 'value-3')
+            cache.clear()
+            self.assertIsNone(cache.get('memo-2'))
+
+    def test_copies(self):
+        data = ['a']
+        with request_memo() as memo:
+            cache.set('memo-1', data)
+            data.append('b')
+            value = cache.get('memo-1')
+            self.assertEqual(value, ['a'])
+            value.append('c')
+            self.assertEqual(cache.get('memo-1'), ['a'])
+            self.assertEqual(cache.get_many(['memo-1']), {'memo-1': ['a']})
+            self.assertEqual(memo.stats(), {'hits': 3, 'misses': 0})
+
+    def test_get_many(self):
+        cache.set('memo-1', 'value-1')
+        cache.set('memo-2', 'value-2')
+        with request_memo() as memo:
+            self.assertEqual(cache.get('memo-1'), 'value-1')
+            testcache.clear()
+            cache.set('memo-2', 'value-3')
+            r = cache.get_many(['memo-1', 'memo-2', 'memo-3'])
+            self.assertEqual(r, {'memo-1': 'value-1', 'memo-2': 'value-3'})
+            self.assertEqual(memo.stats(), {'hits': 2, 'misses': 2})
+            self.assertEqual(cache.get_many(['memo-3']), {})
+            self.assertEqual(memo.stats(), {'hits': 2, 'misses': 3})
+
+    def test_counters(self):
+        cache.set('__counter__:memo', 1)
+        with request_memo() as memo:
+            cache.get('__counter__:memo')
+            cache.incr('__counter__:memo')
+            self.assertEqual(cache.get('__counter__:memo'), 2)
+            self.assertEqual(memo.stats(), {'hits': 0, 'misses': 0})
+
+    def test_disabled(self):
+        calm = CalmCache('testcache', {'OPTIONS': {'REQUEST_MEMO': False}})
+        calm.set('memo-1', 'value-1')
+        with request_memo():
+            calm.get('memo-1')
+            testcache.clear()
+            self.assertIsNone(calm.get('memo-1'))
+
+    def test_totals(self):
+        cache.set('memo-1', 'value-1')
+        before = memo_totals()
+        with request_memo():
+            cache.get('memo-1')
+            cache.get('memo-1')
+        after = memo_totals()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+    def get_response(self, request):
+        request.memo = get_memo()
+        return HttpResponse()
+
+    def test_middleware(self):
+        request = RequestFactory().get('/')
+        RequestMemoMiddleware(self.get_response)(request)
+        self.assertIsNotNone(request.memo)
+        self.assertIsNone(get_memo())
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return self.get_response(request)
+        request = RequestFactory().get('/')
+        middleware = RequestMemoMiddleware(get_response)
+        asyncio.run(middleware(request))
+        self.assertIsNotNone(request.memo)
+        self.assertIsNone(get_memo())
+
+    def test_collapse(self):
+        rsp_cache = ResponseCache(60, collapse=True)
+        decorated_view = rsp_cache(self.get_response)
+        request = RequestFactory().get('/collapse/')
+        cache_key = rsp_cache.key_func(request)
+        # Another worker is rendering the response
+        self.assertTrue(rsp_cache.acquire(cache_key))
+        sleeps = []
+
+        def store():
+            cache.set(cache_key, HttpResponse('rendered elsewhere'))
+
+        def sleep(delay):
+            sleeps.append(delay)
+            if len(sleeps) == 2:
+                # Outside of this request's memo
+                thread = threading.Thread(target=store)
+                thread.start()
+                thread.join()
+        rsp_cache.sleep_func = sleep
+        with request_memo():
+            response = decorated_view(request)
+        self.assertEqual(response.content, b'rendered elsewhere')
+        self.assertEqual(sleeps, [0.05, 0.1])
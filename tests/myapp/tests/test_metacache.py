@@ -0,0 +1,287 @@
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from django.test import TestCase
+
+from calm_cache.backends import CalmCache, MetaMemcachedCache
+from calm_cache.backends.metacache import MetaClient
+
+
+class MetaServer(socketserver.ThreadingTCPServer):
+    """
+    In-process stand-in for memcached implementing the subset of meta
+    protocol used by `MetaClient`
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', 0), MetaHandler)
+        self.items = {}
+        self.lock = threading.Lock()
+        self.now = 1000
+        self.commands = []
+
+    @property
+    def location(self):
+        return '%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def lookup(self, key):
+        item = self.items.get(key)
+        if item is not None and item['expires'] and \
+                item['expires'] <= self.now:
+            del self.items[key]
+            item = None
+        return item
+
+    def ttl(self, item):
+        return item['expires'] - self.now if item['expires'] else -1
+
+    def expires(self, ttl):
+        return self.now + ttl if ttl else 0
+
+
+class MetaHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tokens = line.strip().decode('utf-8').split(' ')
+            self.server.commands.append(tokens[0])
+            with self.server.lock:
+                self.wfile.write(self.dispatch(tokens))
+
+    def dispatch(self, tokens):
+        command = tokens[0]
+        if command == 'mn':
+            return b'MN\r\n'
+        if command == 'flush_all':
+            self.server.items.clear()
+            return b'OK\r\n'
+        if command == 'ms':
+            key, size = tokens[1], int(tokens[2])
+            flags = dict((t[:1], t[1:]) for t in tokens[3:])
+            data = self.rfile.read(size + 2)[:-2]
+            return self.ms(key, data, flags)
+        key = tokens[1]
+        flags = dict((t[:1], t[1:]) for t in tokens[2:])
+        return getattr(self, command)(key, flags)
+
+    def reply(self, code, flags, ret, data=None):
+        parts = [code]
+        if 'k' in flags:
+            ret.append('k' + self.key)
+        if data is not None:
+            parts = [code, str(len(data))]
+        line = (' '.join(parts + ret) + '\r\n').encode('utf-8')
+        if data is not None:
+            line += data + b'\r\n'
+        return line
+
+    def ms(self, key, data, flags):
+        self.key = key
+        server = self.server
+        if flags.get('M') == 'E' and server.lookup(key) is not None:
+            return self.reply('NS', flags, [])
+        server.items[key] = {
+            'data': data, 'flags': flags.get('F', '0'),
+            'expires': server.expires(int(flags.get('T', 0))), 'win': False}
+        return b'' if 'q' in flags else self.reply('HD', flags, [])
+
+    def mg(self, key, flags):
+        self.key = key
+        server = self.server
+        item = server.lookup(key)
+        if item is None:
+            return b'' if 'q' in flags else b'EN\r\n'
+        if 'T' in flags:
+            item['expires'] = server.expires(int(flags['T']))
+        ret = []
+        if 'f' in flags:
+            ret.append('f' + item['flags'])
+        if 't' in flags:
+            ret.append('t%d' % server.ttl(item))
+        if 'R' in flags and item['expires'] and \
+                server.ttl(item) < int(flags['R']):
+            if item['win']:
+                ret.append('Z')
+            else:
+                item['win'] = True
+                ret.append('W')
+        if 'v' in flags:
+            return self.reply('VA', flags, ret, item['data'])
+        return self.reply('HD', flags, ret)
+
+    def md(self, key, flags):
+        self.key = key
+        found = self.server.items.pop(key, None) is not None
+        if 'q' in flags:
+            return b''
+        return self.reply('HD' if found else 'NF', flags, [])
+
+    def ma(self, key, flags):
+        self.key = key
+        item = self.server.lookup(key)
+        if item is None:
+            return self.reply('NF', flags, [])
+        delta = int(flags.get('D', 1))
+        value = int(item['data'])
+        value = value + delta if flags.get('M', 'I') == 'I' else \
+            max(value - delta, 0)
+        item['data'] = str(value).encode('ascii')
+        return self.reply('VA', flags, [], item['data'])
+
+
+class MetaMemcachedCacheTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(MetaMemcachedCacheTest, cls).setUpClass()
+        cls.server = MetaServer()
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super(MetaMemcachedCacheTest, cls).tearDownClass()
+
+    def setUp(self):
+        self.server.items.clear()
+        self.server.now = 1000
+        self.cache = MetaMemcachedCache(self.server.location, {})
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('key-1'))
+        self.cache.set('key-1', {'a': 1}, 60)
+        self.assertEqual(self.cache.get('key-1'), {'a': 1})
+        for value in (b'bytes', u'text т', 42):
+            self.cache.set('key-2', value, 60)
+            self.assertEqual(self.cache.get('key-2'), value)
+
+    def test_expiry(self):
+        self.cache.set('key-1', 'v', 60)
+        self.server.now += 60
+        self.assertIsNone(self.cache.get('key-1'))
+
+    def test_add_delete(self):
+        self.assertTrue(self.cache.add('key-1', 'v1', 60))
+        self.assertFalse(self.cache.add('key-1', 'v2', 60))
+        self.assertEqual(self.cache.get('key-1'), 'v1')
+        self.assertTrue(self.cache.delete('key-1'))
+        self.assertFalse(self.cache.delete('key-1'))
+
+    def test_many(self):
+        self.cache.set_many({'key-1': 1, 'key-2': 'two'}, 60)
+        self.assertEqual(self.cache.get_many(['key-1', 'key-2', 'key-3']),
+                         {'key-1': 1, 'key-2': 'two'})
+        self.cache.delete_many(['key-1', 'key-2'])
+        self.assertEqual(self.cache.get_many(['key-1', 'key-2']), {})
+
+    def test_incr_decr_touch(self):
+        self.cache.set('counter', 10, 60)
+        self.assertEqual(self.cache.incr('counter', 5), 15)
+        self.assertEqual(self.cache.decr('counter', 3), 12)
+        self.assertRaises(ValueError, self.cache.incr, 'missing')
+        self.assertTrue(self.cache.touch('counter', 120))
+        self.server.now += 100
+        self.assertEqual(self.cache.get('counter'), 12)
+
+    def test_clear(self):
+        self.cache.set('key-1', 'v', 60)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key-1'))
+
+    def test_get_stale(self):
+        self.cache.set('key-1', 'v', 60)
+        self.assertEqual(self.cache.get_stale('key-1', 10), ('v', False))
+        self.server.now += 51
+        self.assertEqual(self.cache.get_stale('key-1', 10), ('v', True))
+        self.assertEqual(self.cache.get_stale('key-1', 10), ('v', False))
+        self.assertIsNone(self.cache.get_stale('key-2', 10))
+
+    def test_several_servers(self):
+        other = MetaServer()
+        other.start()
+        try:
+            client = MetaClient([self.server.location, other.location])
+            client.set_multi(dict(('key-%d' % i, i) for i in range(20)))
+            self.assertTrue(self.server.items)
+            self.assertTrue(other.items)
+            self.assertEqual(
+                client.get_multi(['key-%d' % i for i in range(20)]),
+                dict(('key-%d' % i, i) for i in range(20)))
+            client.disconnect_all()
+        finally:
+            other.stop()
+
+
+class CalmCacheMetaTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(CalmCacheMetaTest, cls).setUpClass()
+        cls.server = MetaServer()
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super(CalmCacheMetaTest, cls).tearDownClass()
+
+    def setUp(self):
+        self.server.items.clear()
+        self.server.now = 1000
+        self.cache = CalmCache('testcache', {'OPTIONS': {
+            'MINT_PERIOD': 10, 'GRACE_PERIOD': 5}})
+        self.backend = MetaMemcachedCache(self.server.location, {})
+        self.cache.caches['testcache'] = self.cache.cache = self.backend
+        self.cache.server_side_stale = True
+
+    def test_detection(self):
+        cache = CalmCache('testcache', {})
+        self.assertFalse(cache.server_side_stale)
+        self.assertFalse(self.cache.packing_enabled)
+
+    def test_values_stored_without_envelope(self):
+        self.cache.set('key-1', 'v', 60)
+        item = self.server.items[self.backend.make_key(
+            self.cache.make_key('key-1'))]
+        self.assertEqual(item['data'], b'v')
+        self.assertEqual(item['expires'], 1000 + 60 + 10 + 5)
+
+    def test_mint_handled_by_server(self):
+        self.cache.set('key-1', 'v', 60)
+        self.assertEqual(self.cache.get('key-1'), 'v')
+        self.server.now += 61
+        commands = len(self.server.commands)
+        # First client refreshes, others are served stale
+        self.assertIsNone(self.cache.get('key-1'))
+        self.assertEqual(self.cache.get('key-1'), 'v')
+        self.assertEqual(self.cache.get('key-1'), 'v')
+        # No extra writes to mark the value as refreshing
+        self.assertEqual(self.server.commands[commands:], ['mg'] * 3)
+        self.cache.set('key-1', 'v2', 60)
+        self.assertEqual(self.cache.get('key-1'), 'v2')
+
+    def test_miss(self):
+        self.assertEqual(self.cache.get('key-2', 'default'), 'default')
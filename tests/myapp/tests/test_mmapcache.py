@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+
+from calm_cache.backends import CalmCache, MmapCache
+from calm_cache.backends.mmapcache import get_table
+
+
+class MmapCacheTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_cache(self, **options):
+        return MmapCache(self.path, {'OPTIONS': options})
+
+    def test_set_get(self):
+        self.cache.set('key', {'a': 1})
+        self.assertEqual(self.cache.get('key'), {'a': 1})
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.assertTrue(self.cache.has_key('key'))
+        self.cache.set('key', 'other')
+        self.assertEqual(self.cache.get('key'), 'other')
+        self.assertEqual(os.path.getsize(self.path),
+                         get_table(self.path, 1024, 8, 4096).size)
+
+    def test_add_delete(self):
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+        self.assertTrue(self.cache.delete('key'))
+        self.assertFalse(self.cache.delete('key'))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expiry_and_touch(self):
+        table = self.cache.table
+        table.time_func = lambda: 1e12
+        try:
+            self.cache.set('key', 1, 10)
+            self.cache.set('forever', 1, None)
+            self.assertIsNone(self.cache.get('key'))
+            self.assertEqual(self.cache.get('forever'), 1)
+        finally:
+            table.time_func = time.time
+        self.cache.set('key', 1, 10)
+        self.assertTrue(self.cache.touch('key', 0))
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.touch('key'))
+
+    def test_incr(self):
+        self.cache.set('counter', 10)
+        self.assertEqual(self.cache.incr('counter', 5), 15)
+        self.assertEqual(self.cache.decr('counter'), 14)
+        self.assertEqual(self.cache.get('counter'), 14)
+        self.assertRaises(ValueError, self.cache.incr, 'missing')
+
+    def test_too_large_value(self):
+        cache = MmapCache(self.path + '-small', {'OPTIONS': {'SLOT_SIZE': 128}})
+        cache.set('key', 'small')
+        cache.set('key', 'x' * 200)
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(cache.add('key', 'x' * 200))
+
+    def test_clock_eviction(self):
+        cache = MmapCache(self.path + '-clock',
+                          {'OPTIONS': {'BUCKETS': 1, 'WAYS': 2}})
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+    def test_shared_between_processes(self):
+        self.cache.set('parent', 'value')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                cache = self.make_cache()
+                code = 0 if cache.get('parent') == 'value' else 1
+                cache.set('child', os.getpid())
+            except Exception:
+                code = 2
+            os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertEqual(self.cache.get('child'), pid)
+
+    def test_incompatible_file(self):
+        self.cache.set('key', 1)
+        cache = MmapCache(self.path, {'OPTIONS': {'WAYS': 4}})
+        self.assertRaises(ImproperlyConfigured, cache.get, 'key')
+
+    def test_calmcache_location(self):
+        from django.core.cache import caches
+        with self.settings(CACHES={
+                'default': {'BACKEND': 'calm_cache.backends.MmapCache',
+                            'LOCATION': self.path}}):
+            caches._settings = None
+            try:
+                calm = CalmCache('default', {'OPTIONS': {'MINT_PERIOD': 10}})
+                calm.set('key', 'value')
+                self.assertEqual(calm.get('key'), 'value')
+            finally:
+                del caches._settings
@@ -0,0 +1,109 @@
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from calm_cache.orm import (
+    cached_queryset, invalidate_model, invalidate_tables, model_tables,
+    table_version_key)
+from myapp.models import Article, Author, Review
+
+testcache = caches['testcache']
+
+
+class BrokenCache(LocMemCache):
+
+    def incr(self, key, delta=1, version=None):
+        raise ConnectionError('cache is down')
+
+
+class CachedQuerysetTest(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name='Ann')
+        self.article = Article.objects.create(title='One', author=self.author)
+
+    def tearDown(self):
+        cache.clear()
+        testcache.clear()
+
+    def assertQueries(self, count, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = func(*args, **kwargs)
+        self.assertEqual(len(queries), count)
+        return result
+
+    def test_cached(self):
+        qs = Article.objects.filter(author__name='Ann')
+        r = self.assertQueries(1, cached_queryset, qs, 60)
+        self.assertEqual(r, [self.article])
+        r = self.assertQueries(0, cached_queryset, qs, 60)
+        self.assertEqual(r, [self.article])
+        # Different params are cached separately
+        qs = Article.objects.filter(author__name='Bob')
+        self.assertEqual(self.assertQueries(1, cached_queryset, qs, 60), [])
+
+    def test_values(self):
+        qs = Article.objects.values_list('title', flat=True)
+        self.assertEqual(cached_queryset(qs, 60), ['One'])
+        self.assertEqual(self.assertQueries(0, cached_queryset, qs, 60),
+                         ['One'])
+
+    def test_empty(self):
+        qs = Article.objects.filter(pk__in=[])
+        self.assertEqual(self.assertQueries(0, cached_queryset, qs, 60), [])
+
+    def test_invalidate_on_save(self):
+        qs = Article.objects.filter(author__name='Ann').order_by('pk')
+        cached_queryset(qs, 60)
+        other = Article.objects.create(title='Two', author=self.author)
+        self.assertEqual(cached_queryset(qs, 60), [self.article, other])
+        # Joined table changes invalidate results too
+        self.author.name = 'Bob'
+        self.author.save()
+        self.assertEqual(cached_queryset(qs, 60), [])
+
+    def test_invalidate_on_delete(self):
+        qs = Article.objects.all()
+        cached_queryset(qs, 60)
+        self.article.delete()
+        self.assertEqual(cached_queryset(qs, 60), [])
+
+    def test_invalidate_parent(self):
+        self.assertEqual(model_tables(Review),
+                         ['myapp_article', 'myapp_review'])
+        qs = Article.objects.all()
+        cached_queryset(qs, 60)
+        review = Review.objects.create(title='Two', author=self.author)
+        self.assertEqual(len(cached_queryset(qs, 60)), 2)
+        review.rating = 5
+        review.save()
+        qs = Review.objects.all()
+        self.assertEqual(cached_queryset(qs, 60)[0].rating, 5)
+
+    def test_invalidate_model(self):
+        qs = Article.objects.all()
+        cached_queryset(qs, 60)
+        Article.objects.update(title='Updated')
+        # Bulk updates don't send signals
+        self.assertEqual(cached_queryset(qs, 60)[0].title, 'One')
+        invalidate_model(Article)
+        self.assertEqual(cached_queryset(qs, 60)[0].title, 'Updated')
+
+    def test_evicted_version(self):
+        qs = Article.objects.all()
+        cached_queryset(qs, 60)
+        cache.delete(table_version_key(cache, 'myapp_article'))
+        Article.objects.update(title='Updated')
+        time.sleep(0.002)
+        # New counter doesn't start from any previous version
+        self.assertEqual(cached_queryset(qs, 60)[0].title, 'Updated')
+
+    def test_backend_errors_logged(self):
+        broken = BrokenCache('orm-broken', {})
+        with self.assertLogs('calm_cache.orm', 'ERROR') as logs:
+            invalidate_tables(['myapp_article'], broken)
+        self.assertIn('myapp_article', logs.output[0])
@@ -0,0 +1,82 @@
+from django.test import TestCase
+from django.core.cache import cache, caches
+
+from calm_cache.refresh import Refresher
+
+testcache = caches['testcache']
+
+
+class RefresherTest(TestCase):
+
+    def setUp(self):
+        self._time_func = cache.time_func
+        self._rand_func = cache.rand_func
+        cache.time_func = lambda: 1
+        cache.rand_func = lambda x, y: 2
+        self.refresher = Refresher(interval=1, min_hits=2)
+        self.loads = 0
+
+    def tearDown(self):
+        self.refresher.close()
+        cache.time_func = self._time_func
+        cache.rand_func = self._rand_func
+        cache.clear()
+        testcache.clear()
+
+    def load(self):
+        self.loads += 1
+        return 'value-%d' % self.loads
+
+    def test_unpopular_key_not_refreshed(self):
+        self.refresher.register('r-key-1', self.load, 60)
+        cache.get('r-key-1')
+        self.assertEqual(self.refresher.run_once(), [])
+        self.assertEqual(self.loads, 0)
+
+    def test_popular_missing_key_loaded(self):
+        self.refresher.register('r-key-2', self.load, 60)
+        cache.get('r-key-2')
+        cache.get('r-key-2')
+        self.assertEqual(self.refresher.run_once(), ['r-key-2'])
+        self.assertEqual(cache.get('r-key-2'), 'value-1')
+        # Hits are counted from the last refresh
+        self.assertEqual(self.refresher.run_once(), [])
+
+    def test_refresh_before_refresh_time(self):
+        self.refresher.register('r-key-3', self.load, 60)
+        cache.set('r-key-3', 'initial', 60)
+        cache.get('r-key-3')
+        cache.get('r-key-3')
+        # Refresh time is 1 + 60 + 2 (jitter), lead time is 2 seconds
+        cache.time_func = lambda: 60
+        self.assertEqual(self.refresher.run_once(), [])
+        cache.time_func = lambda: 61
+        self.assertEqual(self.refresher.run_once(), ['r-key-3'])
+        self.assertEqual(testcache.get(cache.make_key('r-key-3')),
+                         ('value-1', 123, False))
+        # Mint period never starts for clients
+        cache.time_func = lambda: 64
+        self.assertEqual(cache.get('r-key-3'), 'value-1')
+
+    def test_failing_loader(self):
+        def loader():
+            raise ValueError()
+        self.refresher.register('r-key-4', loader, 60)
+        cache.get('r-key-4')
+        cache.get('r-key-4')
+        self.assertEqual(self.refresher.run_once(), [])
+        self.assertIsNone(cache.get('r-key-4'))
+
+    def test_loader_decorator(self):
+        @self.refresher.loader('r-key-5', 60)
+        def get_value():
+            return self.load()
+        self.assertEqual(get_value(), 'value-1')
+        self.assertEqual(get_value(), 'value-1')
+        self.assertEqual(self.loads, 1)
+        self.assertIn(('r-key-5', None), self.refresher.entries)
+
+    def test_get_refresh_time(self):
+        self.assertIsNone(cache.get_refresh_time('r-key-6'))
+        cache.set('r-key-6', 'v', 60)
+        self.assertEqual(cache.get_refresh_time('r-key-6'), 63)
@@ -0,0 +1,145 @@
+import os
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from calm_cache.replay import (
+    CacheRequest, Config, LogEntry, Simulator, map_requests, read_log,
+    replay)
+from calm_cache.sizes import format_size, parse_size
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+LOG = """\
+10.0.0.1 - - [10/Oct/2026:13:55:36 +0000] "GET /cached/ HTTP/1.1" 200 2326 "-" "curl/8"
+10.0.0.2 - - [10/Oct/2026:13:55:37 +0000] "GET /cached/?page=2 HTTP/1.1" 200 1000
+garbage
+10.0.0.3 - - [10/Oct/2026:13:55:38 +0000] "GET /missing/ HTTP/1.1" 404 -
+"""
+
+CSV = """\
+GET,foobar,/cached/,1791640536,200,100
+POST,foobar,/cached/,1791640537
+get,,/cached/,2026-10-10T13:55:38+00:00
+"""
+
+
+@override_settings(ROOT_URLCONF='myapp.urls')
+class ReplayTest(TestCase):
+
+    def test_read_log(self):
+        entries = list(read_log(LOG.splitlines(), host='foobar'))
+        self.assertEqual(entries, [
+            LogEntry(1791640536.0, 'GET', 'foobar', '/cached/', 200, 2326),
+            LogEntry(1791640537.0, 'GET', 'foobar', '/cached/?page=2', 200,
+                     1000),
+            LogEntry(1791640538.0, 'GET', 'foobar', '/missing/', 404, None),
+        ])
+
+    def test_read_csv(self):
+        entries = list(read_log(CSV.splitlines(), host='other'))
+        self.assertEqual(entries, [
+            LogEntry(1791640536.0, 'GET', 'foobar', '/cached/', 200, 100),
+            LogEntry(1791640537.0, 'POST', 'foobar', '/cached/', None, None),
+            LogEntry(1791640538.0, 'GET', 'other', '/cached/', None, None),
+        ])
+
+    def test_sizes(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('64k'), 65536)
+        self.assertEqual(parse_size('1.5M'), 1572864)
+        self.assertEqual(format_size(1572864), '1.5M')
+        self.assertEqual(format_size(100), '100')
+
+    def test_map_requests(self):
+        entries = list(read_log(LOG.splitlines(), host='foobar'))
+        entries.append(LogEntry(0, 'POST', 'foobar', '/cached/', 200, 1))
+        requests = list(map_requests(entries, default_size=5))
+        self.assertEqual(requests, [
+            CacheRequest(1791640536.0, 'myapp#GET#http#foobar#/cached/', 60,
+                         2326, True),
+            CacheRequest(1791640537.0,
+                         'myapp#GET#http#foobar#/cached/?page=2', 60, 1000,
+                         True),
+            CacheRequest(1791640538.0, None, None, 5, False),
+            CacheRequest(0, None, 60, 1, True),
+        ])
+
+    def test_simulator(self):
+        config = Config(capacity=1000, mint_period=10, grace_period=20,
+                        jitter=0)
+        simulator = Simulator(config, overhead=0)
+        for time in (0, 1, 61, 62, 80):
+            simulator.access(CacheRequest(time, 'a', 60, 100, True))
+        # Miss, hit, first in the mint period, refreshed, hit
+        report = simulator.report()
+        self.assertEqual((report['hits'], report['misses'],
+                          report['regenerations']), (3, 2, 2))
+        self.assertEqual(report['memory'], 101)
+        self.assertEqual(report['hit_ratio'], 0.6)
+
+    def test_simulator_regen_time(self):
+        config = Config(capacity=1000, mint_period=10, grace_period=20,
+                        jitter=0)
+        simulator = Simulator(config, regen_time=5, overhead=0)
+        for time in (0, 1, 6, 67, 68, 73, 100):
+            simulator.access(CacheRequest(time, 'a', 60, 100, True))
+        report = simulator.report()
+        # Regeneration started at 0 is still running at 1, the one
+        # started at 67 serves stale while it runs
+        self.assertEqual((report['hits'], report['stale_hits'],
+                          report['misses'], report['regenerations']),
+                         (3, 1, 3, 3))
+
+    def test_simulator_grace_and_eviction(self):
+        config = Config(capacity=250, mint_period=10, grace_period=20,
+                        jitter=0)
+        simulator = Simulator(config, overhead=0)
+        simulator.access(CacheRequest(0, 'a', 60, 100, True))
+        simulator.access(CacheRequest(0, 'b', 60, 100, True))
+        simulator.access(CacheRequest(0, 'c', 60, 100, True))
+        report = simulator.report()
+        self.assertEqual(report['evictions'], 1)
+        self.assertEqual(report['peak_entries'], 2)
+        # 'c' is served once stale in the grace period
+        simulator.access(CacheRequest(75, 'c', 60, 100, True))
+        simulator.access(CacheRequest(76, 'c', 60, 100, False))
+        simulator.access(CacheRequest(77, 'c', 60, 100, False))
+        report = simulator.report()
+        self.assertEqual(report['stale_hits'], 1)
+        self.assertEqual(report['regenerations'], 5)
+
+    def test_replay(self):
+        requests = [CacheRequest(t, 'k%d' % (t % 3), 60, 100, True)
+                    for t in range(30)]
+        results = replay(requests, [Config(1000, 0, 0, 0),
+                                    Config(200, 0, 0, 0)], overhead=0)
+        self.assertEqual(results[0][1]['misses'], 3)
+        self.assertEqual(results[1][1]['misses'], 30)
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(LOG)
+            out = StringIO()
+            call_command('replay_cache', path, host='foobar',
+                         capacity=['1M', '2K'], stdout=out)
+            lines = out.getvalue().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertTrue(lines[0].startswith(
+                'capacity=1M mint=10 grace=60 jitter=10: hit ratio 0.0%'))
+            self.assertIn('2 regenerations', lines[0])
+            self.assertIn('1 requests not cached', lines[0])
+            self.assertIn('peak memory 1.1K in 1 entries', lines[1])
+            self.assertRaises(CommandError, call_command, 'replay_cache',
+                              path + '.missing')
+        finally:
+            os.unlink(path)
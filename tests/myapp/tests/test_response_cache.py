@@ -14,6 +14,7 @@ from django.template.response import TemplateResponse
 from django.core.cache import caches
 
 from calm_cache.decorators import ResponseCache
+from calm_cache.decorators.response_cache import CachedStream
 
 try:
     from django.http import StreamingHttpResponse
@@ -391,3 +392,219 @@ class ResponseCacheTest(TestCase):
         self.assertEqual(decorated_view.__doc__, randomView.__doc__)
         self.assertEqual(decorated_view.__module__, randomView.__module__)
         self.assertEqual(decorated_view.__name__, randomView.__name__)
+
+    def test_negative_codes(self):
+        def notFoundView(request):
+            return HttpResponse(str(uuid4()), status=404)
+        key_func = lambda r: 'negative#%s' % r.path
+        # Not cached by default
+        decorated_view = ResponseCache(60, cache='testcache',
+                                       key_func=key_func)(notFoundView)
+        request = self.random_get()
+        self.assertNotEqual(decorated_view(request).content,
+                            decorated_view(request).content)
+        # Cached with its own timeout
+        decorated_view = ResponseCache(
+            60, cache='testcache', key_func=key_func, negative_codes=(404, ),
+            negative_timeout=5)(notFoundView)
+        rsp1 = decorated_view(request)
+        rsp2 = decorated_view(request)
+        self.assertEqual(rsp1.content, rsp2.content)
+        self.assertEqual(rsp2.status_code, 404)
+        testcache = caches['testcache']
+        key = testcache.make_key(key_func(request))
+        self.assertAlmostEqual(testcache._expire_info[key] - time.time(), 5,
+                               delta=1)
+
+    def test_collapse_first_miss_renders(self):
+        rsp_cache = ResponseCache(60, cache='testcache', collapse=True)
+        decorated_view = rsp_cache(randomView)
+        request = self.random_get()
+        cache_key = rsp_cache.key_func(request)
+        rsp1 = decorated_view(request)
+        # The lock is released after storing the response
+        self.assertIsNone(caches['testcache'].get(rsp_cache.lock_key(cache_key)))
+        self.assertEqual(decorated_view(request).content, rsp1.content)
+
+    def test_collapse_waits_for_other_request(self):
+        rsp_cache = ResponseCache(60, cache='testcache', collapse=True)
+        decorated_view = rsp_cache(randomView)
+        request = self.random_get()
+        cache_key = rsp_cache.key_func(request)
+        # Another worker is rendering the response
+        self.assertTrue(rsp_cache.acquire(cache_key))
+        other = HttpResponse('rendered elsewhere')
+        sleeps = []
+
+        def sleep(delay):
+            sleeps.append(delay)
+            if len(sleeps) == 3:
+                caches['testcache'].set(cache_key, other)
+        rsp_cache.sleep_func = sleep
+        self.assertEqual(decorated_view(request).content, b'rendered elsewhere')
+        self.assertEqual(sleeps, [0.05, 0.1, 0.2])
+
+    def test_collapse_wait_timeout(self):
+        rsp_cache = ResponseCache(60, cache='testcache', collapse=True,
+                                  collapse_wait=1)
+        decorated_view = rsp_cache(randomView)
+        request = self.random_get()
+        cache_key = rsp_cache.key_func(request)
+        rsp_cache.acquire(cache_key)
+        now = [100.0]
+        sleeps = []
+
+        def sleep(delay):
+            sleeps.append(delay)
+            now[0] += delay
+        rsp_cache.time_func = lambda: now[0]
+        rsp_cache.sleep_func = sleep
+        # Renders itself after waiting, but doesn't release others' lock
+        response = decorated_view(request)
+        self.assertEqual(sleeps, [0.05, 0.1, 0.2, 0.4, 0.25])
+        self.assertEqual(caches['testcache'].get(cache_key).content,
+                         response.content)
+        self.assertEqual(caches['testcache'].get(rsp_cache.lock_key(cache_key)),
+                         1)
+
+    def test_collapse_lock_timeout(self):
+        # default cache is CalmCache with mint and grace periods and jitter
+        rsp_cache = ResponseCache(60, collapse=True, collapse_timeout=10)
+        cache_key = rsp_cache.key_func(self.random_get())
+        self.assertTrue(rsp_cache.acquire(cache_key))
+        self.assertFalse(rsp_cache.acquire(cache_key))
+        testcache = caches['testcache']
+        key = testcache.make_key(
+            caches['default'].make_key(rsp_cache.lock_key(cache_key)))
+        self.assertIn(key, testcache._cache)
+        self.assertAlmostEqual(testcache._expire_info[key] - time.time(), 10,
+                               delta=1)
+        rsp_cache.release(cache_key)
+        self.assertTrue(rsp_cache.acquire(cache_key))
+        rsp_cache.release(cache_key)
+
+    def test_collapse_releases_lock_on_error(self):
+        def brokenView(request):
+            raise RuntimeError()
+        rsp_cache = ResponseCache(60, cache='testcache', collapse=True)
+        request = self.random_get()
+        self.assertRaises(RuntimeError, rsp_cache(brokenView), request)
+        self.assertTrue(rsp_cache.acquire(rsp_cache.key_func(request)))
+
+    def test_caching_streaming_response(self):
+        def streamingView(request):
+            response = StreamingHttpResponse(
+                (('%s\n' % uuid4()) for _ in range(3)),
+                content_type='text/csv')
+            response['X-Export'] = 'yes'
+            return response
+        rsp_cache = ResponseCache(60, cache='testcache', cache_streaming=True)
+        decorated_view = rsp_cache(streamingView)
+        request = self.random_get()
+        rsp1 = decorated_view(request)
+        self.assertEqual(rsp1['X-Cache'], 'Miss')
+        # Nothing is stored until the content is consumed
+        self.assertIsNone(caches['testcache'].get(rsp_cache.key_func(request)))
+        content = b''.join(rsp1.streaming_content)
+        cached = caches['testcache'].get(rsp_cache.key_func(request))
+        self.assertIsInstance(cached, CachedStream)
+        rsp2 = decorated_view(request)
+        self.assertTrue(rsp2.streaming)
+        self.assertEqual(b''.join(rsp2.streaming_content), content)
+        self.assertEqual(rsp2['X-Cache'], 'Hit')
+        self.assertEqual(rsp2['X-Export'], 'yes')
+        self.assertEqual(rsp2['Content-Type'], 'text/csv')
+
+    def test_streaming_response_not_completed_or_too_large(self):
+        def streamingView(request):
+            return StreamingHttpResponse(b'x' * 10 for _ in range(3))
+        rsp_cache = ResponseCache(60, cache='testcache', cache_streaming=True,
+                                  streaming_max_size=25)
+        decorated_view = rsp_cache(streamingView)
+        request = self.random_get()
+        # Too large
+        self.assertEqual(len(b''.join(decorated_view(request))), 30)
+        self.assertIsNone(caches['testcache'].get(rsp_cache.key_func(request)))
+        # Client disconnected
+        rsp_cache.streaming_max_size = 100
+        response = decorated_view(request)
+        next(response.streaming_content)
+        response.close()
+        self.assertIsNone(caches['testcache'].get(rsp_cache.key_func(request)))
+
+    def test_collapse_streaming_response(self):
+        def streamingView(request):
+            return StreamingHttpResponse(b'x' * 10 for _ in range(3))
+        rsp_cache = ResponseCache(60, cache='testcache', cache_streaming=True,
+                                  collapse=True)
+        decorated_view = rsp_cache(streamingView)
+        request = self.random_get()
+        lock_key = rsp_cache.lock_key(rsp_cache.key_func(request))
+        response = decorated_view(request)
+        # The lock is held until the content is stored
+        self.assertEqual(caches['testcache'].get(lock_key), 1)
+        b''.join(response.streaming_content)
+        self.assertIsNone(caches['testcache'].get(lock_key))
+        self.assertIsInstance(
+            caches['testcache'].get(rsp_cache.key_func(request)), CachedStream)
+        # Released when the client disconnects
+        request = self.random_get()
+        lock_key = rsp_cache.lock_key(rsp_cache.key_func(request))
+        response = decorated_view(request)
+        next(response.streaming_content)
+        self.assertEqual(caches['testcache'].get(lock_key), 1)
+        response.close()
+        self.assertIsNone(caches['testcache'].get(lock_key))
+
+    def test_cache_control(self):
+        # default cache is CalmCache with MINT_PERIOD 10 and GRACE_PERIOD 60
+        rsp_cache = ResponseCache(60, cache_control=True)
+        decorated_view = rsp_cache(randomView)
+        response = decorated_view(self.random_get())
+        directives = set(response['Cache-Control'].split(', '))
+        self.assertEqual(directives, set(['s-maxage=60',
+                                          'stale-while-revalidate=10',
+                                          'stale-if-error=70']))
+        # Served from the cache with the same headers
+        request = self.random_get()
+        decorated_view(request)
+        self.assertEqual(decorated_view(request)['X-Cache'], 'Hit')
+        self.assertIn('s-maxage=60', decorated_view(request)['Cache-Control'])
+        # Plain backend has no stale periods
+        rsp_cache = ResponseCache(30, cache='testcache', cache_control=True,
+                                  negative_codes=(404, ),
+                                  negative_timeout=5)
+        response = rsp_cache(randomView)(self.random_get())
+        self.assertEqual(response['Cache-Control'], 's-maxage=30')
+        response = rsp_cache(lambda r: HttpResponse(status=404))(
+            self.random_get())
+        self.assertEqual(response['Cache-Control'], 's-maxage=5')
+        # Private responses are left alone
+        response = rsp_cache(randomView)(
+            self.random_get(), headers={'Cache-Control': 'private'})
+        self.assertEqual(response['Cache-Control'], 'private')
+        # Not stored responses are left alone
+        response = rsp_cache(randomView)(
+            self.random_get(), headers={'Set-Cookie': 'a=b'})
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_surrogate_keys(self):
+        def taggedView(request):
+            response = randomView(request)
+            response.surrogate_keys = ['article-1', 'author-2']
+            return response
+        rsp_cache = ResponseCache(60, cache='testcache',
+                                  surrogate_keys=('articles', ))
+        request = self.random_get()
+        response = rsp_cache(taggedView)(request)
+        self.assertEqual(response['Surrogate-Key'],
+                         'articles article-1 author-2')
+        self.assertEqual(rsp_cache(taggedView)(request)['Surrogate-Key'],
+                         'articles article-1 author-2')
+        rsp_cache = ResponseCache(
+            60, cache='testcache', surrogate_key_header='Cache-Tag',
+            surrogate_keys=lambda request, response: [request.path[1:]])
+        request = self.random_get()
+        response = rsp_cache(randomView)(request)
+        self.assertEqual(response['Cache-Tag'], request.path[1:])
+        self.assertFalse(response.has_header('Surrogate-Key'))
@@ -0,0 +1,144 @@
+from functools import partial
+
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from calm_cache.backends import CalmCache
+from calm_cache.decorators import ResponseCache
+from calm_cache.sizes import (
+    SizeAccounting, max_entry_size, record_sizes, serialize, view_sizes)
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+testcache = caches['testcache']
+
+
+def bigView(request):
+    return HttpResponse('x' * int(request.GET.get('size', 100)))
+
+
+class BigView(object):
+
+    def __call__(self, request):
+        return bigView(request)
+
+
+class SizesTest(TestCase):
+
+    def tearDown(self):
+        cache.clear()
+        testcache.clear()
+        view_sizes.clear()
+
+    def test_accounting(self):
+        sizes = SizeAccounting()
+        sizes.record('a', 'a:1', b'x' * 100)
+        sizes.record('a', 'a:2', b'x' * 300)
+        sizes.reject('a', 'a:3', 1000)
+        stats = sizes.stats('a')
+        self.assertEqual(stats['writes'], 2)
+        self.assertEqual(stats['bytes'], 400)
+        self.assertEqual(stats['average_bytes'], 200)
+        self.assertEqual((stats['max_bytes'], stats['max_key']), (300, 'a:2'))
+        self.assertTrue(stats['compressed_bytes'] < 100)
+        self.assertEqual((stats['rejected'], stats['rejected_bytes']),
+                         (1, 1000))
+        self.assertEqual(list(sizes.stats()), ['a'])
+        self.assertIsNone(sizes.stats('b'))
+
+    def test_groups_bounded(self):
+        sizes = SizeAccounting()
+        sizes.max_groups = 2
+        for group in ('a', 'b', 'c', 'd'):
+            sizes.record(group, '%s:1' % group, b'x')
+        sizes.reject('e', 'e:1', 10)
+        self.assertEqual(sorted(sizes.stats()), ['*', 'a', 'b'])
+        self.assertEqual(sizes.stats('*')['writes'], 2)
+        self.assertEqual(sizes.stats('*')['rejected'], 1)
+
+    def test_max_entry_size(self):
+        self.assertIsNone(max_entry_size(None, 'a'))
+        self.assertEqual(max_entry_size(10, 'a'), 10)
+        self.assertEqual(max_entry_size({'a': 10, '*': 20}, 'a'), 10)
+        self.assertEqual(max_entry_size({'a': 10, '*': 20}, 'b'), 20)
+        self.assertIsNone(max_entry_size({'a': 10}, 'b'))
+        self.assertEqual(max_entry_size('1M', 'a'), 1024 * 1024)
+        self.assertEqual(max_entry_size({'a': '64K'}, 'a'), 64 * 1024)
+
+    def test_calmcache(self):
+        calm = CalmCache('testcache', {
+            'KEY_PREFIX': self._testMethodName,
+            'OPTIONS': {'SIZE_ACCOUNTING': True,
+                        'MAX_ENTRY_SIZE': {'page': 200, '*': 1000}},
+        })
+        calm.set('page:1', 'x' * 100)
+        calm.set('user:1', 'x' * 500)
+        stats = calm.size_stats('page')
+        self.assertEqual(stats['writes'], 1)
+        self.assertEqual(stats['bytes'], len(serialize('x' * 100)))
+        # Oversized values are not stored and old ones are removed
+        calm.set('page:1', 'x' * 300)
+        self.assertIsNone(calm.get('page:1'))
+        self.assertFalse(calm.add('page:2', 'x' * 300))
+        self.assertEqual(calm.size_stats('page')['rejected'], 2)
+        calm.set('#GET#http#host#/a', 'x')
+        calm.set('#GET#http#host#/b', 'x')
+        # Keys without a prefix are recorded together
+        self.assertEqual(sorted(calm.size_stats()), ['*', 'page', 'user'])
+        self.assertEqual(calm.size_stats('*')['writes'], 2)
+
+    def test_calmcache_disabled(self):
+        cache.set('page:1', 'x' * 100)
+        self.assertEqual(cache.size_stats(), {})
+        with record_sizes():
+            cache.set('page:1', 'x' * 100)
+        self.assertEqual(cache.size_stats('page')['writes'], 1)
+        cache.sizes.clear()
+
+    def test_response_cache(self):
+        rsp_cache = ResponseCache(60, cache='testcache', size_accounting=True,
+                                  max_entry_size=1000)
+        decorated_view = rsp_cache(bigView)
+        factory = RequestFactory()
+        decorated_view(factory.get('/?size=100'))
+        request = factory.get('/?size=2000')
+        self.assertEqual(decorated_view(request)['X-Cache'], 'Miss')
+        self.assertEqual(decorated_view(request)['X-Cache'], 'Miss')
+        stats = rsp_cache.size_stats()
+        self.assertEqual(list(view_sizes.stats()),
+                         ['%s.bigView' % __name__])
+        self.assertEqual(stats['writes'], 1)
+        self.assertEqual(stats['rejected'], 2)
+
+    def test_view_names(self):
+        request = RequestFactory().get('/?size=10')
+        for view, name in ((partial(bigView), 'bigView'),
+                           (BigView(), 'BigView')):
+            rsp_cache = ResponseCache(60, cache='testcache')
+            self.assertEqual(rsp_cache(view)(request).content, b'x' * 10)
+            self.assertEqual(rsp_cache.view_name,
+                             '%s.%s' % (__name__, name))
+
+    @override_settings(ROOT_URLCONF='myapp.urls')
+    def test_command(self):
+        out = StringIO()
+        call_command('cache_sizes', '/cached/', '/missing/', host='foobar',
+                     stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith(
+            'View myapp.views.cached_view: 1 writes'))
+        # Responses already in the cache are measured too
+        view_sizes.clear()
+        call_command('cache_sizes', '/cached/', host='foobar', stdout=out)
+        self.assertEqual(view_sizes.stats('myapp.views.cached_view')['writes'],
+                         1)
+        self.assertRaises(CommandError, call_command, 'cache_sizes')
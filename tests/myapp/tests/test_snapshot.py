@@ -0,0 +1,127 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+from calm_cache.backends import CalmCache
+from calm_cache.snapshot import dump_snapshot, load_snapshot, read_snapshot
+
+
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def locmem(self, suffix='', max_entries=300):
+        return LocMemCache('snapshot-%s%s' % (self._testMethodName, suffix),
+                           {'OPTIONS': {'MAX_ENTRIES': max_entries}})
+
+    def test_dump_and_load(self):
+        cache = self.locmem()
+        for i in range(5):
+            cache.set('key-%d' % i, i)
+        cache.set('forever', 'value', None)
+        cache.get('key-0')
+        self.assertEqual(dump_snapshot(cache, self.path, size=3), 3)
+        keys = [e[0] for e in read_snapshot(self.path)]
+        # The most recently used go first
+        self.assertEqual(keys, [':1:key-0', ':1:forever', ':1:key-4'])
+
+        other = self.locmem('-other')
+        other.set('key-4', 'newer')
+        self.assertEqual(load_snapshot(other, self.path), 2)
+        self.assertEqual(list(other._cache),
+                         [':1:key-0', ':1:forever', ':1:key-4'])
+        self.assertEqual(other.get('key-0'), 0)
+        self.assertEqual(other.get('forever'), 'value')
+        self.assertEqual(other.get('key-4'), 'newer')
+
+    def test_skip_expired_and_stale(self):
+        cache = self.locmem()
+        cache.set('expired', 1, 10)
+        cache.set('stale', 2, 1000)
+        cache.set('fresh', 3, 1000)
+        now = cache._expire_info[':1:expired']
+        refresh = {2: now - 1, 3: now + 100}
+        dump_snapshot(cache, self.path,
+                      refresh_time=lambda p: refresh.get(pickle.loads(p), 0))
+        self.assertEqual([e[0] for e in read_snapshot(self.path, now=now)],
+                         [':1:fresh'])
+
+    def test_max_entries(self):
+        cache = self.locmem()
+        for i in range(5):
+            cache.set('key-%d' % i, i)
+        dump_snapshot(cache, self.path)
+        other = self.locmem('-other', max_entries=2)
+        self.assertEqual(load_snapshot(other, self.path), 2)
+        self.assertEqual(other.get('key-4'), 4)
+        self.assertEqual(other.get('key-3'), 3)
+
+    def test_missing_or_broken_snapshot(self):
+        cache = self.locmem()
+        self.assertEqual(load_snapshot(cache, self.path), 0)
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        self.assertEqual(load_snapshot(cache, self.path), 0)
+        cache.set('key-1', 1)
+        cache.set('key-2', 2)
+        dump_snapshot(cache, self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:-3])
+        self.assertEqual([e[0] for e in read_snapshot(self.path)],
+                         [':1:key-2'])
+        self.assertRaises(ImproperlyConfigured, dump_snapshot,
+                          caches['default'], self.path)
+
+    def test_calmcache_snapshot(self):
+        params = {'KEY_PREFIX': self._testMethodName, 'OPTIONS': {
+            'MINT_PERIOD': 10, 'SNAPSHOT_PATH': self.path}}
+        cache = CalmCache('testcache', params)
+        self.assertEqual(cache.shared['snapshot_loaded'], 0)
+        cache.set('fresh', 'value', 100)
+        # Refresh time of this one is long gone
+        cache.time_func = lambda: 1
+        cache.set('stale', 'value', 100)
+        self.assertEqual(cache.dump_snapshot(), 2)
+        caches['testcache'].clear()
+
+        # A new process with the same configuration
+        params['OPTIONS']['SNAPSHOT_SIZE'] = 10
+        cache = CalmCache('testcache', params)
+        self.assertEqual(cache.shared['snapshot_loaded'], 1)
+        self.assertEqual(cache.get('fresh'), 'value')
+        self.assertIsNone(cache.get('stale'))
+
+    def test_calmcache_snapshot_unpacked_values(self):
+        params = {'KEY_PREFIX': self._testMethodName, 'OPTIONS': {
+            'MINT_PERIOD': 10, 'SNAPSHOT_PATH': self.path}}
+        caches['testcache'].clear()
+        cache = CalmCache('testcache', params)
+        cache.set('fresh', 'value', 100)
+        cache.set('__counter__:hits', 1)
+        cache.incr('__counter__:hits')
+        caches['testcache'].set('raw', 'value')
+        self.assertEqual(cache.dump_snapshot(), 3)
+        caches['testcache'].clear()
+
+        params['OPTIONS']['SNAPSHOT_SIZE'] = 10
+        cache = CalmCache('testcache', params)
+        self.assertEqual(cache.get('__counter__:hits'), 2)
+        self.assertEqual(cache.get('fresh'), 'value')
+
+    def test_calmcache_single_location(self):
+        self.assertRaises(ImproperlyConfigured, CalmCache,
+                          ['testshard-a', 'testshard-b'],
+                          {'OPTIONS': {'SNAPSHOT_PATH': self.path}})
@@ -0,0 +1,100 @@
+from django.core.cache import cache, caches
+from django.template import Context, Template, TemplateSyntaxError
+from django.test import TestCase
+
+from calm_cache.templatetags.calm_cache import make_fragment_key
+
+testcache = caches['testcache']
+
+
+class CountingGets(object):
+    """
+    Counts `get()` and `get_many()` calls of the default cache
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __enter__(self):
+        self.get = cache.get
+        self.get_many = cache.get_many
+        cache.get = self.wrap('get', cache.get)
+        cache.get_many = self.wrap('get_many', cache.get_many)
+        return self
+
+    def __exit__(self, *exc_info):
+        del cache.get
+        del cache.get_many
+
+    def wrap(self, name, method):
+        def wrapper(*args, **kwargs):
+            self.calls.append(name)
+            return method(*args, **kwargs)
+        return wrapper
+
+
+class CalmCacheTagTest(TestCase):
+
+    def setUp(self):
+        self._time_func = cache.time_func
+        self._rand_func = cache.rand_func
+        cache.time_func = lambda: 1
+        cache.rand_func = lambda x, y: y
+
+    def tearDown(self):
+        cache.time_func = self._time_func
+        cache.rand_func = self._rand_func
+        cache.clear()
+        testcache.clear()
+
+    def render(self, source, **context):
+        return Template('{% load calm_cache %}' + source).render(
+            Context(context))
+
+    def test_fragment(self):
+        source = '{% calmcache 60 frag name %}{{ value }}{% endcalmcache %}'
+        self.assertEqual(self.render(source, name='a', value=1), '1')
+        self.assertEqual(self.render(source, name='a', value=2), '1')
+        self.assertEqual(self.render(source, name='b', value=3), '3')
+        self.assertEqual(cache.get(make_fragment_key('frag', ['a'])), '1')
+
+    def test_mint_period(self):
+        source = '{% calmcache 60 frag %}{{ value }}{% endcalmcache %}'
+        self.render(source, value=1)
+        # The first request in the mint period renders the fragment again
+        cache.time_func = lambda: 75
+        self.assertEqual(self.render(source, value=2), '2')
+        self.assertEqual(self.render(source, value=3), '2')
+
+    def test_jitter(self):
+        source = ('{% calmcache 60 frag jitter=0 %}{{ value }}'
+                  '{% endcalmcache %}')
+        self.render(source, value=1)
+        r = testcache.get(cache.make_key(make_fragment_key('frag')))
+        self.assertEqual(r, ('1', 61, False))
+
+    def test_using(self):
+        source = ('{% calmcache 60 frag using="testcache" %}{{ value }}'
+                  '{% endcalmcache %}')
+        self.render(source, value=1)
+        self.assertEqual(testcache.get(make_fragment_key('frag')), '1')
+
+    def test_bad_timeout(self):
+        source = '{% calmcache "soon" frag %}{% endcalmcache %}'
+        self.assertRaises(TemplateSyntaxError, self.render, source)
+
+    def test_prefetch(self):
+        source = (
+            '{% calmcache_prefetch %}'
+            '{% calmcache 60 a %}{{ value }}{% endcalmcache %}'
+            '{% if True %}{% calmcache 60 b x %}{{ value }}'
+            '{% endcalmcache %}{% endif %}'
+            '{% for i in items %}{% calmcache 60 c i %}{{ value }}'
+            '{% endcalmcache %}{% endfor %}'
+            '{% endcalmcache_prefetch %}')
+        self.assertEqual(self.render(source, value=1, x=1, items=[1]), '111')
+        with CountingGets() as counter:
+            r = self.render(source, value=2, x=1, items=[1])
+        self.assertEqual(r, '111')
+        # Fragments inside the loop are fetched one by one
+        self.assertEqual(counter.calls, ['get_many', 'get'])
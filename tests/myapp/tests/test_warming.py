@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from calm_cache.warming import RateLimiter, read_sitemap, warm_urls
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+SITEMAP = """<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>http://foobar/cached/</loc></url>
+  <url><loc> https://foobar/cached/?page=2 </loc></url>
+</urlset>
+"""
+
+
+@override_settings(ROOT_URLCONF='myapp.urls')
+class WarmingTest(TestCase):
+
+    def setUp(self):
+        caches['testcache'].clear()
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(2)
+        now = [100.0]
+        sleeps = []
+        limiter.time_func = lambda: now[0]
+        limiter.sleep_func = sleeps.append
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual(sleeps, [0.5, 1.0])
+
+    def test_rate_limiter_disabled(self):
+        limiter = RateLimiter(0)
+        limiter.sleep_func = lambda s: self.fail("Should not sleep")
+        limiter.wait()
+        limiter.wait()
+
+    def test_read_sitemap(self):
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        with os.fdopen(fd, 'w') as f:
+            f.write(SITEMAP)
+        try:
+            self.assertEqual(read_sitemap(path),
+                             ['http://foobar/cached/',
+                              'https://foobar/cached/?page=2'])
+        finally:
+            os.unlink(path)
+
+    def test_warm_urls_populates_cache(self):
+        results = warm_urls(['/cached/', 'https://foobar/cached/?p=1'],
+                            workers=2)
+        self.assertEqual(sorted(results), [
+            ('/cached/', 200, 'Miss'),
+            ('https://foobar/cached/?p=1', 200, 'Miss'),
+        ])
+        testcache = caches['testcache']
+        # Keys should be the same as for the real traffic
+        self.assertIsNotNone(testcache.get('myapp#GET#http#foobar#/cached/'))
+        self.assertIsNotNone(
+            testcache.get('myapp#GET#https#foobar#/cached/?p=1'))
+        # Second round should be served from the cache
+        self.assertEqual(warm_urls(['/cached/']), [('/cached/', 200, 'Hit')])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('warm_cache', '/cached/', '/missing/', host='foobar',
+                     verbosity=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('/cached/ 200 Miss', output)
+        self.assertIn('/missing/ 404 None', output)
+        self.assertIn('Warmed 2 URLs, 0 failed', output)
+
+    def test_command_no_urls(self):
+        self.assertRaises(CommandError, call_command, 'warm_cache')
@@ -1 +1,10 @@
-# Create your views here.
+from uuid import uuid4
+
+from django.http import HttpResponse
+
+from calm_cache.decorators import cache_response
+
+
+@cache_response(60, cache='testcache', key_prefix='myapp')
+def cached_view(request):
+    return HttpResponse(str(uuid4()))
@@ -15,12 +15,17 @@ INSTALLED_APPS = (
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.sites',
+    'calm_cache',
     'myapp',
     # 'your.app.goes.here',
 )
 
 SITE_ID = 1
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+CCORM_SIGNALS = True
+
 CACHES = {
     'default': {
         'BACKEND': 'calm_cache.backends.CalmCache',
@@ -34,7 +39,19 @@ CACHES = {
     'testcache': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'we-are-all-individuals',
-    }
+    },
+    'testshard-a': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shard-a',
+    },
+    'testshard-b': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shard-b',
+    },
+    'testshard-c': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shard-c',
+    },
 }
 TEMPLATES = [
     {